@@ -15,13 +15,16 @@ allows the user to override this automatic detection.
 The :func:`read_data_list` function is very similar to :func:`read_data` except that it allows the user to specify
 more than one variable name. This function returns a list of data objects, either all of which will be gridded, or all
 ungridded, but not a mix. For ungridded data lists it is assumed that all objects share the same coordinates.
+
+The :func:`aggregate_files` function aggregates ungridded data in many files onto a grid one file at a time, so that
+datasets much larger than the available memory can be aggregated.
 """
 __author__ = "David Michel, Daniel Wallis, Duncan Watson-Parris, Richard Wilkinson, Ian Bush, Matt Kendall, John Holt"
 __version__ = "1.7.9"
 __status__ = "Stable"
 __website__ = "http://www.cistools.net/"
 
-__all__ = ['read_data', 'read_data_list', 'get_variables']
+__all__ = ['read_data', 'read_data_list', 'get_variables', 'aggregate_files']
 
 
 def read_data(filenames, variable, product=None):
@@ -92,3 +95,40 @@ def get_variables(filenames, product=None, type=None):
     if len(file_set) == 0:
         raise IOError("No files found which match: {}".format(filenames))
     return get_variables(file_set, product=product, data_type=type)
+
+
+def aggregate_files(filenames, variables, how='', product=None, processes=None, **kwargs):
+    """
+    Aggregate ungridded data from many files onto a grid without reading all of the data at once. Each file is binned
+    separately (in parallel worker processes) and the statistics of each grid cell are then combined, giving the same
+    result as reading all of the files and calling :meth:`UngriddedData.aggregate`.
+
+    The grid is defined by passing keyword arguments for each dimension, as for :meth:`UngriddedData.aggregate`, except
+    that the start and end of each grid must be given. Only kernels which can be combined in this way (moments, mean,
+    stddev, min, max, sum and approximate percentiles) can be used.
+
+    For example:
+        aggregate_files('granules/*.hdf', 'AOD550', x=[-180, 180, 1], y=[-90, 90, 1], processes=4)
+
+    :param filenames:   The filenames of the files to read. This can be either a single filename as a string, a comma
+     separated list, or a :class:`list` of string filenames. Filenames can include directories which will be expanded to
+     include all files in that directory, or wildcards such as ``*`` or ``?``.
+    :type filenames: string or list
+    :param variables: One or more variables to aggregate
+    :type variables: string or list
+    :param str how: The kernel to use in the aggregation (moments, mean, min, etc...). Default is moments
+    :param str product: The name of the data reading plugin to use to read the data (e.g. ``Cloud_CCI_L2``).
+    :param int processes: The number of worker processes to use, defaults to the number of CPUs
+    :param kwargs: The grid specifications for each coordinate dimension
+    :return: A :class:`GriddedDataList` of the aggregated data
+    """
+    from cis.data_io.data_reader import expand_filelist
+    from cis.data_io.ungridded_data import _aggregate_ungridded_files
+
+    try:
+        file_set = expand_filelist(filenames)
+    except ValueError as e:
+        raise IOError(e)
+    if len(file_set) == 0:
+        raise IOError("No files found which match: {}".format(filenames))
+    return _aggregate_ungridded_files(file_set, variables, how, product, processes, **kwargs)
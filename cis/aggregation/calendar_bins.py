@@ -0,0 +1,180 @@
+"""
+Calendar aware binning of time for aggregation. Time can be aggregated into consecutive calendar periods (months,
+seasons or years) which, having uneven lengths, can't be given as a fixed grid step; or into the bins of a repeating
+calendar cycle (the months, seasons or days of the year, or the hours of the day) to make a climatology or diurnal
+cycle in a single aggregation.
+
+The bins are found using integer arithmetic on numpy datetime64 arrays, so the gregorian (or proleptic gregorian)
+calendar is required.
+"""
+import numpy as np
+import six
+from iris.coords import DimCoord
+
+# The calendars which numpy datetime64 arithmetic is valid for (for dates after 1582)
+_CALENDARS = ('gregorian', 'standard', 'proleptic_gregorian')
+
+_EPOCH = np.datetime64('1970-01-01T00:00:00', 'us')
+
+# The length (in months) and start (in months after January) of each consecutive calendar period
+_PERIODS = {'month': (1, 0),
+            'season': (3, -1),
+            'year': (12, 0)}
+
+# The datetime64 unit of each bin, the unit of the cycle, the length of each bin, the start of the first bin (after the
+# start of the cycle, in bin units) and the number of bins in each cycle
+_CYCLES = {'month_of_year': ('M', 'Y', 1, 0, 12),
+           'season_of_year': ('M', 'Y', 3, -1, 4),
+           'day_of_year': ('D', 'Y', 1, 0, 366),
+           'hour_of_day': ('h', 'D', 1, 0, 24)}
+
+CALENDAR_BINS = tuple(sorted(_PERIODS)) + tuple(sorted(_CYCLES))
+
+
+def is_calendar_bin(step):
+    """
+    :param step: A grid step
+    :return bool: True if the step is the name of a calendar period or cycle
+    """
+    return isinstance(step, six.string_types) and step.lower() in CALENDAR_BINS
+
+
+def _days_since_epoch_unit(units):
+    from cf_units import Unit
+    if not units.is_time_reference() or units.calendar not in _CALENDARS:
+        raise ValueError("Calendar binning is only possible for times in the gregorian calendar, not '{}'"
+                         .format(units))
+    return Unit('days since 1970-01-01 00:00:00', calendar=units.calendar)
+
+
+def to_datetime64(values, units):
+    """
+    Convert times to numpy datetime64 (with microsecond resolution) without going via datetime objects.
+
+    :param values: The times
+    :param cf_units.Unit units: The units of the times
+    :return ndarray: The datetime64 times
+    """
+    days = units.convert(np.asarray(values, dtype=float), _days_since_epoch_unit(units))
+    return _EPOCH + np.round(np.asarray(days) * 86400e6).astype(np.int64).astype('timedelta64[us]')
+
+
+def from_datetime64(times, units):
+    """
+    Convert numpy datetime64 times to the given units.
+
+    :param ndarray times: The datetime64 times
+    :param cf_units.Unit units: The units to convert to
+    :return ndarray: The times
+    """
+    days = (np.asarray(times).astype('datetime64[us]') - _EPOCH) / np.timedelta64(1, 'D')
+    return _days_since_epoch_unit(units).convert(days, units)
+
+
+def _months(times):
+    """
+    :return: The number of the month of each time, counted from January 1970
+    """
+    return times.astype('datetime64[M]').astype(np.int64)
+
+
+def make_period_coord(start, end, period, units, **kwargs):
+    """
+    Make a coordinate whose cells are the consecutive calendar periods covering a time range. The cell bounds are
+    irregular, so the data is binned into them by searching.
+
+    :param float start: The start of the range, in the given units
+    :param float end: The end of the range, in the given units
+    :param str period: The calendar period: month, season (DJF, MAM, JJA and SON) or year
+    :param cf_units.Unit units: The units of the times
+    :param kwargs: Other arguments for the coordinate
+    :return DimCoord: The coordinate, with points at the middle of each period
+    """
+    length, first = _PERIODS[period.lower()]
+    start_month, end_month = _months(to_datetime64([start, end], units))
+    if from_datetime64(np.datetime64(int(end_month), 'M'), units) < end:
+        # The end is part way through a month
+        end_month += 1
+    start_month -= (start_month - first) % length
+    end_month += (first - end_month) % length
+    edges = from_datetime64(np.arange(start_month, max(end_month, start_month + length) + 1, length)
+                            .astype('datetime64[M]'), units)
+    bounds = np.column_stack((edges[:-1], edges[1:]))
+    return DimCoord(bounds.mean(axis=1), units=units, bounds=bounds, **kwargs)
+
+
+def _cycle_starts(times, cycle):
+    """
+    :return: The start of the first bin of the cycle which each (datetime64) time lies in, in the units of the bins
+    """
+    bin_unit, cycle_unit, length, first, num_bins = _CYCLES[cycle]
+    times = times.astype('datetime64[{}]'.format(bin_unit)) - first
+    return times.astype('datetime64[{}]'.format(cycle_unit)).astype('datetime64[{}]'.format(bin_unit)) + first
+
+
+class CalendarCycleCoord(DimCoord):
+    """
+    A climatological time coordinate whose cells are the bins of a repeating calendar cycle, for example the months
+    of the year. Data is binned by its position in the cycle (see :meth:`bin_values`) rather than by comparing its time
+    with the bounds, which follow the CF convention for climatological statistics: the start of each bin in the first
+    cycle to the end of the bin in the last cycle.
+    """
+
+    @classmethod
+    def from_range(cls, start, end, cycle, units, **kwargs):
+        """
+        Make a coordinate for the bins of a calendar cycle over a time range.
+
+        :param float start: The start of the range, in the given units
+        :param float end: The end of the range, in the given units
+        :param str cycle: The calendar cycle: month_of_year, season_of_year, day_of_year or hour_of_day
+        :param cf_units.Unit units: The units of the times
+        :param kwargs: Other arguments for the coordinate
+        :return CalendarCycleCoord:
+        """
+        cycle = cycle.lower()
+        bin_unit, cycle_unit, length, first, num_bins = _CYCLES[cycle]
+        start_time, end_time = to_datetime64([start, end], units)
+        first_cycle, last_cycle = _cycle_starts(np.array([start_time, end_time]), cycle)
+        if last_cycle == end_time:
+            # The range ends at the start of a cycle
+            last_cycle = _cycle_starts(last_cycle - 1, cycle)
+
+        bins = np.arange(num_bins) * length
+        lower = from_datetime64(first_cycle + bins, units)
+        upper = from_datetime64(last_cycle + bins + length, units)
+        points = (lower + from_datetime64(first_cycle + bins + length, units)) / 2.0
+        coord = cls(points, units=units, bounds=np.column_stack((lower, upper)), **kwargs)
+        coord.climatological = True
+        coord.cycle = cycle
+        coord.time_range = (start, end)
+        return coord
+
+    @property
+    def bin_lower_bounds(self):
+        """
+        The lower bounds of the bins, in terms of the positions returned by :meth:`bin_values`
+        """
+        return np.arange(len(self.points))
+
+    @property
+    def bin_max_bound(self):
+        """
+        The upper bound of the last bin, in terms of the positions returned by :meth:`bin_values`
+        """
+        return len(self.points)
+
+    def bin_values(self, values):
+        """
+        Find the bin of the cycle which each time lies in.
+
+        :param values: The times, in the units of this coordinate
+        :return ndarray: The index of the bin of each time, or -1 for times outside the range of the coordinate
+        """
+        bin_unit, cycle_unit, length, first, num_bins = _CYCLES[self.cycle]
+        values = np.asarray(values, dtype=float)
+        times = to_datetime64(values, self.units)
+        offset = (times.astype('datetime64[{}]'.format(bin_unit)) - _cycle_starts(times, self.cycle)).astype(np.int64)
+        bins = offset // length
+        bins[(values < self.time_range[0]) | ~(values < self.time_range[1])] = -1
+        return bins
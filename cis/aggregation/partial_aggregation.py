@@ -0,0 +1,248 @@
+"""
+Mergeable partial aggregates, so that ungridded data can be aggregated in parts (for example one file at a time, in
+separate processes) and the parts combined afterwards.
+
+Each part is reduced to the count, sum, sum of squared deviations from the mean, minimum and maximum of the values in
+every cell of the aggregation grid. These combine exactly (the sums of squared deviations using the parallel algorithm
+of Chan et al.), so the memory needed depends on the size of the grid rather than the amount of data.
+
+Percentiles can't be combined exactly without keeping every value, so for them each part can also keep a
+:class:`QuantileSketch` - a histogram of each cell's values in logarithmically spaced buckets, which gives percentiles
+within a fixed relative error using a bounded amount of memory.
+"""
+import numpy as np
+
+# Added to the logarithmic bucket index of every non-zero value so that all bucket keys are positive (before the sign of
+# the value is applied)
+_BUCKET_KEY_OFFSET = 2 ** 40
+
+
+class QuantileSketch(object):
+    """
+    A mergeable sketch of the distribution of the values in each cell of a grid, from which percentiles can be
+    calculated to within a given relative accuracy (in the manner of DDSketch). Each value is counted in a bucket
+    ``(gamma^(k-1), gamma^k]`` of its magnitude, where ``gamma = (1 + accuracy) / (1 - accuracy)``; only the non-empty
+    (cell, bucket) pairs are stored.
+
+    :param float relative_accuracy: The relative accuracy of the percentiles
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("The relative accuracy of a quantile sketch must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        # The (flat) cell number, bucket key and count of each non-empty bucket, sorted by cell and then value
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_values(cls, cells, values, relative_accuracy=0.01):
+        """
+        :param ndarray cells: The (flat) cell number of each value
+        :param ndarray values: The values
+        :param float relative_accuracy: The relative accuracy of the percentiles
+        :return QuantileSketch:
+        """
+        sketch = cls(relative_accuracy)
+        sketch._set_buckets(np.asarray(cells, dtype=np.int64), sketch._get_keys(np.asarray(values, dtype=float)),
+                            np.ones(len(values), dtype=np.int64))
+        return sketch
+
+    def _get_keys(self, values):
+        """
+        :return: The bucket key of each value, which increases with the value (and is zero for zero)
+        """
+        magnitude = np.abs(values)
+        keys = np.zeros(values.shape, dtype=np.int64)
+        non_zero = magnitude > 0
+        keys[non_zero] = np.ceil(np.log(magnitude[non_zero]) / np.log(self._gamma)).astype(np.int64) + \
+            _BUCKET_KEY_OFFSET
+        return np.where(values < 0, -keys, keys)
+
+    def _get_values(self, keys):
+        """
+        :return: The value representing each bucket, which is within the relative accuracy of every value in it
+        """
+        exponent = np.abs(keys) - _BUCKET_KEY_OFFSET
+        with np.errstate(over='ignore', under='ignore'):
+            values = 2 * self._gamma ** exponent.astype(float) / (self._gamma + 1)
+        return np.where(keys == 0, 0.0, np.sign(keys) * values)
+
+    def _set_buckets(self, cells, keys, counts):
+        """
+        Set the buckets, combining the counts of any repeated (cell, bucket) pairs.
+        """
+        order = np.lexsort((keys, cells))
+        cells, keys, counts = cells[order], keys[order], counts[order]
+        starts = np.flatnonzero(np.concatenate(([True], (cells[1:] != cells[:-1]) | (keys[1:] != keys[:-1]))))
+        starts = starts[:cells.size]
+        self.cells, self.keys = cells[starts], keys[starts]
+        self.counts = np.add.reduceat(counts, starts) if starts.size else counts[:0]
+
+    def merge(self, other):
+        """
+        Combine the buckets of another sketch (of the same accuracy) into this one.
+
+        :param QuantileSketch other: The other sketch
+        :return QuantileSketch: This sketch
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Unable to merge quantile sketches of different accuracies")
+        self._set_buckets(np.concatenate((self.cells, other.cells)), np.concatenate((self.keys, other.keys)),
+                          np.concatenate((self.counts, other.counts)))
+        return self
+
+    def percentiles(self, percentiles, num_cells):
+        """
+        Calculate approximate percentiles of the values in each cell.
+
+        :param percentiles: The percentiles to calculate (between 0 and 100)
+        :param int num_cells: The number of cells in the grid
+        :return ndarray: Array of shape (number of percentiles, num_cells), NaN for cells with no values
+        """
+        totals = np.bincount(self.cells, weights=self.counts, minlength=num_cells)
+        cumulative_counts = np.cumsum(self.counts)
+        # The number of values in all of the previous cells
+        before = np.concatenate(([0], cumulative_counts))[np.searchsorted(self.cells, np.arange(num_cells))]
+
+        result = np.full((len(percentiles), num_cells), np.nan)
+        non_empty = totals > 0
+        for i, percentile in enumerate(percentiles):
+            # The bucket containing the value of the (zero based) rank of the percentile in each cell
+            rank = np.floor(percentile / 100.0 * (totals[non_empty] - 1))
+            buckets = np.searchsorted(cumulative_counts, before[non_empty] + rank, side='right')
+            result[i, non_empty] = self._get_values(self.keys[buckets])
+        return result
+
+
+class PartialAggregate(object):
+    """
+    The statistics of the values in each cell of a grid from which the mean, standard deviation, number of points,
+    minimum, maximum and sum can be calculated. Kernels which can be calculated from these implement
+    ``get_values_from_partial_aggregate``.
+
+    :param tuple shape: The shape of the grid
+    :param float relative_accuracy: If given, a :class:`QuantileSketch` of this accuracy is also kept, from which
+     approximate percentiles can be calculated
+    """
+
+    def __init__(self, shape, relative_accuracy=None):
+        self.shape = tuple(shape)
+        self.sketch = QuantileSketch(relative_accuracy) if relative_accuracy else None
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.total = np.zeros(self.shape)
+        self.sum_of_squared_deviations = np.zeros(self.shape)
+        self.minimum = np.full(self.shape, np.inf)
+        self.maximum = np.full(self.shape, -np.inf)
+
+    @classmethod
+    def from_segments(cls, shape, out_indices, values, offsets, relative_accuracy=None):
+        """
+        Create the partial aggregate of values which have been sorted into the cells of the grid.
+
+        :param tuple shape: The shape of the grid
+        :param tuple out_indices: The indices of each (non-empty) cell, as a tuple of arrays (one for each dimension)
+        :param ndarray values: The values, sorted by cell
+        :param ndarray offsets: The offsets of each cell's values, so the values in cell i are
+         ``values[offsets[i]:offsets[i + 1]]``
+        :param float relative_accuracy: If given, also keep a :class:`QuantileSketch` of this accuracy
+        :return PartialAggregate:
+        """
+        from cis.collocation.col_implementations import _reduce_segments
+        partial = cls(shape, relative_accuracy)
+        if len(offsets) < 2:
+            return partial
+        values = np.asarray(np.ma.getdata(values), dtype=float)
+        counts = np.diff(offsets)
+        totals = _reduce_segments(np.add, values, offsets)
+        deviations = values - np.repeat(totals / counts, counts)
+
+        partial.count[out_indices] = counts
+        partial.total[out_indices] = totals
+        partial.sum_of_squared_deviations[out_indices] = _reduce_segments(np.add, deviations ** 2, offsets)
+        partial.minimum[out_indices] = _reduce_segments(np.minimum, values, offsets)
+        partial.maximum[out_indices] = _reduce_segments(np.maximum, values, offsets)
+        if partial.sketch is not None:
+            cells = np.repeat(np.ravel_multi_index(out_indices, partial.shape), counts)
+            partial.sketch = QuantileSketch.from_values(cells, values, relative_accuracy)
+        return partial
+
+    def merge(self, other):
+        """
+        Combine the statistics of another part of the data (aggregated onto the same grid) into this one.
+
+        :param PartialAggregate other: The partial aggregate of the other part
+        :return PartialAggregate: This partial aggregate
+        """
+        if other.shape != self.shape:
+            raise ValueError("Unable to merge partial aggregates on different grids ({} and {})"
+                             .format(self.shape, other.shape))
+        count = self.count + other.count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = np.where(other.count > 0, other.total / other.count, 0.0) - \
+                np.where(self.count > 0, self.total / self.count, 0.0)
+            correction = np.where(count > 0, delta ** 2 * self.count * other.count / count, 0.0)
+        self.sum_of_squared_deviations += other.sum_of_squared_deviations + correction
+        self.total += other.total
+        self.count = count
+        np.minimum(self.minimum, other.minimum, out=self.minimum)
+        np.maximum(self.maximum, other.maximum, out=self.maximum)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        else:
+            self.sketch = None
+        return self
+
+    def _where_count(self, values, min_count=1):
+        return np.where(self.count >= min_count, values, np.nan)
+
+    def num_points(self):
+        """
+        :return ndarray: The number of points in each cell, NaN where there are none
+        """
+        return self._where_count(self.count.astype(float))
+
+    def mean(self):
+        """
+        :return ndarray: The mean of each cell, NaN where there are no points
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._where_count(self.total / self.count)
+
+    def stddev(self):
+        """
+        :return ndarray: The corrected sample standard deviation of each cell, NaN where there are fewer than two points
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._where_count(np.sqrt(self.sum_of_squared_deviations / (self.count - 1)), min_count=2)
+
+    def min(self):
+        """
+        :return ndarray: The minimum of each cell, NaN where there are no points
+        """
+        return self._where_count(self.minimum)
+
+    def max(self):
+        """
+        :return ndarray: The maximum of each cell, NaN where there are no points
+        """
+        return self._where_count(self.maximum)
+
+    def sum(self):
+        """
+        :return ndarray: The sum of each cell, NaN where there are no points
+        """
+        return self._where_count(self.total)
+
+    def percentiles(self, percentiles):
+        """
+        :param percentiles: The percentiles to calculate (between 0 and 100)
+        :return ndarray: The approximate percentiles of each cell, with shape (number of percentiles,) + grid shape, NaN
+         where there are no points
+        :raises ValueError: If no quantile sketch was kept
+        """
+        if self.sketch is None:
+            raise ValueError("Percentiles can only be calculated from partial aggregates which keep a quantile sketch")
+        return self.sketch.percentiles(percentiles, int(np.prod(self.shape))).reshape((len(percentiles),) + self.shape)
@@ -1,27 +1,239 @@
 import logging
-import numpy as np
+from collections import namedtuple
 from datetime import datetime
 
+import numpy as np
+
+# The details of an aggregated variable, needed to name the output
+_VariableDetails = namedtuple('_VariableDetails', ['var_name', 'long_name', 'standard_name', 'units'])
+
+
+def _aggregate_file(job):
+    """
+    Read and bin the data in a single file onto an aggregation grid, for use in a worker process.
+
+    :param tuple job: The grid, filename, variables, product and the relative accuracy of any quantile sketches
+    :return: A list of the results of :meth:`UngriddedAggregator._aggregate_part` for each variable
+    """
+    from cis.data_io.data_reader import DataReader
+    grid, filename, variables, product, relative_accuracy = job
+    aggregator = UngriddedAggregator(grid)
+    return [aggregator._aggregate_part(data, relative_accuracy)
+            for data in DataReader().read_data_list(filename, variables, product)]
+
 
 class UngriddedAggregator(object):
 
     def __init__(self, grid):
         self._grid = grid
 
-    def aggregate(self, data, kernel):
+    def aggregate(self, data, kernel, sparse=False):
         """
         Performs aggregation for ungridded data by first generating a new grid, converting it into a cube, then
         collocating using the appropriate kernel and a cube cell constraint
+
+        :param data: The data (or list of data) to aggregate
+        :param kernel: The kernel instance to use
+        :param bool sparse: Keep only the occupied cells of the grid (see :meth:`aggregate_sparse`)
+        :return GriddedDataList or SparseGriddedDataList: The aggregated data
+        """
+        from cis.collocation.col_implementations import GeneralGriddedCollocator, BinnedCubeCellOnlyConstraint
+
+        if sparse:
+            return self.aggregate_sparse(data, kernel)
+
+        aggregation_cube = self._make_aggregation_cube(data)
+
+        collocator = GeneralGriddedCollocator()
+        constraint = BinnedCubeCellOnlyConstraint()
+        aggregated_cube = collocator.collocate(aggregation_cube, data, constraint, kernel)
+        self._add_max_min_bounds_for_collapsed_coords(aggregated_cube, data)
+        self._rename_variables_clashing_with_coords(aggregated_cube, aggregation_cube.coords())
+
+        return aggregated_cube
+
+    def aggregate_sparse(self, data, kernel):
+        """
+        Performs aggregation for ungridded data keeping only the occupied cells of the grid, so the memory needed
+        depends on the number of cells containing data rather than the size of the grid. This is useful for very fine
+        grids (or grids with many dimensions) where most cells are empty. The results are the same as :meth:`aggregate`
+        but are returned as :class:`~cis.data_io.sparse_gridded_data.SparseGriddedData`, which can be saved in
+        compressed form or expanded onto the full grid.
+
+        :param data: The data (or list of data) to aggregate
+        :param kernel: The kernel instance to use, which must be a data-only kernel. Kernels without their own method of
+         reducing the values of all the cells at once are applied to each occupied cell in turn
+        :return SparseGriddedDataList: The aggregated data
+        """
+        from cis.collocation.col_framework import AbstractDataOnlyKernel
+        from cis.collocation.col_implementations import _reduces_segments
+        from cis.data_io.sparse_gridded_data import SparseGriddedData, SparseGriddedDataList
+
+        if _reduces_segments(kernel):
+            get_values_for_segments = kernel.get_values_for_segments
+        elif isinstance(kernel, AbstractDataOnlyKernel):
+            # Use the default method, which calls get_value_for_data_only on each cell, rather than any inherited one
+            def get_values_for_segments(values, offsets):
+                return AbstractDataOnlyKernel.get_values_for_segments(kernel, values, offsets)
+        else:
+            raise ValueError("The {} kernel can't be used for sparse aggregation".format(kernel.__class__.__name__))
+
+        aggregation_cube = self._make_aggregation_cube(data)
+        coords = aggregation_cube.coords()
+        aggregated_cube = SparseGriddedDataList()
+        for variable in (data if isinstance(data, list) else [data]):
+            _, coord_map, out_indices, values, offsets = self._bin_data(variable, aggregation_cube)
+            kernel_values = get_values_for_segments(values, offsets)
+            # Put the indices in the same order as the coordinates of the source data (and the aggregation cube)
+            indices = tuple(out_indices[shi] for (hpi, ci, shi) in sorted(coord_map, key=lambda x: x[1]))
+            var_details = kernel.get_variable_details(variable.var_name, variable.long_name, variable.standard_name,
+                                                      variable.units)
+            for details, kernel_val in zip(var_details, kernel_values):
+                aggregated_cube.append(SparseGriddedData.from_indices(indices, kernel_val, coords, *details))
+
+        self._add_max_min_bounds_for_collapsed_coords(aggregated_cube, data)
+        self._rename_variables_clashing_with_coords(aggregated_cube, aggregated_cube.coords())
+        return aggregated_cube
+
+    def aggregate_files(self, filenames, variables, kernel, product=None, processes=None):
+        """
+        Performs aggregation for ungridded data spread over many files without reading all of the data at once. Each
+        file is binned onto the grid separately (in parallel worker processes), giving the
+        :class:`~cis.aggregation.partial_aggregation.PartialAggregate` statistics of each grid cell, and these are then
+        merged - so the memory needed depends on the size of the grid rather than the amount of data. The results are
+        the same as aggregating all of the files at once.
+
+        The start and end of the grid must be given for every gridded coordinate, and the kernel must be one which can
+        be calculated from the partial aggregates (moments, mean, stddev, min, max, sum or approximate percentiles).
+
+        :param list filenames: The files to aggregate
+        :param variables: The variable or list of variables to aggregate
+        :param kernel: The kernel instance to use
+        :param str product: The name of the data reading plugin to use to read the data
+        :param int processes: The number of worker processes to use, defaults to the number of CPUs. With one process
+         each file is read, binned and released in turn
+        :return GriddedDataList: The aggregated data
+        """
+        from multiprocessing import Pool
+        from cis.collocation.col_implementations import GeneralGriddedCollocator, _merges_partial_aggregates
+        from cis.data_io.gridded_data import GriddedDataList
+        from cis.utils import listify
+
+        if not _merges_partial_aggregates(kernel):
+            raise ValueError("The {} kernel can't be used to aggregate files separately".format(
+                kernel.__class__.__name__))
+        for name, grid in self._grid.items():
+            if grid.start is None or grid.stop is None:
+                raise ValueError("The start and end of the grid must be given for the coordinate {} to aggregate files "
+                                 "separately".format(name))
+
+        relative_accuracy = getattr(kernel, 'sketch_relative_accuracy', None)
+        jobs = [(self._grid, filename, listify(variables), product, relative_accuracy) for filename in filenames]
+        pool = None
+        if processes == 1 or len(jobs) < 2:
+            parts = map(_aggregate_file, jobs)
+        else:
+            pool = Pool(processes)
+            parts = pool.imap(_aggregate_file, jobs)
+
+        try:
+            merged = None
+            for file_parts in parts:
+                if merged is None:
+                    merged = file_parts
+                    continue
+                for variable_parts, (partial, extents, _, _, _) in zip(merged, file_parts):
+                    variable_parts[0].merge(partial)
+                    for name, (start, end) in extents.items():
+                        variable_parts[1][name] = (np.minimum(start, variable_parts[1][name][0]),
+                                                   np.maximum(end, variable_parts[1][name][1]))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        aggregated_cube = GriddedDataList()
+        for partial, extents, output_coords, coord_map, var_details in merged:
+            # Set the points and bounds of any fully collapsed coordinates from the extent of the data in all the files
+            for coord in output_coords:
+                if len(coord.points) == 1 and np.all(np.isinf(coord.bounds)):
+                    start, end = extents[coord.name()]
+                    coord.bounds = None
+                    coord.points = [start + (end - start) / 2.0]
+                    coord.bounds = [[start, end]]
+
+            values = kernel.get_values_from_partial_aggregate(partial)
+            aggregated_cube.extend(GeneralGriddedCollocator()._create_output_cubes(
+                var_details, list(values), output_coords, coord_map, kernel))
+        self._rename_variables_clashing_with_coords(aggregated_cube, merged[0][2] if merged else [])
+        return aggregated_cube
+
+    def _aggregate_part(self, data, relative_accuracy=None):
+        """
+        Bin part of the data onto the aggregation grid.
+
+        :param UngriddedData data: The part of the data
+        :param float relative_accuracy: If given, also keep a quantile sketch of the data with this accuracy
+        :return: A tuple of the PartialAggregate of the data, a dictionary of the (minimum, maximum) of each coordinate
+         of the data, the coordinates of the grid, the map relating the data and grid coordinates and the variable
+         details of the data
+        """
+        from cis.aggregation.partial_aggregation import PartialAggregate
+
+        output_coords, coord_map, out_indices, values, offsets = self._bin_data(data)
+        partial = PartialAggregate.from_segments([len(c.points) for c in output_coords], out_indices, values, offsets,
+                                                 relative_accuracy)
+
+        extents = {}
+        for coord in data.coords():
+            extents[coord.name()] = self._get_coord_start_end_centre(coord)[:2]
+        var_details = _VariableDetails(data.var_name, data.long_name, data.standard_name, data.units)
+        return partial, extents, output_coords, coord_map, var_details
+
+    def _bin_data(self, data, aggregation_cube=None):
+        """
+        Sort the data into the cells of the aggregation grid.
+
+        :param UngriddedData data: The data
+        :param aggregation_cube: The cube defining the aggregation grid, made from the data if not given
+        :return: A tuple of the coordinates of the grid (in the order of the cell indices), the map relating the data
+         and grid coordinates, and the out indices of each non-empty cell, the data values sorted by cell and the
+         offsets of each cell's values in them (see :meth:`.BinnedCubeCellOnlyConstraint.get_segments_for_data_only`)
+        """
+        from cis.collocation import data_index
+        from cis.collocation.col_implementations import BinnedCubeCellOnlyConstraint, make_coord_map, \
+            _fix_longitude_range
+
+        if aggregation_cube is None:
+            aggregation_cube = self._make_aggregation_cube(data)
+        data_points = data.get_non_masked_points()
+        coord_map = make_coord_map(aggregation_cube, data)
+        coords = aggregation_cube.coords()
+        _fix_longitude_range(coords, data_points)
+
+        constraint = BinnedCubeCellOnlyConstraint()
+        data_index.create_indexes(constraint, coords, data_points, coord_map)
+        out_indices, values, offsets = constraint.get_segments_for_data_only(False, coord_map, data_points,
+                                                                              aggregation_cube)
+        output_coords = [coords[ci] for (hpi, ci, shi) in coord_map]
+        return output_coords, coord_map, out_indices, values, offsets
+
+    def _make_aggregation_cube(self, data):
+        """
+        Make the cube defining the aggregation grid, with a coordinate for each coordinate of the data.
+
+        :param data: The data to aggregate
+        :return: The aggregation cube
         """
         from cis.exceptions import CoordinateNotFoundError
         from iris.cube import Cube
-        from cis.collocation.col_implementations import GeneralGriddedCollocator, BinnedCubeCellOnlyConstraint
         new_cube_coords = []
         new_cube_shape = []
 
+        grids = dict(self._grid)
         for i, coord in enumerate(data.coords()):
             # Pop off the grid once we have it so that we can check for coords we didn't find
-            grid = self._grid.pop(coord.name(), None)
+            grid = grids.pop(coord.name(), None)
             if grid is None:
                 new_coord = self._make_fully_collapsed_coord(coord)
             else:
@@ -29,31 +241,29 @@ class UngriddedAggregator(object):
             new_cube_coords.append((new_coord, i))
             new_cube_shape.append(len(new_coord.points))
 
-        if len(self._grid) != 0:
+        if len(grids) != 0:
             raise CoordinateNotFoundError("No coordinate found that matches '{}'. Please check the coordinate "
-                                          "name.".format("' or '".join(list(self._grid.keys()))))
+                                          "name.".format("' or '".join(list(grids.keys()))))
 
-        dummy_data = np.reshape(np.arange(int(np.prod(new_cube_shape))) + 1.0, tuple(new_cube_shape))
-        aggregation_cube = Cube(dummy_data, dim_coords_and_dims=new_cube_coords)
+        # The cube only defines the grid, so a (read-only) broadcast array is used to avoid allocating any data for it
+        dummy_data = np.broadcast_to(np.float64(1.0), tuple(new_cube_shape))
+        return Cube(dummy_data, dim_coords_and_dims=new_cube_coords)
 
-        collocator = GeneralGriddedCollocator()
-        constraint = BinnedCubeCellOnlyConstraint()
-        aggregated_cube = collocator.collocate(aggregation_cube, data, constraint, kernel)
-        self._add_max_min_bounds_for_collapsed_coords(aggregated_cube, data)
-
-        # We need to rename any variables which clash with coordinate names otherwise they will not output correctly, we
-        # prepend it with 'aggregated_' to make it clear which variable has been aggregated (the original coordinate
-        # value will not have been.)
+    @staticmethod
+    def _rename_variables_clashing_with_coords(aggregated_cube, coords):
+        """
+        We need to rename any variables which clash with coordinate names otherwise they will not output correctly, we
+        prepend it with 'aggregated_' to make it clear which variable has been aggregated (the original coordinate
+        value will not have been.)
+        """
         for idx, d in enumerate(aggregated_cube):
-            if d.var_name in [coord.var_name for coord in aggregation_cube.coords()]:
+            if d.var_name in [coord.var_name for coord in coords]:
                 new_name = "aggregated_" + d.var_name
                 aggregated_cube[idx].rename(new_name)
                 aggregated_cube[idx].var_name = new_name
                 logging.warning("Variable {} clashes with a coordinate variable name and has been renamed to: {}"
                                 .format(d.var_name, new_name))
 
-        return aggregated_cube
-
     @staticmethod
     def _get_CF_coordinate_units(coord):
         """
@@ -101,10 +311,20 @@ class UngriddedAggregator(object):
         :type coord: data_io.Coord.Coord
         :param coord: Coordinate to partially collapse
         :type grid: slice
-        :param grid: grid on which this coordinate will aggregate
+        :param grid: grid on which this coordinate will aggregate, the step may be the name of a calendar period or
+         cycle (see :mod:`cis.aggregation.calendar_bins`)
         :return: DimCoord
         """
         from iris.coords import DimCoord
+        from cis.aggregation.calendar_bins import is_calendar_bin, make_period_coord, CalendarCycleCoord, _CYCLES
+        if is_calendar_bin(grid.step):
+            coord_units = self._get_CF_coordinate_units(coord)
+            if grid.step.lower() in _CYCLES:
+                return CalendarCycleCoord.from_range(grid.start, grid.stop, grid.step, coord_units,
+                                                     var_name=coord.name(), standard_name=coord.standard_name)
+            return make_period_coord(grid.start, grid.stop, grid.step, coord_units, var_name=coord.name(),
+                                     standard_name=coord.standard_name)
+
         new_coordinate_grid = aggregation_grid_array(grid.start, grid.stop, grid.step)
         new_coord = DimCoord(new_coordinate_grid, var_name=coord.name(), standard_name=coord.standard_name,
                              units=self._get_CF_coordinate_units(coord))
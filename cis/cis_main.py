@@ -91,12 +91,23 @@ def col_cmd(main_arguments):
 
     kernel = get_kernel(kern_name)(**kern_options) if kern_name else None
 
+    # The most recently calculated interpolation (or area) weights, which are shared between the datagroups so that
+    #  those on the same grid don't need to recalculate them
+    recent_weights = {}
+
     for input_group in main_arguments.datagroups:
         # Then collocate each datagroup
         data = DataReader().read_single_datagroup(input_group)
-        output = data.collocated_onto(sample_data, how=col_name, kernel=kernel,
-                                      missing_data_for_missing_sample=missing_data_for_missing_sample, **col_options)
-        output.save_data(main_arguments.output)
+        if 'chunk_size' in col_options:
+            # Write each chunk of the collocated data to the output as it is calculated
+            data.collocated_onto(sample_data, how=col_name, kernel=kernel,
+                                 missing_data_for_missing_sample=missing_data_for_missing_sample,
+                                 output_file=main_arguments.output, recent_weights=recent_weights, **col_options)
+        else:
+            output = data.collocated_onto(sample_data, how=col_name, kernel=kernel,
+                                          missing_data_for_missing_sample=missing_data_for_missing_sample,
+                                          recent_weights=recent_weights, **col_options)
+            output.save_data(main_arguments.output)
 
 
 def subset_cmd(main_arguments):
@@ -134,6 +145,15 @@ def aggregate_cmd(main_arguments):
         __error_occurred("Aggregation can only be performed on one data group")
     input_group = main_arguments.datagroups[0]
 
+    if main_arguments.stream:
+        from cis.data_io.ungridded_data import _aggregate_ungridded_files
+        # Read, bin and release each file in turn rather than reading the whole datagroup
+        output = _aggregate_ungridded_files(input_group['filenames'], input_group['variables'],
+                                            input_group.get("kernel", ''), input_group.get('product', None),
+                                            processes=1, **main_arguments.grid)
+        output.save_data(main_arguments.output)
+        return
+
     data = DataReader().read_single_datagroup(input_group)
 
     if isinstance(data, GriddedDataList):
@@ -143,7 +163,7 @@ def aggregate_cmd(main_arguments):
             raise ex.InvalidCommandLineOptionError("Grid specifications are not supported for Gridded aggregation.")
         output = data.collapsed(list(main_arguments.grid.keys()), how=input_group.get("kernel", ''))
     else:
-        output = data.aggregate(how=input_group.get("kernel", ''), **main_arguments.grid)
+        output = data.aggregate(how=input_group.get("kernel", ''), sparse=main_arguments.sparse, **main_arguments.grid)
 
     output.save_data(main_arguments.output)
 
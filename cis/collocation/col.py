@@ -6,7 +6,7 @@ from cis.collocation.col_implementations import moments
 import six
 
 
-def collocate(data, sample, collocator, constraint, kernel):
+def collocate(data, sample, collocator, constraint, kernel, output_file=None):
     """
     Perform the collocation.
 
@@ -15,6 +15,8 @@ def collocate(data, sample, collocator, constraint, kernel):
     :param cis.collocation.col_framework.Collocator collocator: The collocator object to use
     :param cis.collocation.col_framework.Constraint constraint: The constraint object
     :param cis.collocation.col_framework.Kernel  kernel: The kernel to use
+    :param str output_file: If given, the collocated data is written to this file as it is calculated, using the
+     collocator's collocate_to_file method, and None is returned
     :return CommonData: The collocated data
     :raises CoordinateNotFoundError: If the collocator was unable to compare the sample and data points
     """
@@ -25,24 +27,30 @@ def collocate(data, sample, collocator, constraint, kernel):
     logging.info("Collocator: " + str(collocator))
     logging.info("Kernel: " + str(kernel))
 
+    history = "Collocated onto sampling from: " + str(getattr(sample, "filenames", "Unknown")) + " " + \
+              "\nusing CIS version " + __version__ + " " + \
+              "\nvariables: " + str(getattr(data, "var_name", "Unknown")) + " " + \
+              "\nwith files: " + str(getattr(data, "filenames", "Unknown")) + " " + \
+              "\nusing collocator: " + str(collocator) + " " + \
+              "\nkernel: " + str(kernel)
+
     logging.info("Collocating, this could take a while...")
     t1 = time()
     try:
-        new_data = collocator.collocate(sample, data, constraint, kernel)
+        if output_file is None:
+            new_data = collocator.collocate(sample, data, constraint, kernel)
+        else:
+            new_data = None
+            collocator.collocate_to_file(sample, data, constraint, kernel, output_file, history)
     except (TypeError, AttributeError) as e:
         raise CoordinateNotFoundError('Collocator was unable to compare data points, check the dimensions of each '
                                       'data set and the collocation methods chosen. \n' + str(e))
 
     logging.info("Completed. Total time taken: " + str(time() - t1))
 
-    for d in new_data:
-        history = "Collocated onto sampling from: " + str(getattr(sample, "filenames", "Unknown")) + " " + \
-                  "\nusing CIS version " + __version__ + " " + \
-                  "\nvariables: " + str(getattr(data, "var_name", "Unknown")) + " " + \
-                  "\nwith files: " + str(getattr(data, "filenames", "Unknown")) + " " + \
-                  "\nusing collocator: " + str(collocator) + " " + \
-                  "\nkernel: " + str(kernel)
-        d.add_history(history)
+    if new_data is not None:
+        for d in new_data:
+            d.add_history(history)
     return new_data
 
 
@@ -127,6 +127,109 @@ class AbstractDataOnlyKernel(Kernel):
         :raises ValueError: If there are any problems creating a value
         """
 
+    def get_values_for_segments(self, values, offsets):
+        """
+        Apply the kernel to many contiguous segments of values at once. The values for segment i are
+        ``values[offsets[i]:offsets[i + 1]]``.
+
+        This default implementation just calls :meth:`.AbstractDataOnlyKernel.get_value_for_data_only` on each
+        non-empty segment in turn; kernels which can be expressed as segmented reductions should override it.
+
+        :param values: A numpy array of the values of all segments, concatenated
+        :param offsets: An integer array of length (number of segments + 1) of segment start (and final end) positions
+        :return: An array of shape (:attr:`.Kernel.return_size`, number of segments), NaN where no value could be
+         calculated
+        """
+        result = np.full((self.return_size, len(offsets) - 1), np.nan)
+        for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+            if end > start:
+                try:
+                    result[:, i] = self.get_value_for_data_only(values[start:end])
+                except ValueError:
+                    pass
+        return result
+
+
+class AbstractNearestNeighbourKernel(Kernel):
+    """
+    A Kernel which returns the value of the data point nearest to the sample point, by some measure of the distance
+    between them. Where more than one data point is at the minimum distance the first one is used.
+    """
+
+    __metaclass__ = ABCMeta
+
+    #: The names of the coordinates which :meth:`.AbstractNearestNeighbourKernel.get_distances` uses
+    distance_coords = ()
+
+    @abstractmethod
+    def get_distances(self, sample_coords, data_coords):
+        """
+        This method should return the distances between sample and data points, given their coordinates.
+
+        :param sample_coords: A mapping from each of the :attr:`distance_coords` to the sample point coordinate(s),
+         either scalars or arrays
+        :param data_coords: A mapping from each of the :attr:`distance_coords` to arrays of the data point coordinates
+        :return: A numpy array of the (broadcast) distances between the sample and data points
+        """
+
+    def _get_nearest(self, distances, segment_ids):
+        """
+        Find the (first) position of the minimum distance in each segment.
+
+        :param distances: Array of distances
+        :param segment_ids: The (non-decreasing) segment number for each distance
+        :return: Array of the positions of the nearest points, sorted by segment
+        """
+        # Missing coordinates never make a point nearer
+        distances = np.where(np.isnan(distances), np.inf, distances)
+        order = np.lexsort((np.arange(len(distances)), distances, segment_ids))
+        sorted_ids = segment_ids[order]
+        first_in_segment = np.ones(len(order), dtype=bool)
+        first_in_segment[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        return order[first_in_segment]
+
+    def get_value(self, point, data):
+        """
+        Find the value of the data point nearest to the given point.
+
+        :param point: A single HyperPoint (or pandas Series)
+        :param data: A pandas DataFrame of the data points
+        :return: The value of the nearest data point
+        :raises ValueError: When there are no data points
+        """
+        if len(data) == 0:
+            # No points to check
+            raise ValueError
+        distances = self.get_distances({c: getattr(point, c) for c in self.distance_coords},
+                                       {c: getattr(data, c).values for c in self.distance_coords})
+        distances = np.broadcast_to(distances, (len(data),))
+        nearest = self._get_nearest(distances, np.zeros(len(data), dtype=int))[0]
+        return data.vals.values[nearest]
+
+    def get_values_for_neighbours(self, sample_points, data_points, offsets, indices, value_column='vals'):
+        """
+        Apply the kernel to every sample point at once, given the neighbouring data points of each one. The neighbours
+        of sample point i are ``data_points.iloc[indices[offsets[i]:offsets[i + 1]]]``.
+
+        :param sample_points: A pandas DataFrame of the sample points
+        :param data_points: A pandas DataFrame of the data points
+        :param offsets: An integer array of length (number of sample points + 1) of segment start (and final end)
+         positions
+        :param indices: An integer array of the data point indices in each segment, concatenated
+        :param value_column: The column of data_points containing the values to return
+        :return: An array of shape (1, number of sample points), NaN where there are no neighbours
+        """
+        counts = np.diff(offsets)
+        sample_indices = np.repeat(np.arange(len(counts)), counts)
+        distances = self.get_distances(
+            {c: getattr(sample_points, c).values[sample_indices] for c in self.distance_coords},
+            {c: getattr(data_points, c).values[indices] for c in self.distance_coords})
+        nearest = self._get_nearest(distances, sample_indices)
+
+        result = np.full((1, len(counts)), np.nan)
+        result[0, counts > 0] = data_points[value_column].values[indices[nearest]]
+        return result
+
 
 class Constraint(object):
     """
@@ -2,12 +2,14 @@ import logging
 
 import iris.cube
 import iris.coords
-from iris.exceptions import CoordinateMultiDimError
+from iris.exceptions import CoordinateMultiDimError, CoordinateNotFoundError
 import numpy as np
+import six
 from numpy import mean as np_mean, std as np_std, min as np_min, max as np_max, sum as np_sum
 
 from cis.collocation.col_framework import (Collocator, Constraint, PointConstraint, CellConstraint,
-                                           IndexedConstraint, Kernel, AbstractDataOnlyKernel)
+                                           IndexedConstraint, Kernel, AbstractDataOnlyKernel,
+                                           AbstractNearestNeighbourKernel)
 import cis.exceptions
 from cis.data_io.gridded_data import GriddedData, make_from_cube, GriddedDataList
 from cis.data_io.hyperpoint import HyperPoint, HyperPointList
@@ -21,6 +23,23 @@ class GeneralUngriddedCollocator(Collocator):
     Collocator for locating onto ungridded sample points
     """
 
+    def __init__(self, fill_value=None, var_name='', var_long_name='', var_units='',
+                 missing_data_for_missing_sample=False, workers=1, chunk_size=None):
+        """
+        :param workers: The number of processes to collocate with. The sample points are split into contiguous shards
+         which are collocated in parallel. The default is 1 (no extra processes).
+        :param chunk_size: The number of sample points to collocate at a time, to limit the memory used for large
+         numbers of sample points. The default is None (all of the points at once).
+        """
+        super(GeneralUngriddedCollocator, self).__init__(fill_value, var_name, var_long_name, var_units,
+                                                         missing_data_for_missing_sample)
+        self.workers = int(workers)
+        if self.workers < 1:
+            raise ValueError("The number of workers must be at least 1")
+        self.chunk_size = int(chunk_size) if chunk_size is not None else None
+        if self.chunk_size is not None and self.chunk_size < 1:
+            raise ValueError("The chunk size must be at least 1")
+
     def collocate(self, points, data, constraint, kernel):
         """
         This collocator takes a list of HyperPoints and a data object (currently either Ungridded
@@ -39,21 +58,111 @@ class GeneralUngriddedCollocator(Collocator):
         log_memory_profile("GeneralUngriddedCollocator Initial")
 
         if isinstance(data, list):
-            # Indexing and constraints (for SepConstraintKdTree) will only take place on the first iteration,
-            # so we really can just call this method recursively if we've got a list of data.
-            output = UngriddedDataList()
-            for var in data:
-                output.extend(self.collocate(points, var, constraint, kernel))
-            return output
+            if len(data) > 1 and not isinstance(kernel, nn_horizontal_only) and _share_coordinates(data):
+                # Find the neighbours of the sample points once and use them for all of the variables
+                variables = list(data)
+            else:
+                # Indexing and constraints (for SepConstraintKdTree) will only take place on the first iteration,
+                # so we really can just call this method recursively if we've got a list of data.
+                output = UngriddedDataList()
+                for var in data:
+                    output.extend(self.collocate(points, var, constraint, kernel))
+                return output
+        else:
+            variables = [data]
+
+        data_points, var_columns, var_set_details = self._prepare(points, variables, constraint, kernel)
+
+        sample_points_count = points.coords()[0].data.size
+        # Create an empty masked array to store the collocated values. The elements will be unmasked by assignment.
+        values = np.ma.masked_all((len(var_set_details), sample_points_count))
+        values.fill_value = self.fill_value
+        log_memory_profile("GeneralUngriddedCollocator after output array creation")
+
+        logging.info("    {} sample points".format(sample_points_count))
+        for start, end, chunk_values in self._collocate_chunks(points, data_points, constraint, kernel,
+                                                               len(var_set_details), var_columns):
+            values[:, start:end] = chunk_values
+        log_memory_profile("GeneralUngriddedCollocator after running kernel on sample points")
+
+        return_data = UngriddedDataList()
+        for idx, var_details in enumerate(var_set_details):
+            var_metadata = self._get_output_metadata(var_details, sample_points_count)
+            return_data.append(UngriddedData(values[idx, :], var_metadata, points.coords()))
+        log_memory_profile("GeneralUngriddedCollocator final")
 
+        return return_data
+
+    def collocate_to_file(self, points, data, constraint, kernel, output_file, history=None):
+        """
+        Collocate the data onto the sample points like :meth:`collocate`, but write the collocated values to a NetCDF
+        file one chunk of chunk_size sample points at a time, rather than returning them. The data are only indexed
+        once, and the memory used for the sample points and collocated values is bounded by the chunk size.
+
+        :param UngriddedData or UngriddedCoordinates points: Object defining the sample points
+        :param UngriddedData or UngriddedDataList data: The source data to collocate from
+        :param constraint: An instance of a Constraint subclass
+        :param kernel: An instance of a Kernel subclass
+        :param str output_file: The file to write the sample coordinates and collocated variables to
+        :param str history: Any history to add to the collocated variables
+        """
+        from cis.data_io.Coord import Coord, CoordList
+        from cis.data_io.write_netcdf import write_coordinates, add_data_to_file
+
+        if not isinstance(data, list):
+            variable_groups = [[data]]
+        elif len(data) > 1 and not isinstance(kernel, nn_horizontal_only) and _share_coordinates(data):
+            variable_groups = [list(data)]
+        else:
+            variable_groups = [[var] for var in data]
+
+        logging.info('Saving data to %s' % output_file)
+        for group_number, variables in enumerate(variable_groups):
+            data_points, var_columns, var_set_details = self._prepare(points, variables, constraint, kernel)
+            if group_number == 0:
+                # Write the coordinates once their longitudes have been fixed to the same range as the data
+                write_coordinates(points, output_file)
+
+            sample_points_count = points.coords()[0].data.size
+            logging.info("    {} sample points".format(sample_points_count))
+            for start, end, chunk_values in self._collocate_chunks(points, data_points, constraint, kernel,
+                                                                   len(var_set_details), var_columns):
+                chunk_coords = CoordList([Coord(coord.data.ravel()[start:end], coord.metadata)
+                                          for coord in points.coords()])
+                for idx, var_details in enumerate(var_set_details):
+                    chunk = UngriddedData(chunk_values[idx, :], self._get_output_metadata(var_details, end - start),
+                                          chunk_coords)
+                    if history:
+                        chunk.add_history(history)
+                    add_data_to_file(chunk, output_file, start=start)
+                log_memory_profile("GeneralUngriddedCollocator after writing sample points up to {}".format(end))
+
+    def _prepare(self, points, variables, constraint, kernel):
+        """
+        Convert the data to a dataframe and index it.
+
+        :return: A tuple of the dataframe of data points, the names of its columns containing the values of each
+         variable, and the output variable details for each variable (as returned by the kernel)
+        """
         # First fix the sample points so that they all fall within the same 360 degree longitude range
         _fix_longitude_range(points.coords(), points)
         # Then fix the data points so that they fall onto the same 360 degree longitude range as the sample points
-        _fix_longitude_range(points.coords(), data)
+        for var in variables:
+            _fix_longitude_range(points.coords(), var)
 
         # Convert to dataframes for fancy indexing
-        sample_points = points.as_data_frame(time_index=False, name='vals')
-        data_points = data.as_data_frame(time_index=False, name='vals').dropna(axis=0)
+        if len(variables) == 1:
+            var_columns = ['vals']
+            data_points = variables[0].as_data_frame(time_index=False, name='vals').dropna(axis=0)
+        else:
+            # Each variable gets its own column; only drop the points which are missing for all of the variables
+            var_columns = ['vals_{}'.format(i) for i in range(len(variables))]
+            data_points = variables[0].as_data_frame(time_index=False, name=var_columns[0])
+            for column, var in zip(var_columns[1:], variables[1:]):
+                data_points[column] = np.ma.filled(var.data.astype(float), np.nan).ravel()
+            coord_columns = [c for c in data_points.columns if c not in var_columns]
+            data_points = data_points.dropna(axis=0, subset=coord_columns).dropna(axis=0, how='all',
+                                                                                  subset=var_columns)
 
         log_memory_profile("GeneralUngriddedCollocator after data retrieval")
 
@@ -64,52 +173,237 @@ class GeneralUngriddedCollocator(Collocator):
 
         logging.info("--> Collocating...")
 
-        # Create output arrays.
-        self.var_name = data.var_name
-        self.var_long_name = data.long_name
-        self.var_standard_name = data.standard_name
-        self.var_units = data.units
-        var_set_details = kernel.get_variable_details(self.var_name, self.var_long_name,
-                                                      self.var_standard_name, self.var_units)
+        var_set_details = []
+        for var in variables:
+            self.var_name = var.var_name
+            self.var_long_name = var.long_name
+            self.var_standard_name = var.standard_name
+            self.var_units = var.units
+            var_set_details.extend(kernel.get_variable_details(self.var_name, self.var_long_name,
+                                                               self.var_standard_name, self.var_units))
+        return data_points, var_columns, var_set_details
+
+    def _get_output_metadata(self, var_details, length):
+        var_metadata = Metadata(name=var_details[0], long_name=var_details[1], shape=(length,),
+                                missing_value=self.fill_value, units=var_details[3])
+        set_standard_name_if_valid(var_metadata, var_details[2])
+        return var_metadata
+
+    def _collocate_chunks(self, points, data_points, constraint, kernel, n_outputs, var_columns):
+        """
+        Apply the constraint and kernel to the sample points, chunk_size points at a time (or all at once if there is
+        no chunk size).
 
-        sample_points_count = len(sample_points)
-        # Create an empty masked array to store the collocated values. The elements will be unmasked by assignment.
-        values = np.ma.masked_all((len(var_set_details), sample_points_count))
-        values.fill_value = self.fill_value
-        log_memory_profile("GeneralUngriddedCollocator after output array creation")
+        :return: An iterator of (start, end, values) for each chunk, where values is a masked array of shape
+         (n_outputs, end - start) of the collocated values for sample points start to end
+        """
+        sample_points_count = points.coords()[0].data.size
+        chunk_size = self.chunk_size or sample_points_count or 1
+        for start in range(0, sample_points_count, chunk_size):
+            end = int(np.minimum(start + chunk_size, sample_points_count))
+            if end - start == sample_points_count:
+                sample_points = points.as_data_frame(time_index=False, name='vals')
+            else:
+                sample_points = _get_sample_points_chunk(points, start, end)
+                logging.info("    Collocating sample points {} to {}".format(start, end))
+
+            values = np.ma.masked_all((n_outputs, end - start))
+            values.fill_value = self.fill_value
+            # Apply constraint and/or kernel to each sample point.
+            if self.workers > 1 and end - start > 1:
+                self._collocate_in_parallel(sample_points, data_points, constraint, kernel, values, var_columns)
+            else:
+                self._collocate_points(sample_points, data_points, constraint, kernel, values, var_columns)
 
-        logging.info("    {} sample points".format(sample_points_count))
-        # Apply constraint and/or kernel to each sample point.
+            # Mask any bad values
+            yield start, end, np.ma.masked_invalid(values)
 
+    def _collocate_points(self, sample_points, data_points, constraint, kernel, values, var_columns=('vals',)):
+        """
+        Apply the constraint and kernel to each of the sample points, storing the results in values.
+
+        :param sample_points: A dataframe of the sample points, with a default (0 to N-1) index
+        :param data_points: A dataframe of the data points. If there is more than one variable column then the
+         values may be missing (NaN) for some variables, otherwise all of the points must be non-missing.
+        :param values: The (number of output variables, N) array to store the results in, the outputs of the kernel for
+         each variable in turn
+        :param var_columns: The names of the columns of data_points containing the values of each variable
+        """
+        return_size = len(values) // len(var_columns)
         if isinstance(kernel, nn_horizontal_only):
             # Only find the nearest point using the kd-tree, without constraint in other dimensions
             nearest_points = data_points.iloc[constraint.haversine_distance_kd_tree_index.find_nearest_point(sample_points)]
             values[0, :] = nearest_points.vals.values
+        elif (_reduces_segments(kernel) or hasattr(kernel, "get_values_for_neighbours")) and \
+                hasattr(constraint, "get_neighbour_indices"):
+            # Find the neighbours of all of the sample points at once and reduce them segment by segment
+            offsets, indices = constraint.get_neighbour_indices(data_points, sample_points,
+                                                                self.missing_data_for_missing_sample)
+            for i, column in enumerate(var_columns):
+                var_offsets, var_indices = offsets, indices
+                valid = ~np.isnan(data_points[column].values[indices])
+                if not np.all(valid):
+                    # Leave out this variable's missing values from each segment
+                    var_offsets = np.concatenate(([0], np.cumsum(valid)))[offsets]
+                    var_indices = indices[valid]
+                if _reduces_segments(kernel):
+                    var_values = kernel.get_values_for_segments(data_points[column].values[var_indices], var_offsets)
+                else:
+                    var_values = kernel.get_values_for_neighbours(sample_points, data_points, var_offsets,
+                                                                  var_indices, column)
+                values[i * return_size:(i + 1) * return_size, :] = var_values
         else:
             for i, point, con_points in constraint.get_iterator(self.missing_data_for_missing_sample, None, None,
                                                                 data_points, None, sample_points, None):
+                for j, column in enumerate(var_columns):
+                    if column != 'vals':
+                        con_points_for_var = con_points[con_points[column].notna()].rename(columns={column: 'vals'})
+                    else:
+                        con_points_for_var = con_points
+                    try:
+                        values[j * return_size:(j + 1) * return_size, i] = kernel.get_value(point, con_points_for_var)
+                        # Kernel returns either a single value or a tuple of values to insert into each output variable.
+                    except CoordinateMultiDimError as e:
+                        raise NotImplementedError(e)
+                    except ValueError as e:
+                        pass
+
+    def _collocate_in_parallel(self, sample_points, data_points, constraint, kernel, values, var_columns=('vals',)):
+        """
+        Split the sample points into contiguous shards and collocate them in a pool of worker processes. The workers
+        are forked after the data has been read and indexed, so they share the data points and index copy-on-write
+        rather than having them pickled; each writes its results into its own columns of a shared memory array.
+        """
+        import multiprocessing
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            logging.warning("Unable to fork worker processes on this platform, collocating with a single process")
+            self._collocate_points(sample_points, data_points, constraint, kernel, values, var_columns)
+            return
+
+        n_vars, n_points = values.shape
+        shared_values = multiprocessing.RawArray('d', n_vars * n_points)
+        # Use a few shards per worker so that the work stays balanced when some regions are denser than others
+        shard_bounds = np.linspace(0, n_points, np.minimum(n_points, 4 * self.workers) + 1).astype(int)
+
+        _parallel_collocation_state.update(collocator=self, sample_points=sample_points, data_points=data_points,
+                                           constraint=constraint, kernel=kernel, values=shared_values,
+                                           shape=values.shape, var_columns=var_columns)
+        try:
+            pool = context.Pool(self.workers)
+            try:
+                pool.map(_collocate_shard, zip(shard_bounds[:-1], shard_bounds[1:]))
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _parallel_collocation_state.clear()
 
-                try:
-                    values[:, i] = kernel.get_value(point, con_points)
-                    # Kernel returns either a single value or a tuple of values to insert into each output variable.
-                except CoordinateMultiDimError as e:
-                    raise NotImplementedError(e)
-                except ValueError as e:
-                    pass
-        log_memory_profile("GeneralUngriddedCollocator after running kernel on sample points")
+        values[:, :] = np.frombuffer(shared_values).reshape(values.shape)
 
-        # Mask any bad values
-        values = np.ma.masked_invalid(values)
 
-        return_data = UngriddedDataList()
-        for idx, var_details in enumerate(var_set_details):
-            var_metadata = Metadata(name=var_details[0], long_name=var_details[1], shape=(len(sample_points),),
-                                    missing_value=self.fill_value, units=var_details[3])
-            set_standard_name_if_valid(var_metadata, var_details[2])
-            return_data.append(UngriddedData(values[idx, :], var_metadata, points.coords()))
-        log_memory_profile("GeneralUngriddedCollocator final")
+def _get_sample_points_chunk(points, start, end):
+    """
+    Get a chunk of the sample points as a dataframe, in the same form as ``points.as_data_frame(time_index=False,
+    name='vals')`` but without converting all of the points.
 
-        return return_data
+    :param UngriddedData or UngriddedCoordinates points: The sample points
+    :param int start: The first sample point in the chunk
+    :param int end: The end (exclusive) of the chunk
+    :return: A dataframe of the sample points with a default (0 to end - start - 1) index
+    """
+    import pandas as pd
+
+    def chunk_of(array):
+        chunk = array.ravel()[start:end]
+        if isinstance(chunk, np.ma.MaskedArray):
+            chunk = chunk.astype(float).filled(np.nan)
+        return np.array(chunk)
+
+    columns = {}
+    for coord in points.coords():
+        columns[coord.standard_name] = chunk_of(coord.data)
+    if isinstance(points, UngriddedData):
+        columns['vals'] = chunk_of(points.data)
+    return pd.DataFrame(columns)
+
+
+def _defining_class(kernel, method_name):
+    """
+    :return: The class in the kernel's hierarchy which defines the given method
+    """
+    return next(cls for cls in type(kernel).__mro__ if method_name in vars(cls))
+
+
+def _has_own_method(kernel, method_name):
+    """
+    Whether a data-only kernel has its own implementation of a method which reduces data values in bulk (such as
+    get_values_for_segments), rather than the default one, or one inherited from a kernel whose get_value,
+    get_value_for_data_only or get_values_for_segments it overrides in a subclass (which the inherited method would
+    silently ignore).
+
+    :param Kernel kernel: The kernel
+    :param str method_name: The name of the method
+    :return bool:
+    """
+    if not isinstance(kernel, AbstractDataOnlyKernel) or not hasattr(kernel, method_name):
+        return False
+    method_class = _defining_class(kernel, method_name)
+    overridden_classes = [_defining_class(kernel, name)
+                          for name in ('get_value', 'get_value_for_data_only', 'get_values_for_segments')]
+    return method_class is not AbstractDataOnlyKernel and \
+        all(issubclass(method_class, cls) for cls in overridden_classes)
+
+
+def _reduces_segments(kernel):
+    """
+    Whether a kernel has its own method for reducing many segments of data values at once (see
+    :func:`_has_own_method`). Other kernels are applied to each sample point (or cell) in turn so that their overrides
+    are used and they get the same data as before.
+
+    :param Kernel kernel: The kernel
+    :return bool:
+    """
+    return _has_own_method(kernel, 'get_values_for_segments')
+
+
+def _merges_partial_aggregates(kernel):
+    """
+    Whether a kernel has its own method for calculating its values from mergeable partial aggregates (see
+    :func:`_has_own_method`), so that it can be used to aggregate files separately.
+
+    :param Kernel kernel: The kernel
+    :return bool:
+    """
+    return _has_own_method(kernel, 'get_values_from_partial_aggregate') and getattr(kernel, 'mergeable', True)
+
+
+# The arguments of a parallel collocation, which are set before the worker processes are forked so that they can be
+# shared without pickling
+_parallel_collocation_state = {}
+
+
+def _collocate_shard(bounds):
+    """
+    Collocate the sample points in the half open range bounds = (start, end) in a worker process
+    """
+    start, end = bounds
+    state = _parallel_collocation_state
+    values = np.frombuffer(state['values']).reshape(state['shape'])[:, start:end]
+    values[:] = np.nan
+    shard_points = state['sample_points'].iloc[start:end].reset_index(drop=True)
+    state['collocator']._collocate_points(shard_points, state['data_points'], state['constraint'], state['kernel'],
+                                          values, state['var_columns'])
+
+
+def _parse_bool(value):
+    """
+    Interpret a collocator option which may have been given as a string on the command line as a boolean
+    """
+    if isinstance(value, six.string_types):
+        return value.lower() == 'true'
+    return bool(value)
 
 
 class GriddedUngriddedCollocator(Collocator):
@@ -118,10 +412,27 @@ class GriddedUngriddedCollocator(Collocator):
     """
 
     def __init__(self, fill_value=None, var_name='', var_long_name='', var_units='',
-                 missing_data_for_missing_sample=False, extrapolate=False):
+                 missing_data_for_missing_sample=False, extrapolate=False, stream_time=False, index_cache_dir=None,
+                 workers=1, recent_weights=None):
+        """
+        :param bool extrapolate: Extrapolate values for sample points outside of the bounds of the data?
+        :param bool stream_time: Interpolate the data two time steps at a time (so that the whole time series never
+         needs to be read into memory at once)?
+        :param str index_cache_dir: A directory in which to cache the interpolation indices and weights, so that they
+         can be reused when data on the same grid is collocated onto the same sample points again
+        :param int workers: The number of threads to evaluate the interpolation with
+        :param dict recent_weights: A dictionary in which to keep the interpolation weights most recently calculated,
+         which can be shared between collocators (e.g. for each datagroup of a command) so that they can reuse them
+        """
         super(GriddedUngriddedCollocator, self).__init__(fill_value, var_name, var_long_name, var_units,
                                                          missing_data_for_missing_sample)
-        self.extrapolate = extrapolate
+        self.extrapolate = _parse_bool(extrapolate)
+        self.stream_time = _parse_bool(stream_time)
+        self.index_cache_dir = index_cache_dir
+        self.workers = int(workers)
+        if self.workers < 1:
+            raise ValueError("The number of workers must be at least 1")
+        self.recent_weights = {} if recent_weights is None else recent_weights
         self.interpolator = None
 
     def collocate(self, points, data, constraint, kernel):
@@ -139,10 +450,12 @@ class GriddedUngriddedCollocator(Collocator):
                        a single value
         :return: A single LazyData object
         """
-        from cis.collocation.gridded_interpolation import GriddedUngriddedInterpolator
         log_memory_profile("GriddedUngriddedCollocator Initial")
 
         if isinstance(data, list):
+            if len(data) > 1 and all(var.shape == data[0].shape for var in data):
+                # Interpolate all of the variables at once
+                return self._collocate_variables(points, data, constraint, kernel)
             # Indexing and constraints (for SepConstraintKdTree) will only take place on the first iteration,
             # so we really can just call this method recursively if we've got a list of data.
             output = UngriddedDataList()
@@ -150,14 +463,27 @@ class GriddedUngriddedCollocator(Collocator):
                 output.extend(self.collocate(points, var, constraint, kernel))
             return output
 
+        return self._collocate_variables(points, [data], constraint, kernel)
+
+    def _collocate_variables(self, points, variables, constraint, kernel):
+        """
+        Collocate a list of GriddedData objects with the same coordinates onto the sample points, interpolating all of
+        their values together.
+
+        :return UngriddedDataList: The collocated data, one object for each variable
+        """
+        from cis.collocation.gridded_interpolation import GriddedUngriddedInterpolator, \
+            GriddedUngriddedTimeStreamingInterpolator
+
         if constraint is not None and not isinstance(constraint, DummyConstraint):
             raise ValueError("A constraint cannot be specified for the GriddedUngriddedCollocator")
-        data_points = data
+        data = variables[0]
 
         # First fix the sample points so that they all fall within the same 360 degree longitude range
         _fix_longitude_range(points.coords(), points)
         # Then fix the data points so that they fall onto the same 360 degree longitude range as the sample points
-        _fix_longitude_range(points.coords(), data_points)
+        for var in variables:
+            _fix_longitude_range(points.coords(), var)
 
         log_memory_profile("GriddedUngriddedCollocator after data retrieval")
 
@@ -166,16 +492,31 @@ class GriddedUngriddedCollocator(Collocator):
 
         if self.interpolator is None:
             # Cache the interpolator
-            self.interpolator = GriddedUngriddedInterpolator(data, points, kernel, self.missing_data_for_missing_sample)
-
-        values = self.interpolator(data, fill_value=self.fill_value, extrapolate=self.extrapolate)
+            if self.stream_time:
+                interpolator = GriddedUngriddedTimeStreamingInterpolator
+            else:
+                interpolator = GriddedUngriddedInterpolator
+            self.interpolator = interpolator(data, points, kernel, self.missing_data_for_missing_sample,
+                                             cache_dir=self.index_cache_dir, recent_weights=self.recent_weights)
+            # Only keep the weights of this interpolation (of every time step when streaming through time)
+            for key in set(self.recent_weights) - set(self.interpolator.weights_keys):
+                del self.recent_weights[key]
+
+        if len(variables) == 1:
+            all_values = [self.interpolator(data, fill_value=self.fill_value, extrapolate=self.extrapolate,
+                                            workers=self.workers)]
+        else:
+            all_values = self.interpolator(variables, fill_value=self.fill_value, extrapolate=self.extrapolate,
+                                           workers=self.workers)
 
         log_memory_profile("GriddedUngriddedCollocator after running kernel on sample points")
 
-        metadata = Metadata(self.var_name or data.var_name, long_name=self.var_long_name or data.long_name,
-                            shape=values.shape, missing_value=self.fill_value, units=self.var_units or data.units)
-        set_standard_name_if_valid(metadata, data.standard_name)
-        return_data = UngriddedDataList([UngriddedData(values, metadata, points.coords())])
+        return_data = UngriddedDataList()
+        for var, values in zip(variables, all_values):
+            metadata = Metadata(self.var_name or var.var_name, long_name=self.var_long_name or var.long_name,
+                                shape=values.shape, missing_value=self.fill_value, units=self.var_units or var.units)
+            set_standard_name_if_valid(metadata, var.standard_name)
+            return_data.append(UngriddedData(values, metadata, points.coords()))
 
         log_memory_profile("GriddedUngriddedCollocator final")
 
@@ -258,14 +599,24 @@ class SepConstraint(PointConstraint):
 
 class SepConstraintKdtree(PointConstraint):
     """A separation constraint that uses a k-D tree to optimise spatial constraining.
-    If no horizontal separation parameter is supplied, this reduces to an exhaustive
-    search using the other parameter(s).
+    If no horizontal separation parameter is supplied, the data is instead indexed on time
+    (or altitude, or pressure) so that only the points within that separation of each
+    sample point are checked against the other parameter(s).
+
+    The k-D tree used for the horizontal separation is chosen by index_type: 'haversine' (the default) or
+    'cartesian', which uses scipy's cKDTree on points on the unit sphere with index_workers threads per query.
+
+    If index_cache_dir (or the CIS_INDEX_CACHE_DIR environment variable) is set, the indexes are cached in that
+    directory, to be re-used when collocating data with the same coordinates again.
     """
 
-    def __init__(self, h_sep=None, a_sep=None, p_sep=None, t_sep=None):
+    def __init__(self, h_sep=None, a_sep=None, p_sep=None, t_sep=None, index_type='haversine', index_workers=1,
+                 index_cache_dir=None):
         from cis.exceptions import InvalidCommandLineOptionError
+        from cis.collocation.haversinedistancekdtreeindex import HaversineDistanceKDTreeIndex
 
         self.haversine_distance_kd_tree_index = False
+        self.index_cache_dir = index_cache_dir
 
         super(SepConstraintKdtree, self).__init__()
 
@@ -273,7 +624,10 @@ class SepConstraintKdtree(PointConstraint):
         self.checks = []
         if h_sep is not None:
             self.h_sep = cis.utils.parse_distance_with_units_to_float_km(h_sep)
-            self.haversine_distance_kd_tree_index = None
+            try:
+                self.haversine_distance_kd_tree_index = HaversineDistanceKDTreeIndex(index_type, int(index_workers))
+            except ValueError as e:
+                raise InvalidCommandLineOptionError('Separation Constraint index options are invalid: ' + str(e))
         else:
             self.h_sep = None
 
@@ -294,6 +648,22 @@ class SepConstraintKdtree(PointConstraint):
                 raise InvalidCommandLineOptionError(e)
             self.checks.append(self.time_constraint)
 
+        if self.h_sep is None:
+            # Without a horizontal index, index the data on one of the other coordinates so that only the points
+            # within a window around each sample point need to be checked.
+            if t_sep is not None:
+                self.sorted_coordinate_index = data_index.SortedCoordinateIndex('time')
+                self._window_half_width = self.t_sep
+            elif a_sep is not None:
+                self.sorted_coordinate_index = data_index.SortedCoordinateIndex('altitude')
+                self._window_half_width = self.a_sep
+            elif p_sep is not None:
+                self.sorted_coordinate_index = data_index.SortedCoordinateIndex('air_pressure', log=True)
+                self._window_half_width = np.log(self.p_sep)
+
+    #: The maximum number of (sample point, data point) pairs to check at once when using the sorted coordinate index
+    max_pairs_per_block = 2 ** 24
+
     def time_constraint(self, points, ref_point):
         return (np.abs(points.time - ref_point.time) < self.t_sep).to_numpy().nonzero()[0]
 
@@ -314,6 +684,10 @@ class SepConstraintKdtree(PointConstraint):
                 point_indices = self.haversine_distance_kd_tree_index.find_points_within_distance(ref_point, self.h_sep)
                 self._add_cached_indices(ref_point, point_indices)
             con_points = data.iloc[point_indices]
+        elif self._get_sorted_coordinate_index() is not None:
+            index = self._get_sorted_coordinate_index()
+            (start,), (end,) = index.find_windows(np.ravel(ref_point[index.coord_name]), self._window_half_width)
+            con_points = data.iloc[np.sort(index.sort_order[start:end])]
         else:
             con_points = data
         for check in self.checks:
@@ -335,9 +709,18 @@ class SepConstraintKdtree(PointConstraint):
         sample_points_count = len(points)
 
         indices = False
+        checks = self.checks
 
         if self.haversine_distance_kd_tree_index and self.h_sep:
-            indices = self.haversine_distance_kd_tree_index.find_points_within_distance_sample(points, self.h_sep)
+            # Query all of the sample points against the data index at once, rather than building a second tree
+            offsets, neighbours = self.haversine_distance_kd_tree_index.find_points_within_distance_sample_csr(
+                points, self.h_sep)
+            indices = [neighbours[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        elif self._get_sorted_coordinate_index() is not None:
+            # All of the checks are applied when finding the neighbours from the index
+            offsets, neighbours = self.get_neighbour_indices(data_points, points, missing_data_for_missing_sample)
+            indices = [neighbours[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+            checks = []
 
         for i, p in points.iterrows():
 
@@ -355,11 +738,171 @@ class SepConstraintKdtree(PointConstraint):
                     d_points = data_points.iloc[indices[i]]
                 else:
                     d_points = data_points
-                for check in self.checks:
+                for check in checks:
                     d_points = d_points.iloc[check(d_points, p)]
 
                 yield i, p, d_points
 
+    def get_neighbour_indices(self, data_points, points, missing_data_for_missing_sample=False):
+        """
+        Find the constrained data points for every sample point at once. The result is in a compressed sparse row
+        layout: the indices (into data_points) of the data points satisfying the constraint for sample point i are
+        ``indices[offsets[i]:offsets[i + 1]]``.
+
+        :param data_points: The (non-masked) data points, as a DataFrame
+        :param points: The sample points, as a DataFrame
+        :param missing_data_for_missing_sample: If true, sample points with a missing value get no data points
+        :return: Tuple of (offsets, indices) integer arrays
+        """
+        sample_points_count = len(points)
+        data_coords = self._get_check_coords(data_points)
+        sample_coords = self._get_check_coords(points)
+
+        if missing_data_for_missing_sample and hasattr(points, 'vals'):
+            missing_sample = np.isnan(points.vals.values)
+        else:
+            missing_sample = np.zeros(sample_points_count, dtype=bool)
+
+        if self.haversine_distance_kd_tree_index and self.h_sep:
+            offsets, indices = self.haversine_distance_kd_tree_index.find_points_within_distance_sample_csr(
+                points, self.h_sep)
+            counts = np.diff(offsets)
+
+            # Apply the remaining checks to all of the (sample point, data point) pairs in one go
+            sample_indices = np.repeat(np.arange(sample_points_count), counts)
+            keep = self._check_neighbours(data_coords, sample_coords, sample_indices, indices)
+            keep &= ~missing_sample[sample_indices]
+            indices = indices[keep]
+            counts = np.bincount(sample_indices[keep], minlength=sample_points_count)
+        elif self._get_sorted_coordinate_index() is not None:
+            counts, indices = self._get_neighbour_indices_from_windows(data_coords, sample_coords, points,
+                                                                       missing_sample)
+        else:
+            # Every data point is a candidate, so check one sample point at a time rather than materialising every
+            # (sample point, data point) pair at once.
+            all_indices = np.arange(len(data_points))
+            neighbours = []
+            for i in np.flatnonzero(~missing_sample):
+                neighbours.append(all_indices[self._check_neighbours(data_coords, sample_coords, i, all_indices)])
+            counts = np.zeros(sample_points_count, dtype=np.intp)
+            counts[~missing_sample] = [len(n) for n in neighbours]
+            indices = np.concatenate(neighbours) if neighbours else np.array([], dtype=np.intp)
+
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return offsets, indices
+
+    def _get_sorted_coordinate_index(self):
+        """
+        :return: The sorted coordinate index, if one has been created for the data, otherwise None
+        """
+        index = getattr(self, 'sorted_coordinate_index', None)
+        if index is not None and index.sorted_values is not None:
+            return index
+        return None
+
+    def _get_neighbour_indices_from_windows(self, data_coords, sample_coords, points, missing_sample):
+        """
+        Find the constrained data points for every sample point by checking only the data points within the window
+        of the sorted coordinate index around each one. The sample points are processed in blocks so that at most
+        max_pairs_per_block (sample point, data point) pairs are checked at once.
+
+        :return: Tuple of (number of data points for each sample point, data point indices) arrays
+        """
+        index = self._get_sorted_coordinate_index()
+        starts, ends = index.find_windows(points[index.coord_name].values, self._window_half_width)
+        ends[missing_sample] = starts[missing_sample]
+        cumulative_pairs = np.concatenate(([0], np.cumsum(ends - starts)))
+
+        sample_points_count = len(points)
+        counts = np.zeros(sample_points_count, dtype=np.intp)
+        indices = []
+        block_start = 0
+        while block_start < sample_points_count:
+            block_end = np.searchsorted(cumulative_pairs, cumulative_pairs[block_start] + self.max_pairs_per_block,
+                                        side='right') - 1
+            block_end = np.clip(block_end, block_start + 1, sample_points_count)
+            block = slice(block_start, block_end)
+
+            sample_indices, positions = cis.utils.expand_ranges(np.arange(block_start, block_end), starts[block],
+                                                                ends[block])
+            data_indices = index.sort_order[positions]
+            keep = self._check_neighbours(data_coords, sample_coords, sample_indices, data_indices)
+            sample_indices, data_indices = sample_indices[keep], data_indices[keep]
+
+            # Keep the data points for each sample point in their original order
+            order = np.lexsort((data_indices, sample_indices))
+            indices.append(data_indices[order])
+            counts[block] = np.bincount(sample_indices - block_start, minlength=block_end - block_start)
+            block_start = block_end
+
+        indices = np.concatenate(indices) if indices else np.array([], dtype=np.intp)
+        return counts, indices
+
+    def _get_check_coords(self, points):
+        """
+        Pull out the coordinate arrays needed by the (non-horizontal) checks from a DataFrame
+        """
+        coords = {}
+        if getattr(self, 'a_sep', None) is not None:
+            coords['altitude'] = points.altitude.values
+        if getattr(self, 'p_sep', None) is not None:
+            coords['air_pressure'] = points.air_pressure.values
+        if getattr(self, 't_sep', None) is not None:
+            coords['time'] = points.time.values
+        return coords
+
+    def _check_neighbours(self, data_coords, sample_coords, sample_indices, data_indices):
+        """
+        Vectorised equivalent of the alt, pressure and time constraints, for many (sample point, data point) pairs.
+
+        :param data_coords: Dictionary of data coordinate arrays, from _get_check_coords
+        :param sample_coords: Dictionary of sample coordinate arrays, from _get_check_coords
+        :param sample_indices: Index of the sample point in each pair (or a single sample index for all of them)
+        :param data_indices: Index of the data point in each pair
+        :return: Boolean array which is True for each pair which satisfies all of the constraints
+        """
+        keep = np.ones(len(data_indices), dtype=bool)
+        if 'altitude' in data_coords:
+            keep &= np.abs(data_coords['altitude'][data_indices] -
+                           sample_coords['altitude'][sample_indices]) < self.a_sep
+        if 'air_pressure' in data_coords:
+            data_pressure = data_coords['air_pressure'][data_indices]
+            sample_pressure = sample_coords['air_pressure'][sample_indices]
+            keep &= np.where(data_pressure > sample_pressure,
+                             data_pressure / sample_pressure, sample_pressure / data_pressure) < self.p_sep
+        if 'time' in data_coords:
+            keep &= np.abs(data_coords['time'][data_indices] - sample_coords['time'][sample_indices]) < self.t_sep
+        return keep
+
+
+def _reduce_segments(ufunc, values, offsets):
+    """
+    Reduce each segment ``values[offsets[i]:offsets[i + 1]]`` using the given ufunc, giving NaN for empty segments
+    (for which reduceat would otherwise return the following value).
+
+    :param ufunc: A binary numpy ufunc, e.g. np.add
+    :param values: The values of all segments, concatenated
+    :param offsets: Segment start (and final end) positions
+    :return: An array of length (number of segments)
+    """
+    non_empty = np.diff(offsets) > 0
+    result = np.full(len(offsets) - 1, np.nan)
+    if values.size:
+        result[non_empty] = ufunc.reduceat(values, offsets[:-1][non_empty])
+    return result
+
+
+def _segment_mean_and_stddev(values, offsets):
+    """
+    Calculate the mean and corrected sample standard deviation of each segment, using two passes for stability.
+    """
+    counts = np.diff(offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = _reduce_segments(np.add, values, offsets) / counts
+        deviations = values - np.repeat(means, counts)
+        stddevs = np.sqrt(_reduce_segments(np.add, deviations ** 2, offsets) / (counts - 1))
+    return means, stddevs
+
 
 # noinspection PyPep8Naming
 class mean(AbstractDataOnlyKernel):
@@ -373,6 +916,19 @@ class mean(AbstractDataOnlyKernel):
         """
         return np_mean(values)
 
+    def get_values_for_segments(self, values, offsets):
+        """
+        Return the mean of each segment
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (_reduce_segments(np.add, values, offsets) / np.diff(offsets))[np.newaxis, :]
+
+    def get_values_from_partial_aggregate(self, partial):
+        """
+        Return the mean of each cell of a :class:`cis.aggregation.partial_aggregation.PartialAggregate`
+        """
+        return partial.mean()[np.newaxis]
+
 
 # noinspection PyPep8Naming
 class stddev(AbstractDataOnlyKernel):
@@ -386,6 +942,18 @@ class stddev(AbstractDataOnlyKernel):
         """
         return np_std(values, ddof=1)
 
+    def get_values_for_segments(self, values, offsets):
+        """
+        Return the standard deviation of each segment
+        """
+        return _segment_mean_and_stddev(values, offsets)[1][np.newaxis, :]
+
+    def get_values_from_partial_aggregate(self, partial):
+        """
+        Return the standard deviation of each cell of a :class:`cis.aggregation.partial_aggregation.PartialAggregate`
+        """
+        return partial.stddev()[np.newaxis]
+
 
 # noinspection PyPep8Naming,PyShadowingBuiltins
 class min(AbstractDataOnlyKernel):
@@ -399,6 +967,18 @@ class min(AbstractDataOnlyKernel):
         """
         return np_min(values)
 
+    def get_values_for_segments(self, values, offsets):
+        """
+        Return the minimum value of each segment
+        """
+        return _reduce_segments(np.minimum, values, offsets)[np.newaxis, :]
+
+    def get_values_from_partial_aggregate(self, partial):
+        """
+        Return the minimum value of each cell of a :class:`cis.aggregation.partial_aggregation.PartialAggregate`
+        """
+        return partial.min()[np.newaxis]
+
 
 # noinspection PyPep8Naming,PyShadowingBuiltins
 class max(AbstractDataOnlyKernel):
@@ -412,6 +992,18 @@ class max(AbstractDataOnlyKernel):
         """
         return np_max(values)
 
+    def get_values_for_segments(self, values, offsets):
+        """
+        Return the maximum value of each segment
+        """
+        return _reduce_segments(np.maximum, values, offsets)[np.newaxis, :]
+
+    def get_values_from_partial_aggregate(self, partial):
+        """
+        Return the maximum value of each cell of a :class:`cis.aggregation.partial_aggregation.PartialAggregate`
+        """
+        return partial.max()[np.newaxis]
+
 
 class sum(AbstractDataOnlyKernel):
     """
@@ -424,6 +1016,18 @@ class sum(AbstractDataOnlyKernel):
         """
         return np_sum(values)
 
+    def get_values_for_segments(self, values, offsets):
+        """
+        Return the sum of the values in each segment
+        """
+        return _reduce_segments(np.add, values, offsets)[np.newaxis, :]
+
+    def get_values_from_partial_aggregate(self, partial):
+        """
+        Return the sum of the values of each cell of a :class:`cis.aggregation.partial_aggregation.PartialAggregate`
+        """
+        return partial.sum()[np.newaxis]
+
 
 # noinspection PyPep8Naming
 class moments(AbstractDataOnlyKernel):
@@ -461,98 +1065,193 @@ class moments(AbstractDataOnlyKernel):
 
         return np_mean(values), np_std(values, ddof=1), np.size(values)
 
+    def get_values_for_segments(self, values, offsets):
+        """
+        Returns the mean, standard deviation and number of values of each segment
+        """
+        means, stddevs = _segment_mean_and_stddev(values, offsets)
+        counts = np.diff(offsets).astype(float)
+        counts[counts == 0] = np.nan
+        return np.vstack((means, stddevs, counts))
 
-class nn_horizontal(Kernel):
-    def get_value(self, point, data):
+    def get_values_from_partial_aggregate(self, partial):
         """
-            Collocation using nearest neighbours along the face of the earth where both points and
-              data are a list of HyperPoints. The default point is the first point.
+        Return the mean, standard deviation and number of values of each cell of a
+        :class:`cis.aggregation.partial_aggregation.PartialAggregate`
         """
-        from cis.collocation.kdtree import haversine
-        iterator = data.iterrows()
-        try:
-            nearest_point = next(iterator)[1]
-        except StopIteration:
-            # No points to check
-            raise ValueError
-        for idx, data_point in iterator:
-            if (haversine(point, nearest_point) > haversine(point, data_point)):
-                nearest_point = data_point
-        return nearest_point.vals
+        return np.stack((partial.mean(), partial.stddev(), partial.num_points()))
 
 
-class nn_horizontal_only(Kernel):
+# noinspection PyPep8Naming
+class percentiles(AbstractDataOnlyKernel):
     """
-    Used to shortcut the constraint checks in dimensions other than the horizontal to allow quick kd-tree lookup
+    Calculate percentiles of the data points (with linear interpolation between the closest values, as
+    :func:`numpy.percentile`).
+
+    The values of every cell are sorted at once (by cell and then value) and the percentiles taken from each cell's
+    sorted values. In the approximate mode the percentiles are instead always calculated from a
+    :class:`~cis.aggregation.partial_aggregation.QuantileSketch` of the values, to within the given relative accuracy,
+    which uses a fixed amount of memory and can be used when aggregating files separately (giving the same result as
+    aggregating them together).
+
+    :param percentiles: The percentiles to calculate (between 0 and 100)
+    :param bool approximate: Calculate approximate percentiles from quantile sketches
+    :param float relative_accuracy: The relative accuracy of the approximate percentiles
     """
-    def get_value(self, point, data):
-        pass
 
+    def __init__(self, percentiles=(25, 50, 75), approximate=False, relative_accuracy=0.01):
+        self.percentiles = tuple(float(p) for p in percentiles)
+        if any(not 0 <= p <= 100 for p in self.percentiles):
+            raise ValueError("Percentiles must be between 0 and 100")
+        self.return_size = len(self.percentiles)
+        self.approximate = _parse_bool(approximate)
+        self.relative_accuracy = float(relative_accuracy)
 
-class nn_altitude(Kernel):
-    def get_value(self, point, data):
+    @property
+    def mergeable(self):
         """
-            Collocation using nearest neighbours in altitude, where both points and
-              data are a list of HyperPoints. The default point is the first point.
+        Only approximate percentiles can be calculated from partial aggregates
         """
-        iterator = data.iterrows()
-        try:
-            nearest_point = next(iterator)[1]
-        except StopIteration:
-            # No points to check
-            raise ValueError
-        for idx, data_point in iterator:
-            if abs(point.altitude - nearest_point.altitude) > abs(point.altitude - data_point.altitude):
-                nearest_point = data_point
-        return nearest_point.vals
+        return self.approximate
 
+    @property
+    def sketch_relative_accuracy(self):
+        """
+        The accuracy of the quantile sketches needed by this kernel, or None if it doesn't use them
+        """
+        return self.relative_accuracy if self.approximate else None
 
-class nn_pressure(Kernel):
+    def get_variable_details(self, var_name, var_long_name, var_standard_name, var_units):
+        """Sets name and units for each of the percentiles, based on those of the base variable.
+        :param var_name: base variable name
+        :param var_long_name: base variable long name
+        :param var_standard_name: base variable standard name
+        :param var_units: base variable units
+        :return: tuple of tuples each containing (variable name, variable long name, variable units)
+        """
+        return tuple((var_name + '_p{:g}'.format(p), '{:g}th percentile of {}'.format(p, var_long_name), None,
+                      var_units) for p in self.percentiles)
 
+    def get_value_for_data_only(self, values):
+        """
+        Return the percentiles of the values
+        """
+        if self.approximate:
+            result = self.get_values_for_segments(np.asarray(values), np.array([0, len(values)]))[:, 0]
+        else:
+            result = np.percentile(values, self.percentiles)
+        return result[0] if self.return_size == 1 else result
 
-    def get_value(self, point, data):
+    def get_values_for_segments(self, values, offsets):
+        """
+        Return the percentiles of each segment, sorting all of the segments at once (or from a quantile sketch of
+        them, in the approximate mode)
+        """
+        values = np.ma.getdata(values)
+        counts = np.diff(offsets)
+        segments = np.repeat(np.arange(len(counts)), counts)
+        if self.approximate:
+            from cis.aggregation.partial_aggregation import QuantileSketch
+            sketch = QuantileSketch.from_values(segments, values, self.relative_accuracy)
+            return sketch.percentiles(self.percentiles, len(counts))
+
+        sorted_values = values[np.lexsort((values, segments))]
+
+        result = np.full((self.return_size, len(counts)), np.nan)
+        non_empty = counts > 0
+        starts, counts = offsets[:-1][non_empty], counts[non_empty]
+        for i, percentile in enumerate(self.percentiles):
+            # Interpolate between the two values either side of the (fractional) rank of the percentile
+            rank = percentile / 100.0 * (counts - 1)
+            lower = np.floor(rank).astype(int)
+            upper = np.minimum(lower + 1, counts - 1)
+            lower_values, upper_values = sorted_values[starts + lower], sorted_values[starts + upper]
+            result[i, non_empty] = lower_values + (upper_values - lower_values) * (rank - lower)
+        return result
+
+    def get_values_from_partial_aggregate(self, partial):
         """
-            Collocation using nearest neighbours in pressure, where both points and
-              data are a list of HyperPoints. The default point is the first point.
+        Return the approximate percentiles of each cell of a
+        :class:`cis.aggregation.partial_aggregation.PartialAggregate` (which must have a quantile sketch)
         """
+        return partial.percentiles(self.percentiles)
 
-        def pres_sep(point1, point2):
-            """
-                Computes the pressure ratio between two points, this is always >= 1.
-            """
-            if point1.air_pressure > point2.air_pressure:
-                return point1.air_pressure / point2.air_pressure
-            else:
-                return point2.air_pressure / point1.air_pressure
 
-        iterator = data.iterrows()
-        try:
-            nearest_point = next(iterator)[1]
-        except StopIteration:
-            # No points to check
-            raise ValueError
-        for idx, data_point in iterator:
-            if pres_sep(point, nearest_point) > pres_sep(point, data_point):
-                nearest_point = data_point
-        return nearest_point.vals
+# noinspection PyPep8Naming
+class median(percentiles):
+    """
+    Calculate the median of the data points, see :class:`percentiles`
+    """
+
+    def __init__(self, approximate=False, relative_accuracy=0.01):
+        super(median, self).__init__([50], approximate, relative_accuracy)
+
+    def get_variable_details(self, var_name, var_long_name, var_standard_name, var_units):
+        return AbstractDataOnlyKernel.get_variable_details(self, var_name, var_long_name, var_standard_name, var_units)
 
 
-class nn_time(Kernel):
+# noinspection PyPep8Naming
+class approximate_median(median):
+    """
+    Calculate the approximate median of the data points using a fixed amount of memory, for example when streaming
+    aggregation, see :class:`percentiles`
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        super(approximate_median, self).__init__(True, relative_accuracy)
+
+
+class nn_horizontal(AbstractNearestNeighbourKernel):
+    """
+    Collocation using nearest neighbours along the face of the earth.
+    """
+    distance_coords = ('latitude', 'longitude')
+
+    def get_distances(self, sample_coords, data_coords):
+        from cis.collocation.kdtree import haversine
+        return haversine(np.column_stack((sample_coords['latitude'], sample_coords['longitude'])),
+                         np.column_stack((data_coords['latitude'], data_coords['longitude'])))
+
+
+class nn_horizontal_only(Kernel):
+    """
+    Used to shortcut the constraint checks in dimensions other than the horizontal to allow quick kd-tree lookup
+    """
     def get_value(self, point, data):
-        """
-            Collocation using nearest neighbours in time, where both points and
-              data are a list of HyperPoints. The default point is the first point.
-        """
-        iterator = data.iterrows()
-        try:
-            nearest_point = next(iterator)[1]
-        except StopIteration:
-            # No points to check
-            raise ValueError
-        for idx, data_point in iterator:
-            if abs(point.time - nearest_point.time) > abs(point.time - data_point.time):
-                nearest_point = data_point
-        return nearest_point.vals
+        pass
+
+
+class nn_altitude(AbstractNearestNeighbourKernel):
+    """
+    Collocation using nearest neighbours in altitude.
+    """
+    distance_coords = ('altitude',)
+
+    def get_distances(self, sample_coords, data_coords):
+        return np.abs(sample_coords['altitude'] - data_coords['altitude'])
+
+
+class nn_pressure(AbstractNearestNeighbourKernel):
+    """
+    Collocation using nearest neighbours in pressure, where the separation is the ratio of the pressures (which is
+    always >= 1).
+    """
+    distance_coords = ('air_pressure',)
+
+    def get_distances(self, sample_coords, data_coords):
+        sample_pressure, data_pressure = sample_coords['air_pressure'], data_coords['air_pressure']
+        return np.where(sample_pressure > data_pressure,
+                        sample_pressure / data_pressure, data_pressure / sample_pressure)
+
+
+class nn_time(AbstractNearestNeighbourKernel):
+    """
+    Collocation using nearest neighbours in time.
+    """
+    distance_coords = ('time',)
+
+    def get_distances(self, sample_coords, data_coords):
+        return np.abs(sample_coords['time'] - data_coords['time'])
 
 
 # These classes act as abbreviations for kernel classes above:
@@ -583,19 +1282,23 @@ class nn_t(nn_time):
 class GriddedCollocator(Collocator):
 
     def __init__(self, fill_value=None, var_name='', var_long_name='', var_units='',
-                 missing_data_for_missing_sample=False, extrapolate=False):
+                 missing_data_for_missing_sample=False, extrapolate=False, index_cache_dir=None, recent_weights=None):
         super(GriddedCollocator, self).__init__(fill_value, var_name, var_long_name, var_units,
                                                          missing_data_for_missing_sample)
         self.extrapolate = 'extrapolate' if extrapolate else 'mask'
+        self.index_cache_dir = index_cache_dir
+        # The most recently calculated area weights, which can be shared between collocators
+        self.recent_weights = {} if recent_weights is None else recent_weights
 
     @staticmethod
     def _check_for_valid_kernel(kernel):
         from cis.exceptions import ClassNotFoundError
 
-        if not (isinstance(kernel, gridded_gridded_nn) or isinstance(kernel, gridded_gridded_li)):
+        if not isinstance(kernel, (gridded_gridded_nn, gridded_gridded_li, gridded_gridded_area_weighted)):
             raise ClassNotFoundError("Expected kernel of one of classes {}; found one of class {}".format(
                 str([cis.utils.get_class_name(gridded_gridded_nn),
-                     cis.utils.get_class_name(gridded_gridded_li)]),
+                     cis.utils.get_class_name(gridded_gridded_li),
+                     cis.utils.get_class_name(gridded_gridded_area_weighted)]),
                 cis.utils.get_class_name(type(kernel))))
 
     def collocate(self, points, data, constraint, kernel):
@@ -613,6 +1316,9 @@ class GriddedCollocator(Collocator):
         # Force the data longitude range to be the same as that of the sample grid.
         _fix_longitude_range(points.coords(), data)
 
+        if isinstance(kernel, gridded_gridded_area_weighted):
+            return self._area_weighted_regrid(points, data)
+
         # Initialise variables used to create an output mask based on the sample data mask.
         sample_coord_lookup = {}  # Maps coordinate in sample data -> location in dimension order
         for idx, coord in enumerate(points.coords()):
@@ -690,6 +1396,56 @@ class GriddedCollocator(Collocator):
         else:
             return output_cube
 
+    def _area_weighted_regrid(self, points, data):
+        """
+        Regrid the data conservatively onto the latitude-longitude grid of the sample points. The area weights between
+        the grids are calculated once and applied to every variable and every other (e.g. time) slice of the data.
+
+        :param points: An Iris cube with the sampling grid to collocate onto.
+        :param data: The GriddedData or GriddedDataList to be collocated.
+        :return GriddedDataList: The collocated data
+        """
+        from cis.collocation import conservative_regridding, index_cache
+
+        variables = data if isinstance(data, list) else [data]
+        try:
+            lat, lon = variables[0].coord('latitude', dim_coords=True), variables[0].coord('longitude', dim_coords=True)
+            target_lat, target_lon = points.coord('latitude', dim_coords=True), points.coord('longitude',
+                                                                                          dim_coords=True)
+        except CoordinateNotFoundError:
+            raise cis.exceptions.CoordinateNotFoundError("Area weighted collocation requires latitude and longitude "
+                                                         "dimension coordinates in both the data and the sample grid")
+
+        weights = conservative_regridding.get_area_weights(lat, lon, target_lat, target_lon,
+                                                           index_cache.get_cache_dir(self.index_cache_dir),
+                                                           self.recent_weights)
+        output_mask = None
+        if self.missing_data_for_missing_sample and np.ma.is_masked(points.data) and points.ndim == 2:
+            output_mask = np.ma.getmaskarray(points.data)
+            if points.coord_dims(target_lat)[0] != 0:
+                output_mask = output_mask.T
+
+        output = GriddedDataList()
+        for var in variables:
+            lat_dim, lon_dim = var.coord_dims(lat)[0], var.coord_dims(lon)[0]
+            values = conservative_regridding.regrid(var.data, weights, lat_dim, lon_dim,
+                                                    (len(target_lat.points), len(target_lon.points)), output_mask)
+            if self.fill_value is not None:
+                values.fill_value = self.fill_value
+
+            dim_coords_and_dims = [(target_lat.copy(), lat_dim), (target_lon.copy(), lon_dim)]
+            dim_coords_and_dims.extend((c.copy(), var.coord_dims(c)[0]) for c in var.coords(dim_coords=True)
+                                       if c not in (lat, lon))
+            # Auxiliary coordinates on the source grid can't be kept
+            aux_coords_and_dims = [(c.copy(), var.coord_dims(c)) for c in var.coords(dim_coords=False)
+                                   if lat_dim not in var.coord_dims(c) and lon_dim not in var.coord_dims(c)]
+            regridded = iris.cube.Cube(values, standard_name=var.standard_name, long_name=var.long_name,
+                                       var_name=var.var_name, units=var.units, attributes=var.attributes,
+                                       cell_methods=var.cell_methods, dim_coords_and_dims=dim_coords_and_dims,
+                                       aux_coords_and_dims=aux_coords_and_dims)
+            output.append(make_from_cube(regridded))
+        return output
+
     @staticmethod
     def _make_output_mask(coord_names_and_sizes_for_sample_grid, output_shape, points, repeat_size):
         """ Creates a mask to apply to the output data based on the sample data mask. If there are coordinates in
@@ -771,6 +1527,17 @@ class gridded_gridded_li(Kernel):
         raise ValueError("gridded_gridded_li kernel selected for use with collocator other than GriddedCollocator")
 
 
+class gridded_gridded_area_weighted(Kernel):
+    def __init__(self):
+        self.name = 'area_weighted'
+
+    def get_value(self, point, data):
+        """Not needed for gridded/gridded collocation.
+        """
+        raise ValueError("gridded_gridded_area_weighted kernel selected for use with collocator other than "
+                         "GriddedCollocator")
+
+
 class GeneralGriddedCollocator(Collocator):
     """Performs collocation of data on to the points of a cube (ie onto a gridded dataset).
     """
@@ -847,7 +1614,14 @@ class GeneralGriddedCollocator(Collocator):
 
         logging.info("--> Co-locating...")
 
-        if hasattr(kernel, "get_value_for_data_only") and hasattr(constraint, "get_iterator_for_data_only"):
+        if _reduces_segments(kernel) and hasattr(constraint, "get_segments_for_data_only"):
+            # Reduce the data values in every cell at once
+            out_indices, data_values, offsets = constraint.get_segments_for_data_only(
+                self.missing_data_for_missing_sample, coord_map, data_points, points)
+            kernel_values = kernel.get_values_for_segments(data_values, offsets)
+            for val, kernel_val in zip(values, kernel_values):
+                val[out_indices] = kernel_val
+        elif hasattr(kernel, "get_value_for_data_only") and hasattr(constraint, "get_iterator_for_data_only"):
             # Iterate over constrained cells
             iterator = constraint.get_iterator_for_data_only(
                 self.missing_data_for_missing_sample, coord_map, coords, data_points, shape, points, values)
@@ -875,6 +1649,24 @@ class GeneralGriddedCollocator(Collocator):
         log_memory_profile("GeneralGriddedCollocator Completed collocation")
 
         # Construct an output cube containing the collocated data.
+        output = self._create_output_cubes(data, values, output_coords, coord_map, kernel)
+
+        log_memory_profile("GeneralGriddedCollocator Finished")
+
+        return output
+
+    def _create_output_cubes(self, data, values, output_coords, coord_map, kernel):
+        """
+        Create the output cubes from the collocated values of each of the kernel's outputs.
+
+        :param data: the data that was collocated, from which the metadata is taken
+        :param values: list of the (masked) arrays of collocated values for each kernel output, with their dimensions
+         in the order of the coordinates iterated over
+        :param output_coords: the coordinates iterated over
+        :param coord_map: list of tuples relating index in HyperPoint to index in coords and in coords iterated over
+        :param kernel: the kernel used
+        :return: GriddedDataList of the collocated data
+        """
         kernel_var_details = kernel.get_variable_details(self.var_name or data.var_name,
                                                          self.var_long_name or data.long_name,
                                                          data.standard_name,
@@ -901,8 +1693,6 @@ class GeneralGriddedCollocator(Collocator):
             cube.transpose(transpose_order)
             output.append(cube)
 
-        log_memory_profile("GeneralGriddedCollocator Finished")
-
         return output
 
     def _set_multi_value_kernel(self, kernel_val, values, indices):
@@ -1017,6 +1807,37 @@ class BinnedCubeCellOnlyConstraint(Constraint):
 
                 yield out_indices, hp, con_points
 
+    def get_segments_for_data_only(self, missing_data_for_missing_sample, coord_map, data_points, points):
+        """
+        Get the data values in all of the (non-empty) cells at once, as contiguous segments of one array, for kernels
+        which can reduce many segments at once (see :meth:`.AbstractDataOnlyKernel.get_values_for_segments`).
+
+        :param missing_data_for_missing_sample: If true anywhere there is missing data on the sample then final point is
+         missing; otherwise just use the sample
+        :param coord_map: list of tuples relating index in HyperPoint to index in coords and in coords to be iterated
+         over
+        :param data_points: The (non-masked) data points
+        :param points: The original points object, these are the points to collocate
+        :return: a tuple of the out indices of each cell (a tuple of arrays), the data values sorted by cell and the
+         offsets of each cell's values in them
+        """
+        index = self.grid_cell_bin_index_slices
+        first, out_indices, offsets = index.get_cell_segments()
+        data_values = data_points.data[index.sort_order[first:]]
+
+        if missing_data_for_missing_sample:
+            # Remap the indices to match the data coordinate order, using the coord_map provided
+            remapped_indices = out_indices[[c[2] for c in sorted(coord_map, key=lambda x: x[1])]]
+            sampled = ~np.ma.getmaskarray(points.data)[tuple(remapped_indices)]
+            if not sampled.all():
+                # Keep only the values in the sampled cells
+                starts, ends = offsets[:-1][sampled], offsets[1:][sampled]
+                data_values = data_values[cis.utils.expand_ranges(starts, starts, ends)[1]]
+                out_indices = out_indices[:, sampled]
+                offsets = np.concatenate(([0], np.cumsum(ends - starts)))
+
+        return tuple(out_indices), data_values, offsets
+
     def get_iterator_for_data_only(self, missing_data_for_missing_sample, coord_map, coords, data_points, shape, points,
                                    values):
         """
@@ -1095,6 +1916,22 @@ def _find_standard_coords(cube, coordinate_mask):
     return coord_map
 
 
+def _share_coordinates(data_list):
+    """Checks whether all of the ungridded data objects in a list are defined on exactly the same points
+    :param data_list: list of UngriddedData objects
+    :return: True if the coordinates of all of the data objects are equal
+    """
+    first = data_list[0]
+    for data in data_list[1:]:
+        if not isinstance(data, UngriddedData) or data.shape != first.shape:
+            return False
+        for coord in first.coords():
+            other_coords = data.coords(standard_name=coord.standard_name)
+            if len(other_coords) != 1 or not np.array_equal(other_coords[0].points, coord.points):
+                return False
+    return isinstance(first, UngriddedData)
+
+
 def _find_longitude_range(coords):
     """Finds the start of the longitude range, assumed to be either 0,360 or -180,180
     :param coords: coordinates to check
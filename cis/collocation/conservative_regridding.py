@@ -0,0 +1,155 @@
+"""
+Conservative, area-weighted regridding between rectilinear latitude-longitude grids.
+
+The weight of each source cell in each target cell is the area of their overlap on the sphere. Because the grids are
+rectilinear this is the product of the overlap of their latitude bands (in sine of latitude) and their longitude bands,
+so the (sparse) weight matrix is built as the Kronecker product of the two one-dimensional overlap matrices. The weights
+only depend on the two grids, so they are calculated once and reused for every field (and every time or vertical slice
+of each field) regridded between the same grids.
+"""
+import logging
+
+import numpy as np
+import scipy.sparse
+
+from cis.collocation import index_cache
+from cis.utils import expand_ranges
+
+#: The (approximate) number of source values to regrid at a time, so that the temporary arrays of regridding many
+#: (e.g. time or vertical) slices stay bounded in size
+REGRID_BLOCK_SIZE = 2 ** 22
+
+
+def _get_bounds(coord):
+    """
+    :param coord: A one dimensional coordinate
+    :return ndarray: The (n, 2) bounds of the coordinate, guessing them if the coordinate has none
+    """
+    if not coord.has_bounds():
+        coord = coord.copy()
+        coord.guess_bounds()
+    return np.sort(coord.bounds, axis=1)
+
+
+def overlap_matrix(source_bounds, target_bounds, modulus=None):
+    """
+    Calculate the length of the overlap of each of a set of target intervals with each of a set of (non-overlapping)
+    source intervals.
+
+    :param ndarray source_bounds: The (n_source, 2) bounds of the source intervals
+    :param ndarray target_bounds: The (n_target, 2) bounds of the target intervals
+    :param float modulus: If given, the intervals wrap around with this period (e.g. 360 for longitudes)
+    :return scipy.sparse.csr_matrix: The (n_target, n_source) overlaps
+    """
+    source_bounds, target_bounds = np.sort(source_bounds, axis=1), np.sort(target_bounds, axis=1)
+    order = np.argsort(source_bounds[:, 0], kind='mergesort')
+    lower, upper = source_bounds[order, 0], source_bounds[order, 1]
+    target_cells = np.arange(len(target_bounds))
+
+    rows, columns, overlaps = [], [], []
+    for shift in ([0.] if not modulus else [-modulus, 0., modulus]):
+        # The source intervals which start before the end of each target interval and end after its start
+        starts = np.searchsorted(upper + shift, target_bounds[:, 0], side='right')
+        ends = np.maximum(np.searchsorted(lower + shift, target_bounds[:, 1], side='left'), starts)
+        targets, sources = expand_ranges(target_cells, starts, ends)
+        overlap = (np.minimum(upper[sources] + shift, target_bounds[targets, 1]) -
+                   np.maximum(lower[sources] + shift, target_bounds[targets, 0]))
+        keep = overlap > 0
+        rows.append(targets[keep])
+        columns.append(order[sources[keep]])
+        overlaps.append(overlap[keep])
+
+    # Any repeated entries (which can only come from the wrapping) are summed
+    return scipy.sparse.csr_matrix((np.concatenate(overlaps), (np.concatenate(rows), np.concatenate(columns))),
+                                   shape=(len(target_bounds), len(source_bounds)))
+
+
+def _calculate_area_weights(source_lat_bounds, source_lon_bounds, target_lat_bounds, target_lon_bounds, modulus):
+    def sin_lat(bounds):
+        return np.sin(np.radians(np.clip(bounds, -90., 90.)))
+
+    lat_weights = overlap_matrix(sin_lat(source_lat_bounds), sin_lat(target_lat_bounds))
+    lon_weights = overlap_matrix(np.radians(source_lon_bounds), np.radians(target_lon_bounds),
+                                 np.radians(modulus) if modulus else None)
+    return scipy.sparse.kron(lat_weights, lon_weights, format='csr')
+
+
+def get_area_weights(source_lat, source_lon, target_lat, target_lon, cache_dir=None, recent_weights=None):
+    """
+    Get the area overlap weights between two rectilinear grids, reusing them if they have already been calculated
+    (either in the on-disk cache or most recently, in recent_weights).
+
+    :param source_lat: The latitude coordinate of the source grid
+    :param source_lon: The longitude coordinate of the source grid
+    :param target_lat: The latitude coordinate of the target grid
+    :param target_lon: The longitude coordinate of the target grid
+    :param str cache_dir: A directory in which to cache the weights (see :mod:`cis.collocation.index_cache`)
+    :param dict recent_weights: A dictionary holding the most recently used weights by their key, which is updated with
+     these weights, so that regridding other fields between the same grids doesn't need to recalculate them
+    :return scipy.sparse.csr_matrix: The (n_target_lat * n_target_lon, n_source_lat * n_source_lon) weights, with
+     the cells of each grid flattened in (latitude, longitude) order
+    """
+    bounds = [_get_bounds(c) for c in (source_lat, source_lon, target_lat, target_lon)]
+    modulus = source_lon.units.modulus
+    key = index_cache.make_key('area_weights', bounds, modulus=modulus)
+
+    weights = recent_weights.get(key) if recent_weights is not None else None
+    if weights is None and cache_dir is not None:
+        arrays = index_cache.load(cache_dir, key)
+        if arrays is not None:
+            logging.info("Using the cached area weights {}".format(key))
+            weights = scipy.sparse.csr_matrix((np.array(arrays['data']), np.array(arrays['indices']),
+                                               np.array(arrays['indptr'])), shape=tuple(arrays['shape']))
+
+    if weights is None:
+        weights = _calculate_area_weights(*(bounds + [modulus]))
+        if cache_dir is not None:
+            index_cache.save(cache_dir, key, {'data': weights.data, 'indices': weights.indices,
+                                              'indptr': weights.indptr, 'shape': np.array(weights.shape)})
+
+    if recent_weights is not None:
+        recent_weights.clear()
+        recent_weights[key] = weights
+    return weights
+
+
+def regrid(values, weights, lat_dim, lon_dim, target_shape, target_mask=None, block_size=None):
+    """
+    Regrid an array using the area overlap weights. Each target cell is the area weighted mean of the (non-masked)
+    source cells which overlap it, and is masked if there are none.
+
+    :param ndarray values: The (possibly masked) source values
+    :param scipy.sparse.csr_matrix weights: The area weights from get_area_weights
+    :param int lat_dim: The latitude dimension of the values
+    :param int lon_dim: The longitude dimension of the values
+    :param tuple target_shape: The (latitude, longitude) shape of the target grid
+    :param ndarray target_mask: An optional (latitude, longitude) mask of target cells to mask in the output
+    :param int block_size: The (approximate) number of source values to regrid at a time
+    :return np.ma.MaskedArray: The regridded values, with the target grid in place of the source grid dimensions
+    """
+    values = np.moveaxis(np.ma.asarray(values), [lat_dim, lon_dim], [0, 1])
+    other_shape = values.shape[2:]
+    n_other = int(np.prod(other_shape))
+    if not other_shape:
+        values = values[:, :, np.newaxis]
+    result_shape = (weights.shape[0], n_other)
+    result = np.ma.masked_array(np.empty(result_shape), mask=np.zeros(result_shape, dtype=bool))
+
+    # Regrid a block of the other (e.g. time) slices at a time, only taking a copy of the source values in that block
+    slices_per_block = max(1, (block_size or REGRID_BLOCK_SIZE) // max(weights.shape[1], 1))
+    for start in range(0, n_other, slices_per_block):
+        end = min(start + slices_per_block, n_other)
+        block = values[(slice(None), slice(None)) + np.unravel_index(np.arange(start, end), values.shape[2:])]
+        block = block.reshape((weights.shape[1], end - start))
+
+        valid = (~np.ma.getmaskarray(block)).astype(float)
+        total = weights.dot(np.ma.filled(block.astype(float), 0.) * valid)
+        area = weights.dot(valid)
+        no_data = area <= 0
+        result.data[:, start:end] = total / np.where(no_data, 1., area)
+        result.mask[:, start:end] = no_data
+
+    result = result.reshape(tuple(target_shape) + other_shape)
+    if target_mask is not None:
+        result[np.asarray(target_mask, dtype=bool)] = np.ma.masked
+    return np.moveaxis(result, [0, 1], [lat_dim, lon_dim])
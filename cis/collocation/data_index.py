@@ -2,16 +2,60 @@
 Indexes over data used for fast lookup when collocating.
 """
 import logging
-import math
 import datetime
 
 import numpy as np
 import numpy.ma as ma
 
+from cis.collocation import index_cache
 from cis.collocation.haversinedistancekdtreeindex import HaversineDistanceKDTreeIndex
+from cis.collocation.index_cache import make_key
 from cis.time_util import convert_datetime_to_std_time
 
 
+def _get_hyper_point_coord(hyper_points, hpi):
+    """
+    :return: the values of coordinate hpi of the hyper points, with any datetimes converted to standard time
+    """
+    hp_coord = hyper_points.coords[hpi]
+    if isinstance(hp_coord[0], datetime.datetime):
+        hp_coord = convert_datetime_to_std_time(hp_coord)
+    return hp_coord
+
+
+def _find_cell_indices(lower_bounds, values, max_bound, out):
+    """
+    Find the cell of a one dimensional grid which each value lies in.
+
+    The choice of 'right' in the search and '<' for the maximum determines which cell is chosen when a value is equal to
+    a boundary. When the cells are evenly spaced (such as an aggregation grid given by a start, end and delta) their
+    indices are calculated arithmetically rather than searched for, giving the same results.
+
+    :param ndarray lower_bounds: The (increasing) lower bounds of the cells
+    :param ndarray values: The values to find the cells of
+    :param float max_bound: The upper bound of the grid
+    :param ndarray out: An integer array, the same length as values, for the indices of the cells - or -1 if the value
+     is outside the grid
+    """
+    num_cells = len(lower_bounds)
+    delta = (lower_bounds[-1] - lower_bounds[0]) / (num_cells - 1) if num_cells > 1 else 0
+    if delta > 0 and np.allclose(np.diff(lower_bounds), delta, rtol=1e-6, atol=0):
+        with np.errstate(invalid='ignore'):
+            cell = np.floor((values - lower_bounds[0]) / delta)
+        np.clip(np.nan_to_num(cell), 0, num_cells - 1, out=cell)
+        out[:] = cell
+        # Correct the (at most one cell) rounding errors, so that values on a boundary match the search
+        out[values < lower_bounds[out]] -= 1
+        np.clip(out, 0, num_cells - 1, out=out)
+        next_cell = np.minimum(out + 1, num_cells - 1)
+        out[(next_cell > out) & (values >= lower_bounds[next_cell])] += 1
+        out[values < lower_bounds[0]] = -1
+    else:
+        out[:] = np.searchsorted(lower_bounds, values, side='right') - 1
+    with np.errstate(invalid='ignore'):
+        out[~(values < max_bound)] = -1
+
+
 class GridCellBinIndexInSlices(object):
     def __init__(self):
         # cells numbers for each hyperpoint
@@ -53,67 +97,42 @@ class GridCellBinIndexInSlices(object):
                 if coord.points[1] < coord.points[0]:
                     coord_descreasing[shi] = True
             coord_lengths[shi] = len(coord.points)
-            if coord_descreasing[shi]:
+            hp_coord = _get_hyper_point_coord(hyper_points, hpi)
+            if hasattr(coord, 'bin_values'):
+                # The cells of this coordinate (such as the bins of a calendar cycle) are found from a transformation of
+                # the values, with their own (increasing) bounds
+                lower_bounds[shi] = coord.bin_lower_bounds
+                max_bounds[shi] = coord.bin_max_bound
+                hp_coord = coord.bin_values(hp_coord)
+            elif coord_descreasing[shi]:
                 lower_bounds[shi] = coord.bounds[::-1, 1]
                 max_bounds[shi] = coord.bounds[0, 1]
             else:
                 lower_bounds[shi] = coord.bounds[::, 0]
                 max_bounds[shi] = coord.bounds[-1, 1]
 
-            hp_coord = hyper_points.coords[hpi]
-            if isinstance(hp_coord[0], datetime.datetime):
-                hp_coord = convert_datetime_to_std_time(hp_coord)
-
             hp_coords.append(hp_coord)
 
-        bounds_coords_max = list(zip(lower_bounds, hp_coords, max_bounds))
-
-        # stack for each coordinate
-        #    where the coordinate is larger than the maximum set to -1
-        #    otherwise search in the sorted coordinate to find all the index of the hyperpoints
-        # The choice of 'left' or 'right' and '<' and '<=' determines which
-        #  cell is chosen when the coordinate is equal to the boundary.
-        # -1 or M_i indicates the point is outside the grid.
-        # Output is a list of coordinates which lists the indexes where the hyper points
-        #    should be located in the grid
-        indices = np.vstack(
-            [np.where(
-                 ci < max_coordinate_value,
-                 np.searchsorted(bi, ci, side='right') - 1,
-                 -1)
-             for bi, ci, max_coordinate_value in bounds_coords_max])
-
-        # D-tuple giving the shape of the output grid
-        grid_shape = tuple(len(bi_ci[0]) for bi_ci in bounds_coords_max)
-
-        # shape (N,) telling which points actually fall within the grid,
-        # i.e. have indexes that are not -1 and are not masked data points
-        grid_mask = np.all(
-            (indices >= 0) &
-            (ma.getmaskarray(hyper_points.data) == False),
-            axis=0)
-
-        # if the coordinate was decreasing then correct the indices for this cell
-        for indices_slice, decreasing, coord_length in zip(range(indices.shape[0]), coord_descreasing, coord_lengths):
-            if decreasing:
-                # indices[indices_slice] += (coord_length - 1) - indices[indices_slice]
-                indices[indices_slice] *= -1
-                indices[indices_slice] += (coord_length - 1)
-
-        # shape (N,) containing negative scalar cell numbers for each
-        # input point (sequence doesn't matter so long as they are unique), or
-        # -1 for points outside the grid.
-        #
-        # Possibly numpy.lexsort could be used to avoid the need for this,
-        # although we'd have to be careful about points outside the grid.
-        self.cell_numbers = np.where(
-            grid_mask,
-            np.tensordot(
-                np.cumproduct((1,) + grid_shape[:-1]),
-                indices,
-                axes=1
-            ),
-            -1)
+        # For each coordinate find the index of the cell each hyper point lies in, or -1 where the point is outside the
+        # grid, and accumulate the (non-negative) scalar cell number of each point (sequence doesn't matter so long as
+        # they are unique), or -1 for points outside the grid or with masked data.
+        num_points = len(hp_coords[0]) if hp_coords else 0
+        indices = np.empty((len(hp_coords), num_points), dtype=np.int64)
+        self.cell_numbers = np.zeros(num_points, dtype=np.int64)
+        grid_mask = ~ma.getmaskarray(hyper_points.data).ravel()
+        stride = 1
+        for dim, (bi, ci, max_coordinate_value) in enumerate(zip(lower_bounds, hp_coords, max_bounds)):
+            _find_cell_indices(bi, np.asarray(ci), max_coordinate_value, out=indices[dim])
+            grid_mask &= indices[dim] >= 0
+
+            # if the coordinate was decreasing then correct the indices for this cell
+            if coord_descreasing[dim]:
+                indices[dim] *= -1
+                indices[dim] += (coord_lengths[dim] - 1)
+
+            self.cell_numbers += indices[dim] * stride
+            stride *= coord_lengths[dim]
+        self.cell_numbers[~grid_mask] = -1
 
         # Sort everything by cell number
         self.sort_order = np.argsort(self.cell_numbers)
@@ -121,6 +140,35 @@ class GridCellBinIndexInSlices(object):
         self._indices = indices[:, self.sort_order]
         self.hp_coords = [hp_coord[self.sort_order] for hp_coord in hp_coords]
 
+    def get_cache_key(self, coords, hyper_points, coord_map):
+        """
+        :return: the key for caching the index of the data (see :mod:`cis.collocation.index_cache`)
+        """
+        arrays = [np.ma.getmaskarray(hyper_points.data).ravel()]
+        for (hpi, ci, shi) in coord_map:
+            arrays.extend([coords[ci].points, coords[ci].bounds, _get_hyper_point_coord(hyper_points, hpi)])
+            if hasattr(coords[ci], 'time_range'):
+                arrays.append(np.asarray(coords[ci].time_range, dtype=float))
+        return make_key(self.__class__.__name__, arrays, coord_map=[tuple(m) for m in coord_map])
+
+    def get_cache_arrays(self):
+        """
+        :return: dictionary of the arrays to cache for this index, or None if there is no index to cache
+        """
+        if self.cell_numbers is None:
+            return None
+        return {'cell_numbers': self.cell_numbers, 'sort_order': self.sort_order, 'indices': self._indices,
+                'hp_coords': np.array(self.hp_coords)}
+
+    def set_cache_arrays(self, arrays):
+        """
+        Set the index from cached arrays (as returned by :meth:`get_cache_arrays`) instead of indexing the data.
+        """
+        self.cell_numbers = arrays['cell_numbers']
+        self.sort_order = arrays['sort_order']
+        self._indices = arrays['indices']
+        self.hp_coords = list(arrays['hp_coords'])
+
     def get_iterator(self):
         """
         Get an iterator through all the points which will contribute to a cell.
@@ -164,10 +212,57 @@ class GridCellBinIndexInSlices(object):
             out_indices = tuple(self._indices[:, cell_slice_indices[0]])
             yield out_indices, cell_slice_indices
 
+    def get_cell_segments(self):
+        """
+        Get all of the non-empty cells at once, as the segments of the sorted points which fall in each of them.
+
+        :return: a tuple of the first sorted point in the grid, the out indices of each non-empty cell (an array of
+         shape (number of grid dimensions, number of cells)) and the offsets of each cell's points relative to the first
+         point (length number of cells + 1) - so the points in cell i are
+         ``sort_order[first + offsets[i]:first + offsets[i + 1]]``
+        """
+        # Points outside the grid have a cell number of -1, so are sorted before all the others
+        first = int(np.searchsorted(self.cell_numbers, 0))
+        cell_numbers = self.cell_numbers[first:]
+        starts = np.flatnonzero(np.concatenate(([True], cell_numbers[1:] != cell_numbers[:-1])))[:cell_numbers.size]
+        offsets = np.append(starts, cell_numbers.size)
+        return first, self._indices[:, first + starts], offsets
+
+
+def _get_point_coord_values(data, hpi):
+    """
+    :param data: the data points, as a HyperPointView or a list of HyperPoints
+    :param hpi: the index of the coordinate in a HyperPoint
+    :return: the values of the coordinate at each of the data points (flattened, for gridded data), with any datetimes
+     converted to standard time
+    """
+    if hasattr(data, 'dims_to_std_coords_map'):
+        # Gridded data only holds the coordinate along its dimension, so broadcast it over the other dimensions
+        dim = [d for d, sc_idx in data.dims_to_std_coords_map.items() if sc_idx == hpi][0]
+        shape = [1] * data.num_dimensions
+        shape[dim] = -1
+        values = np.asarray(data.coords[dim]).reshape(shape)
+        return np.broadcast_to(values, data.data.shape).ravel()
+    elif hasattr(data, 'coords'):
+        return np.asarray(_get_hyper_point_coord(data, hpi))
+    else:
+        values = [point[hpi] for point in data]
+        if len(values) > 0 and isinstance(values[0], datetime.datetime):
+            values = convert_datetime_to_std_time(values)
+        return np.asarray(values, dtype=float)
+
 
 class GridCellBinIndex(object):
     def __init__(self):
-        self.index = None
+        # indices of the (non-masked) data points which lie in the grid, sorted by the (flat) number of their cell
+        self.sort_order = None
+
+        # offsets of the points in each cell in sort_order, i.e. the points in the cell with flat number i are
+        # sort_order[cell_offsets[i]:cell_offsets[i + 1]]
+        self.cell_offsets = None
+
+        # shape of the grid (in the order of the coordinates to be iterated over)
+        self.shape = None
 
     def index_data(self, coords, data, coord_map):
         """
@@ -178,95 +273,164 @@ class GridCellBinIndex(object):
         :param coord_map: list of tuples relating index in HyperPoint to index in coords and in
                           coords to be iterated over
         """
-        # Create an index array matching the shape of the coordinates to be iterated over.
-        shape = []
-        for (hpi, ci, shi) in coord_map:
-            shape.append(len(coords[ci].points))
-        num_cell_indices = len(shape)
-
-        # Set a logging interval.
-        num_bin_checks = sum([math.log(x) for x in shape])
-        log_every_points = 2000000 / num_bin_checks
-        log_every_points -= log_every_points % 100
-        log_every_points = max(log_every_points, 100)
+        num_points = len(data)
+        shape = [0] * len(coord_map)
+        cell_indices = [None] * len(coord_map)
 
-        # Create the index, which will be an array containing of a lists of data points that are
-        # within each cell.
-        self.index = np.empty(tuple(shape), dtype=np.dtype(object))
-        self.index.fill(None)
+        # Only index the non-masked points
+        if getattr(data, 'data', None) is not None:
+            in_grid = ~ma.getmaskarray(data.data).ravel()
+        else:
+            in_grid = np.ones(num_points, dtype=bool)
 
-        coord_decreasing = [False] * len(coords)
-        coord_lengths = [0] * len(coords)
-        lower_bounds = [None] * len(coords)
-        upper_bounds = [None] * len(coords)
+        # Find the interval that each point resides in for each relevant coordinate.
         for (hpi, ci, shi) in coord_map:
             coord = coords[ci]
             # Coordinates must be monotonic; determine whether increasing or decreasing.
-            if len(coord.points) > 1:
-                if coord.points[1] < coord.points[0]:
-                    coord_decreasing[ci] = True
-            coord_lengths[ci] = len(coord.points)
-            if coord_decreasing[ci]:
-                lower_bounds[ci] = coord.bounds[::-1, 1]
-                upper_bounds[ci] = coord.bounds[::-1, 0]
+            decreasing = len(coord.points) > 1 and coord.points[1] < coord.points[0]
+            if decreasing:
+                lower_bounds, upper_bounds = coord.bounds[::-1, 1], coord.bounds[::-1, 0]
             else:
-                lower_bounds[ci] = coord.bounds[::, 0]
-                upper_bounds[ci] = coord.bounds[::, 1]
-
-        # Populate the index by finding the cell containing each data point.
-        num_points = len(data)
-        pt_count = 0
-        pt_total = 0
-        for pt_idx, point in data.enumerate_non_masked_points():
-            point_cell_indices = [None] * num_cell_indices
-
-            # Find the interval that the point resides in for each relevant coordinate.
-            for (hpi, ci, shi) in coord_map:
-                search_index = np.searchsorted(lower_bounds[ci], point[hpi], side='right') - 1
-                if (search_index >= 0) and (point[hpi] < upper_bounds[ci][search_index]):
-                    if coord_decreasing[ci]:
-                        point_cell_indices[shi] = coord_lengths[ci] - search_index - 1
-                    else:
-                        point_cell_indices[shi] = search_index
-
-            # Add point to index if a containing interval was found for each coordinate.
-            if point_cell_indices.count(None) == 0:
-                index_entry = self.index[tuple(point_cell_indices)]
-                if index_entry is None:
-                    index_entry = []
-                index_entry.append(pt_idx)
-                self.index[tuple(point_cell_indices)] = index_entry
-
-            # Periodically log progress.
-            pt_count += 1
-            pt_total += 1
-            if pt_count == log_every_points:
-                logging.info("    Indexed %d points of %d (%d%%)",
-                             pt_total, num_points, int(pt_total * 100 / num_points))
-                pt_count = 0
+                lower_bounds, upper_bounds = coord.bounds[:, 0], coord.bounds[:, 1]
+            shape[shi] = len(coord.points)
+
+            values = _get_point_coord_values(data, hpi)
+            search_index = np.searchsorted(lower_bounds, values, side='right') - 1
+            in_interval = search_index >= 0
+            in_interval[in_interval] = values[in_interval] < upper_bounds[search_index[in_interval]]
+            in_grid &= in_interval
+            cell_indices[shi] = shape[shi] - search_index - 1 if decreasing else search_index
+
+        # Sort the points which were found in a cell for every coordinate by their (flat) cell number
+        points_in_grid = np.flatnonzero(in_grid)
+        cell_numbers = np.ravel_multi_index([indices[points_in_grid] for indices in cell_indices], shape)
+        order = np.argsort(cell_numbers, kind='mergesort')
+        self.sort_order = points_in_grid[order]
+        self.cell_offsets = np.searchsorted(cell_numbers[order], np.arange(int(np.prod(shape)) + 1), side='left')
+        self.shape = tuple(shape)
+        logging.info("    Indexed %d points of %d", self.sort_order.size, num_points)
 
     def get_points_by_indices(self, indices):
-        return self.index[tuple(indices)]
+        """
+        :param indices: the indices of a grid cell
+        :return: array of the indices of the data points in the cell, or None if there are none
+        """
+        cell_number = np.ravel_multi_index(tuple(indices), self.shape)
+        start, end = self.cell_offsets[cell_number], self.cell_offsets[cell_number + 1]
+        if start == end:
+            return None
+        return self.sort_order[start:end]
+
+
+class SortedCoordinateIndex(object):
+    """
+    Index over a single coordinate of the data points (e.g. time), which are sorted so that the points within a window
+    around any value can be found by binary search.
+
+    :param coord_name: the name of the coordinate (i.e. the column of the data points) to index
+    :param log: if True the logarithm of the coordinate is indexed, so that a window of a fixed ratio (as used for
+     pressure) has a fixed width
+    """
+    def __init__(self, coord_name, log=False):
+        self.coord_name = coord_name
+        self.log = log
+
+        # data point indices in order of increasing coordinate value
+        self.sort_order = None
+
+        # the (transformed) coordinate values in that order
+        self.sorted_values = None
+
+    def index_data(self, points, data, coord_map):
+        """
+        Creates the index.
+
+        :param points: (not used) sample points
+        :param data: DataFrame of the data points to index
+        :param coord_map: (not used) list of tuples relating index in HyperPoint
+                          to index in sample point coords and in coords to be output
+        """
+        try:
+            values = self._transform(np.asarray(data[self.coord_name], dtype=float))
+        except (KeyError, TypeError, ValueError):
+            return  # Unable to create index
+        self.sort_order = np.argsort(values, kind='stable')
+        self.sorted_values = values[self.sort_order]
+
+    def get_cache_key(self, points, data, coord_map):
+        """
+        :return: the key for caching the index of the data (see :mod:`cis.collocation.index_cache`)
+        """
+        return make_key(self.__class__.__name__, [np.asarray(data[self.coord_name], dtype=float)],
+                        coord_name=self.coord_name, log=self.log)
+
+    def get_cache_arrays(self):
+        """
+        :return: dictionary of the arrays to cache for this index, or None if there is no index to cache
+        """
+        if self.sort_order is None:
+            return None
+        return {'sort_order': self.sort_order, 'sorted_values': self.sorted_values}
+
+    def set_cache_arrays(self, arrays):
+        """
+        Set the index from cached arrays (as returned by :meth:`get_cache_arrays`) instead of indexing the data.
+        """
+        self.sort_order = arrays['sort_order']
+        self.sorted_values = arrays['sorted_values']
+
+    def _transform(self, values):
+        if self.log:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.log(values)
+        return values
+
+    def find_windows(self, values, half_width):
+        """
+        Find the data points with coordinate within half_width (inclusive) of each of the given values. The window is
+        widened by a few units in the last place so that no points which satisfy a strict check of the separation get
+        left out by rounding.
+
+        :param values: array of the coordinate values to search around
+        :param half_width: the half width of the window, in the (transformed) coordinate units
+        :return: tuple of (starts, ends) arrays, such that the data points in the window around values[i] are
+         ``self.sort_order[starts[i]:ends[i]]``
+        """
+        values = self._transform(np.asarray(values, dtype=float))
+        half_width = half_width + 4 * np.spacing(np.abs(values) + half_width)
+        return (np.searchsorted(self.sorted_values, values - half_width, side='left'),
+                np.searchsorted(self.sorted_values, values + half_width, side='right'))
 
 
 # Map of names of attributes of a constraint or kernel to the class used to
 # create an index to which the attribute should be set
 _index_attributes = {'grid_cell_bin_index': GridCellBinIndex,
                      'grid_cell_bin_index_slices': GridCellBinIndexInSlices,
-                     'haversine_distance_kd_tree_index': HaversineDistanceKDTreeIndex}
+                     'haversine_distance_kd_tree_index': HaversineDistanceKDTreeIndex,
+                     'sorted_coordinate_index': SortedCoordinateIndex}
 
 
 def create_indexes(operator, coords, data, coord_map):
     """
+    The indexes are read from (and added to) the on-disk index cache if it is enabled, either by the operator's
+    index_cache_dir attribute or the environment (see :mod:`cis.collocation.index_cache`).
+
     :param operator: constraint or kernel instance
     :param coords: coordinates of grid
     :param data: list of HyperPoints to index
     :param coord_map: list of tuples relating index in HyperPoint to index in coords and in
                       coords to be iterated over
     """
+    cache_dir = index_cache.get_cache_dir(getattr(operator, 'index_cache_dir', None))
     for attr, cls in _index_attributes.items():
         if hasattr(operator, attr):
-            index = cls()
+            # Use an index which the operator has already configured, otherwise create a default one
+            index = getattr(operator, attr)
+            if not isinstance(index, cls):
+                index = cls()
             logging.info("--> Creating index for %s", operator.__class__.__name__)
-            index.index_data(coords, data, coord_map)
+            if cache_dir is None:
+                index.index_data(coords, data, coord_map)
+            else:
+                index_cache.index_data(index, coords, data, coord_map, cache_dir)
             setattr(operator, attr, index)
@@ -18,10 +18,18 @@
 
 # There is no algorithmic change, just a restructuring to allow caching of the weights for calculating many
 #  interpolations of different datasets using the same points, and support for hybrid coordinates.
-# The two helper functions extend_circular_coord and _data are also taken from SciPy as the interpolate module is
-#  deprecated since Iris 1.10.
+# The helper function extend_circular_coord is also taken from SciPy as the interpolate module is deprecated since
+#  Iris 1.10. Rather than extending (or reversing) the data itself, circular and decreasing coordinates are handled by
+#  mapping the indices of the extended (or reversed) grid back onto the original array.
+import logging
+
 import numpy as np
 
+from cis.collocation import index_cache
+
+#: The default number of sample points to evaluate an interpolation for at a time
+EVALUATION_CHUNK_SIZE = 2 ** 16
+
 
 def extend_circular_coord(coord, points):
     """
@@ -35,19 +43,10 @@ def extend_circular_coord(coord, points):
     return points
 
 
-def extend_circular_data(data, coord_dim):
-    coord_slice_in_cube = [slice(None)] * data.ndim
-    coord_slice_in_cube[coord_dim] = slice(0, 1)
-
-    data = np.append(data,
-                     data[tuple(coord_slice_in_cube)],
-                     axis=coord_dim)
-    return data
-
-
 class GriddedUngriddedInterpolator(object):
 
-    def __init__(self, _data, sample, method='lin', missing_data_for_missing_sample=False):
+    def __init__(self, _data, sample, method='lin', missing_data_for_missing_sample=False, cache_dir=None,
+                 recent_weights=None):
         """
         Prepare an interpolation over the grid defined by a GriddedData source onto an UngriddedData sample.
 
@@ -57,12 +56,19 @@ class GriddedUngriddedInterpolator(object):
         :param GriddedData _data: The source data, only the coordinates are used from this at initialisation.
         :param UngriddedData sample: The points to sample the source data at.
         :param str method: The interpolation method to use (either 'linear' or 'nearest'). Default is 'linear'.
+        :param str cache_dir: A directory in which to cache the interpolation indices and weights, keyed by the grid
+         and sample coordinates, so that they can be reused rather than recalculated (see
+         :mod:`cis.collocation.index_cache`). Default is the ``CIS_INDEX_CACHE_DIR`` environment variable, if set.
+        :param dict recent_weights: A dictionary holding the weights of the most recent interpolation by their key,
+         which is updated with these weights, so that collocating other data on the same grid onto the same sample
+         points (for example the next datagroup of a 'cis col' command) doesn't need to recalculate them. Any other
+         weights in it are left for its owner to discard, using the keys in :attr:`weights_keys`
         """
         from cis.utils import move_item_to_end
         coords = []
         grid_points = []
-        self._circular_coord_dims = []
-        self._decreasing_coord_dims = []
+        # The index into each (transposed) dimension of the data of each grid point, where this isn't just the same
+        self._index_maps = {}
 
         # If we have hybrid coordinates then ensure that the vertical dimension of the cube is last, as we will be
         #  performing partial interpolations to pull out vertical columns - which only works if the vertical dim is last
@@ -73,8 +79,9 @@ class GriddedUngriddedInterpolator(object):
         else:
             self._data_transpose = list(range(_data.ndim))
 
-        # Unfortunately transpose works in place, so make a copy of the data first
-        data = _data.copy()
+        # Unfortunately transpose works in place, so make a copy first - of only the coordinates, as the data values
+        #  aren't needed here
+        data = _data.copy(data=np.broadcast_to(np.zeros(1, dtype=_data.dtype), _data.shape))
         data.transpose(self._data_transpose)
 
         # Remove any tuples in the list that do not correspond to a dimension coordinate in the cube 'data'.
@@ -85,16 +92,20 @@ class GriddedUngriddedInterpolator(object):
                 coord_dim = data.coord_dims(coord)[0]
                 coord_points = coord.points
 
+                index_map = np.arange(coord_points.size)
                 decreasing = (coord_points.size > 1 and
                               coord_points[1] < coord_points[0])
                 if decreasing:
-                    self._decreasing_coord_dims.append(decreasing)
+                    index_map = index_map[::-1]
                     coord_points = coord_points[::-1]
 
                 if getattr(coord, 'circular', False):
-                    self._circular_coord_dims.append(coord_dim)
+                    # The extra grid point wraps around to the first
+                    index_map = np.append(index_map, index_map[0])
                     coord_points = extend_circular_coord(coord, coord_points)
 
+                if decreasing or getattr(coord, 'circular', False):
+                    self._index_maps[coord_dim] = index_map
                 grid_points.append(coord_points)
 
         sample_points = [sample.coord(c).data_flattened for c in coords]
@@ -102,15 +113,9 @@ class GriddedUngriddedInterpolator(object):
         if len(data.coords('altitude', dim_coords=False)) > 0 and sample.coords(standard_name='altitude'):
             hybrid_dims = data.coord_dims(data.coord('altitude'))
             hybrid_coord = data.coord('altitude').points
-            for coord_dim in self._circular_coord_dims:
-                # Lookup the dimension on the hybrid data array
-                hybrid_coord_dim = hybrid_dims.index(coord_dim)
-                hybrid_coord = extend_circular_data(hybrid_coord, hybrid_coord_dim)
             sample_points.append(sample.coord(standard_name="altitude").data_flattened)
         elif len(data.coords('air_pressure', dim_coords=False)) > 0 and sample.coords(standard_name='air_pressure'):
             hybrid_coord = data.coord('air_pressure').points
-            for coord_dim in self._circular_coord_dims:
-                hybrid_coord = extend_circular_data(hybrid_coord, coord_dim)
             hybrid_dims = data.coord_dims(data.coord('air_pressure'))
             sample_points.append(sample.coord(standard_name="air_pressure").data_flattened)
         else:
@@ -128,8 +133,101 @@ class GriddedUngriddedInterpolator(object):
         else:
             self.missing_mask = None
 
-        self._interp = _RegularGridInterpolator(grid_points, sample_points,
-                                                hybrid_coord=hybrid_coord, hybrid_dims=hybrid_dims, method=method)
+        self._interp = self._create_interpolator(grid_points, sample_points, hybrid_coord, hybrid_dims, method,
+                                                 index_cache.get_cache_dir(cache_dir), recent_weights)
+
+        # Only the block of grid cells around the sample points needs to be read from the data
+        hyperslab = self._interp.restrict_to_hyperslab()
+        self._hyperslab_slices, self._hyperslab_indices = self._find_data_hyperslab(hyperslab)
+
+    def _create_interpolator(self, grid_points, sample_points, hybrid_coord, hybrid_dims, method, cache_dir,
+                             recent_weights):
+        """
+        Create the interpolator, reusing the indices and weights of an identical interpolation if they have been
+        calculated before (either in the on-disk cache or most recently, in recent_weights).
+
+        :return _RegularGridInterpolator: The interpolator
+        """
+        index_map_dims = sorted(self._index_maps)
+        arrays = grid_points + sample_points + ([] if hybrid_coord is None else [hybrid_coord])
+        arrays.extend(self._index_maps[dim] for dim in index_map_dims)
+        if self.missing_mask is not None:
+            arrays.append(self.missing_mask)
+        try:
+            # The (reversed or circular) index maps and the transpose of the data change how the hybrid coordinate is
+            #  mapped onto the grid, so are part of the key as well as the points
+            key = index_cache.make_key('GriddedUngriddedInterpolator', arrays, method=method,
+                                       hybrid_dims=None if hybrid_dims is None else tuple(hybrid_dims),
+                                       index_map_dims=tuple(index_map_dims),
+                                       data_transpose=tuple(self._data_transpose))
+        except TypeError:
+            key = None  # Unable to cache this interpolation
+
+        weights = recent_weights.get(key) if key is not None and recent_weights is not None else None
+        if weights is None and key is not None and cache_dir is not None:
+            weights = index_cache.load(cache_dir, key)
+            if weights is not None:
+                logging.info("Using the cached interpolation weights {}".format(key))
+
+        if weights is not None:
+            interp = _RegularGridInterpolator.from_arrays(grid_points, weights, hybrid_coord=hybrid_coord,
+                                                          method=method)
+        else:
+            hybrid_index_maps = None if hybrid_dims is None else [self._index_maps.get(dim) for dim in hybrid_dims]
+            interp = _RegularGridInterpolator(grid_points, sample_points, hybrid_coord=hybrid_coord,
+                                              hybrid_dims=hybrid_dims, method=method,
+                                              hybrid_index_maps=hybrid_index_maps)
+            if key is not None:
+                weights = interp.get_arrays()
+                if cache_dir is not None:
+                    index_cache.save(cache_dir, key, weights)
+
+        # The weights of earlier interpolations are pruned by the owner of recent_weights (see weights_keys), since a
+        #  time streaming interpolation needs to keep those of all of its steps
+        self.weights_keys = [] if key is None else [key]
+        if key is not None and recent_weights is not None:
+            recent_weights[key] = weights
+        return interp
+
+    def _find_data_hyperslab(self, hyperslab):
+        """
+        Find the part of the data which corresponds to a block of the interpolation grid, accounting for the circular
+        coordinates (which have been extended by one point) and decreasing coordinates (which have been reversed).
+
+        :param list hyperslab: (start, stop) of the block in each dimension of the grid
+        :return: a tuple of the slice of each dimension of the (transposed) data to read, and arrays of the indices into
+         each dimension of that slice giving the grid points of the block, or None where they are the whole slice
+        """
+        slices, indices = [], []
+        for dim, (start, stop) in enumerate(hyperslab):
+            grid_indices = self._index_maps[dim][start:stop] if dim in self._index_maps else np.arange(start, stop)
+            first, last = grid_indices.min(), grid_indices.max()
+            slices.append(slice(first, last + 1))
+            if np.array_equal(grid_indices, np.arange(first, last + 1)):
+                indices.append(None)
+            else:
+                indices.append(grid_indices - first)
+        return slices, indices
+
+    def _read_hyperslab(self, data):
+        """
+        Read only the part of the data which is needed for the interpolation. If the data is lazy (i.e. not yet read
+        from the file) this is all that is read.
+
+        :param GriddedData data: The data
+        :return ndarray: The (transposed) values of the data in the slice containing the block of the grid the
+         interpolator uses (which is mapped onto the grid using the hyperslab indices, rather than by copying it)
+        """
+        data_slices = [slice(None)] * data.ndim
+        for dim, dim_slice in zip(self._data_transpose, self._hyperslab_slices):
+            data_slices[dim] = dim_slice
+        data_array = data[tuple(data_slices)].data
+        if np.ndim(data_array) == data.ndim:
+            data_array = data_array.transpose(self._data_transpose)
+        else:
+            # A scalar cube
+            data_array = np.ma.asarray(data_array).reshape((1,) * data.ndim)
+        return data_array
 
     def _get_dims_order(self, data, coords):
         """
@@ -142,48 +240,150 @@ class GriddedUngriddedInterpolator(object):
         self._data_transpose.pop(vertical_dim)
         self._data_transpose.append(vertical_dim)
 
-    def _account_for_inverted(self, data):
-        dim_slices = [slice(None)] * data.ndim
-        for dim in self._decreasing_coord_dims:
-                dim_slices[dim] = slice(-1, None, -1)
-        data = data[tuple(dim_slices)]
-        return data
-
-    def __call__(self, data, fill_value=np.nan, extrapolate=False):
+    def __call__(self, data, fill_value=np.nan, extrapolate=False, workers=1):
         """
          Perform the prepared interpolation over the given data GriddedData object - this assumes that the coordinates
           used to initialise the interpolator are identical as those in this data object.
 
         If extrapolate is True then fill_value is ignored (since there will be no invalid values).
 
-        :param GriddedData data: Data values to interpolate
+        A list of GriddedData objects with the same coordinates can also be given, in which case their values are
+        stacked and interpolated together.
+
+        :param GriddedData or list data: Data values to interpolate
         :param float fill_value: The fill value to use for sample points outside of the bounds of the data
         :param bool extrapolate: Extrapolate points outside the bounds of the data? Default False.
-        :return ndarray: Interpolated values.
+        :param int workers: The number of threads to evaluate the interpolation with. Default 1.
+        :return ndarray: Interpolated values, or a list of interpolated values for each data object in a list
         """
         if extrapolate:
             fill_value = None
 
-        # Apply a transpose if we need to so that the indices line-up correctly
-        data_array = data.data.transpose(self._data_transpose)
-        # Account for any circular coords present
-        for dim in self._circular_coord_dims:
-            data_array = extend_circular_data(data_array, dim)
-
-        data_array = self._account_for_inverted(data_array)
+        if isinstance(data, list):
+            # Stack the variables along a trailing dimension, which the interpolation broadcasts over
+            data_array = np.ma.stack([self._read_hyperslab(d) for d in data], axis=-1)
+        else:
+            data_array = self._read_hyperslab(data)
 
-        result = self._interp(data_array, fill_value=fill_value)
+        result = self._interp(data_array, fill_value=fill_value, workers=workers, index_maps=self._hyperslab_indices)
 
         if self.missing_mask is not None:
             # Pack the interpolated values back into the original shape
-            expanded_result = np.ma.masked_array(np.zeros(self.missing_mask.shape), mask=self.missing_mask.copy(),
-                                                 fill_value=fill_value)
+            shape = self.missing_mask.shape + result.shape[1:]
+            mask = np.broadcast_to(self.missing_mask.reshape(self.missing_mask.shape + (1,) * (result.ndim - 1)), shape)
+            expanded_result = np.ma.masked_array(np.zeros(shape), mask=mask.copy(), fill_value=fill_value)
             expanded_result[~self.missing_mask] = result
             result = expanded_result
 
+        if isinstance(data, list):
+            return [result[..., i] for i in range(len(data))]
         return result
 
 
+class GriddedUngriddedTimeStreamingInterpolator(object):
+
+    def __init__(self, _data, sample, method='lin', missing_data_for_missing_sample=False, cache_dir=None,
+                 recent_weights=None):
+        """
+        Prepare an interpolation over the grid defined by a GriddedData source onto an UngriddedData sample, stepping
+        through the time dimension of the source.
+
+        The sample points are grouped by the pair of time steps of the source which bracket them, and each group is
+        interpolated separately using just those two time steps. This means only two time slices of the data need to be
+        in memory at once, so long time series of gridded data can be sampled without reading them all in.
+
+        :param GriddedData _data: The source data, only the coordinates are used from this at initialisation.
+        :param UngriddedData sample: The points to sample the source data at.
+        :param str method: The interpolation method to use (either 'linear' or 'nearest'). Default is 'linear'.
+        :param str cache_dir: A directory in which to cache the interpolation indices and weights of each time step
+        :param dict recent_weights: A dictionary holding the weights of the most recent interpolation, see
+         :class:`GriddedUngriddedInterpolator`
+        """
+        from cis.data_io.Coord import Coord, CoordList
+        from cis.data_io.ungridded_data import UngriddedCoordinates
+
+        if not _data.coords('time', dim_coords=True) or not sample.coords(standard_name='time'):
+            raise ValueError("Both the data and the sample points must have a time coordinate to step through time")
+        time_coord = _data.coord('time', dim_coords=True)
+        self._time_dim = _data.coord_dims(time_coord)[0]
+        self._size = sample.coord(standard_name='time').data_flattened.size
+
+        # Check if we want to sample missing points
+        if missing_data_for_missing_sample and hasattr(sample.data, 'mask'):
+            self.missing_mask = np.ma.getmaskarray(sample.data).flatten()
+        else:
+            self.missing_mask = None
+
+        time_steps = self._find_time_steps(time_coord.points, sample.coord(standard_name='time').data_flattened)
+        sample_indices = np.arange(self._size)
+        if self.missing_mask is not None:
+            time_steps, sample_indices = time_steps[~self.missing_mask], sample_indices[~self.missing_mask]
+
+        # Sort the sample points by time step so that each step is interpolated from a contiguous group of them
+        order = np.argsort(time_steps, kind='mergesort')
+        time_steps, sample_indices = time_steps[order], sample_indices[order]
+        group_starts = np.flatnonzero(np.r_[True, time_steps[1:] != time_steps[:-1]]) if time_steps.size else []
+        group_ends = np.r_[group_starts[1:], time_steps.size].astype(int)
+
+        self._steps = []
+        for start, end in zip(group_starts, group_ends):
+            time_slice = slice(time_steps[start], time_steps[start] + 2)
+            indices = sample_indices[start:end]
+            step_sample = UngriddedCoordinates(CoordList([Coord(c.data_flattened[indices], c.metadata)
+                                                          for c in sample.coords()]))
+            interpolator = GriddedUngriddedInterpolator(self._slice_time(_data, time_slice), step_sample, method,
+                                                        cache_dir=cache_dir, recent_weights=recent_weights)
+            self._steps.append((time_slice, indices, interpolator))
+        self.weights_keys = [key for _, _, interpolator in self._steps for key in interpolator.weights_keys]
+
+    @staticmethod
+    def _find_time_steps(times, sample_times):
+        """
+        Find the first of the pair of time steps which bracket each sample time. Sample times outside the time range
+        of the data are bracketed by the first or last pair.
+
+        :param ndarray times: The (monotonic) time points of the data
+        :param ndarray sample_times: The sample times
+        :return ndarray: The index of the first time step for each sample time
+        """
+        last_step = max(times.size - 2, 0)
+        if times.size > 1 and times[1] < times[0]:
+            steps = np.searchsorted(times[::-1], sample_times, side='right') - 1
+            return last_step - np.clip(steps, 0, last_step)
+        return np.clip(np.searchsorted(times, sample_times, side='right') - 1, 0, last_step)
+
+    def _slice_time(self, data, time_slice):
+        data_slices = [slice(None)] * data.ndim
+        data_slices[self._time_dim] = time_slice
+        return data[tuple(data_slices)]
+
+    def __call__(self, data, fill_value=np.nan, extrapolate=False, workers=1):
+        """
+        Perform the prepared interpolation over the given data GriddedData object, reading two time steps at a time.
+        This assumes that the coordinates used to initialise the interpolator are identical as those in this data
+        object.
+
+        :param GriddedData or list data: Data values to interpolate
+        :param float fill_value: The fill value to use for sample points outside of the bounds of the data
+        :param bool extrapolate: Extrapolate points outside the bounds of the data? Default False.
+        :param int workers: The number of threads to evaluate the interpolation with. Default 1.
+        :return ndarray: Interpolated values, or a list of interpolated values for each data object in a list
+        """
+        variables = data if isinstance(data, list) else [data]
+        results = [np.ma.masked_all(self._size) for _ in variables]
+        for time_slice, indices, interpolator in self._steps:
+            step_values = interpolator([self._slice_time(var, time_slice) for var in variables],
+                                       fill_value=fill_value, extrapolate=extrapolate, workers=workers)
+            for result, values in zip(results, step_values):
+                result[indices] = values
+
+        if fill_value is not None:
+            for result in results:
+                result.fill_value = fill_value
+
+        return results if isinstance(data, list) else results[0]
+
+
 def _ndim_coords_from_arrays(points, ndim=None):
     """
     Convert a tuple of coordinate arrays to a (..., ndim)-shaped array.
@@ -224,7 +424,7 @@ class _RegularGridInterpolator(object):
     # this class is based on code originally programmed by Johannes Buchner,
     # see https://github.com/JohannesBuchner/regulargrid
 
-    def __init__(self, coords, points, hybrid_coord=None, hybrid_dims=None, method="lin"):
+    def __init__(self, coords, points, hybrid_coord=None, hybrid_dims=None, method="lin", hybrid_index_maps=None):
         """
         Initialise the itnerpolator - this will calculate and cache the indices of the interpolation. It will
         also interpolate the hybrid coordinate if needed to determine a unique vertical index.
@@ -235,22 +435,10 @@ class _RegularGridInterpolator(object):
         :param iterable hybrid_dims: The grid dimensions over which the hybrid coordinate is defined
         :param str method: The method of interpolation to perform. Supported are "linear" and "nearest". Default is
         "linear".
+        :param list hybrid_index_maps: For each of the hybrid dims, an (optional) array giving the index in the hybrid
+        coordinate of each grid point - for grid coordinates which have been reversed or extended to wrap around
         """
-        if method == "lin":
-            self._interp = self._evaluate_linear
-        elif method == "nn":
-            self._interp = self._evaluate_nearest
-        else:
-            raise ValueError("Method '%s' is not defined" % method)
-
-        for i, c in enumerate(coords):
-            if not np.all(np.diff(c) > 0.):
-                raise ValueError("The points in dimension %d must be strictly "
-                                 "ascending" % i)
-            if not np.asarray(c).ndim == 1:
-                raise ValueError("The points in dimension %d must be "
-                                 "1-dimensional" % i)
-        self.grid = tuple([np.asarray(c) for c in coords])
+        self._set_grid(coords, hybrid_coord, method)
 
         if hybrid_coord is None:
             ndim = len(self.grid)
@@ -274,30 +462,97 @@ class _RegularGridInterpolator(object):
             hybrid_indices = [self.indices[i] for i in hybrid_interp_dims]
 
             # Find all of the interpolated vertical columns (one for each point)
-            v_coords = self._interp(hybrid_coord, hybrid_indices, self.norm_distances)
-
-            self.indices.append(np.zeros(len(points.T), dtype=self.indices[0].dtype))
-            self.norm_distances.append(np.zeros(len(points.T)))
+            v_coords = self._interp(hybrid_coord, hybrid_indices, self.norm_distances,
+                                    None if hybrid_index_maps is None else hybrid_index_maps[:-1])
 
             # Calculate and store the vertical index and weight for each point based on the interpolated vertical
             # column
-            # TODO: This loop could be a bottle-neck for many points, maybe move to Cython?
-            for i, p in enumerate(points.T):
-                vert_index, vert_norm_distance, vert_out_of_bounds = self._find_vertical_index(p[-1], v_coords[i])
-                self.indices[-1][i] = vert_index
-                self.norm_distances[-1][i] = vert_norm_distance
-                self.out_of_bounds[i] += vert_out_of_bounds
+            vert_indices, vert_norm_distances, vert_out_of_bounds = self._find_vertical_indices(points[-1], v_coords)
+            self.indices.append(vert_indices.astype(self.indices[0].dtype))
+            self.norm_distances.append(vert_norm_distances)
+            self.out_of_bounds += vert_out_of_bounds
 
         else:
             self.indices, self.norm_distances, self.out_of_bounds = self._find_indices(points.T, self.grid)
 
-    def __call__(self, values, fill_value=np.nan):
+    def _set_grid(self, coords, hybrid_coord, method):
+        if method == "lin":
+            self._interp = self._evaluate_linear
+        elif method == "nn":
+            self._interp = self._evaluate_nearest
+        else:
+            raise ValueError("Method '%s' is not defined" % method)
+
+        for i, c in enumerate(coords):
+            if not np.all(np.diff(c) > 0.):
+                raise ValueError("The points in dimension %d must be strictly "
+                                 "ascending" % i)
+            if not np.asarray(c).ndim == 1:
+                raise ValueError("The points in dimension %d must be "
+                                 "1-dimensional" % i)
+        self.grid = tuple([np.asarray(c) for c in coords])
+        self._vertical_size = 0 if hybrid_coord is None else np.shape(hybrid_coord)[-1]
+
+    def get_arrays(self):
+        """
+        :return dict: The calculated indices, weights and out of bounds flags of the interpolation by name, from which
+         the interpolator can be recreated using from_arrays
+        """
+        return {'indices': np.array(self.indices), 'norm_distances': np.array(self.norm_distances),
+                'out_of_bounds': np.asarray(self.out_of_bounds)}
+
+    @classmethod
+    def from_arrays(cls, coords, arrays, hybrid_coord=None, method="lin"):
+        """
+        Recreate an interpolator from the arrays returned by get_arrays, without recalculating the indices
+
+        :param iterable coords: The coords defining the regular grid in n dimensions. Should be a tuple of ndarrays
+        :param dict arrays: The arrays returned by get_arrays of the interpolator
+        :param ndarray hybrid_coord: An (optional) array describing a single vertical hybrid coordinate
+        :param str method: The method of interpolation to perform
+        :return _RegularGridInterpolator: The interpolator
+        """
+        interp = cls.__new__(cls)
+        interp._set_grid(coords, hybrid_coord, method)
+        interp.indices = list(np.array(arrays['indices']))
+        interp.norm_distances = list(np.array(arrays['norm_distances']))
+        interp.out_of_bounds = np.array(arrays['out_of_bounds'])
+        return interp
+
+    def restrict_to_hyperslab(self):
+        """
+        Restrict the interpolation to the smallest block of the grid which contains all of the grid points used for
+        the interpolation, so that it can be called with just the values on that block.
+
+        :return list: (start, stop) of the block in each dimension
+        """
+        hyperslab = []
+        for dim, indices in enumerate(self.indices):
+            size = len(self.grid[dim]) if dim < len(self.grid) else self._vertical_size
+            if len(indices) > 0:
+                # The linear and nearest neighbour interpolations use the points i and i + 1
+                start, stop = int(np.min(indices)), int(np.max(indices)) + 2
+            else:
+                start, stop = 0, 1
+            start, stop = max(start, 0), min(stop, size)
+            hyperslab.append((start, stop))
+            self.indices[dim] = indices - start
+            if dim < len(self.grid):
+                self.grid = self.grid[:dim] + (self.grid[dim][start:stop],) + self.grid[dim + 1:]
+        return hyperslab
+
+    def __call__(self, values, fill_value=np.nan, workers=1, chunk_size=None, index_maps=None):
         """
         Interpolation of values at cached coordinates
 
         :param ndarray values: The data on the regular grid in n dimensions
         :param float fill_value: If provided, the value to use for points outside of the interpolation domain. If None,
         values outside the domain are extrapolated.
+        :param int workers: The number of threads to evaluate the interpolation with
+        :param int chunk_size: The number of sample points to evaluate at a time, which bounds the size of the temporary
+        arrays. Default is EVALUATION_CHUNK_SIZE.
+        :param list index_maps: For each dimension, an (optional) array giving the index into values of each grid point
+        - where the grid has been reversed or extended to wrap around, so the values needn't be copied to match it
         :return ndarray: The interpolated values
         """
         if not hasattr(values, 'ndim'):
@@ -321,19 +576,66 @@ class _RegularGridInterpolator(object):
                                  "of a type compatible with values")
 
         for i, p in enumerate(self.grid):
-            if not values.shape[i] == len(p):
+            index_map = index_maps[i] if index_maps is not None else None
+            if index_map is None and not values.shape[i] == len(p):
                 raise ValueError("There are %d points and %d values in "
                                  "dimension %d" % (len(p), values.shape[i], i))
+            elif index_map is not None and not len(index_map) == len(p):
+                raise ValueError("There are %d points and %d mapped values in "
+                                 "dimension %d" % (len(p), len(index_map), i))
 
-        result = self._interp(values, self.indices, self.norm_distances)
+        result = self._evaluate_in_chunks(values, workers, chunk_size or EVALUATION_CHUNK_SIZE, index_maps)
 
         if fill_value is not None:
-            result = np.ma.array(result, mask=self.out_of_bounds, fill_value=fill_value)
+            mask = self.out_of_bounds
+            if np.ndim(result) > np.ndim(mask) > 0:
+                # Broadcast the mask over any trailing (stacked variable) dimensions of the values
+                mask = np.broadcast_to(np.reshape(mask, np.shape(mask) + (1,) * (np.ndim(result) - np.ndim(mask))),
+                                       np.shape(result))
+            result = np.ma.array(result, mask=mask, fill_value=fill_value)
 
         return result
 
+    def _evaluate_in_chunks(self, values, workers, chunk_size, index_maps=None):
+        """
+        Evaluate the interpolation over blocks of the sample points, in a pool of threads if more than one worker is
+        given. NumPy releases the GIL for most of the indexing and arithmetic, so the blocks are evaluated in parallel.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        n_points = len(self.indices[0]) if len(self.indices) > 0 else 0
+        if n_points <= chunk_size:
+            return self._interp(values, self.indices, self.norm_distances, index_maps)
+
+        def evaluate_chunk(start):
+            end = start + chunk_size
+            return self._interp(values, [i[start:end] for i in self.indices],
+                                [d[start:end] for d in self.norm_distances], index_maps)
+
+        starts = range(0, n_points, chunk_size)
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                chunks = pool.map(evaluate_chunk, starts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunks = [evaluate_chunk(start) for start in starts]
+        return np.ma.concatenate(chunks)
+
     @staticmethod
-    def _evaluate_linear(values, indices, norm_distances):
+    def _map_indices(indices, index_maps):
+        """
+        Map grid indices onto the indices of the values array, where the grid has been reversed or extended
+        """
+        if index_maps is None:
+            return tuple(indices)
+        return tuple(i if index_map is None else index_map[i] for i, index_map in zip(indices, index_maps)) + \
+            tuple(indices[len(index_maps):])
+
+    @staticmethod
+    def _evaluate_linear(values, indices, norm_distances, index_maps=None):
         from itertools import product
         # slice for broadcasting over trailing dimensions in self.values
         vslice = (slice(None),) + (None,)*(values.ndim - len(indices))
@@ -346,15 +648,16 @@ class _RegularGridInterpolator(object):
             weight = 1.
             for ei, i, yi in zip(edge_indices, indices, norm_distances):
                 weight *= np.where(ei == i, 1 - yi, yi)
-            value += np.ma.asarray(values[edge_indices]) * weight[vslice]
+            value_indices = _RegularGridInterpolator._map_indices(edge_indices, index_maps)
+            value += np.ma.asarray(values[value_indices]) * weight[vslice]
         return value
 
     @staticmethod
-    def _evaluate_nearest(values, indices, norm_distances):
+    def _evaluate_nearest(values, indices, norm_distances, index_maps=None):
         idx_res = []
         for i, yi in zip(indices, norm_distances):
             idx_res.append(np.where(yi <= .5, i, i + 1))
-        return values[tuple(idx_res)]
+        return values[_RegularGridInterpolator._map_indices(idx_res, index_maps)]
 
     @staticmethod
     def _find_indices(points, coords):
@@ -378,13 +681,35 @@ class _RegularGridInterpolator(object):
         return indices, norm_distances, out_of_bounds
 
     @staticmethod
-    def _find_vertical_index(point, coord):
-        i = np.searchsorted(coord, point) - 1
-        if i < 0:
-            i = 0
-        if i > coord.size - 2:
-            i = coord.size - 2
-        norm_distances = ((point - coord[i]) / (coord[i + 1] - coord[i]))
-
-        out_of_bounds = point < coord[0] or point > coord[-1]
-        return i, norm_distances, out_of_bounds
+    def _find_vertical_indices(points, columns, chunk_size=100000):
+        """
+        Find the vertical index and weight of each point in its own vertical column, for all of the points at once.
+        The columns may be either increasing or decreasing (e.g. pressure), independently of each other.
+
+        :param ndarray points: The vertical coordinate of each point (n_points)
+        :param ndarray columns: The vertical coordinate column at each point (n_points x n_levels)
+        :param int chunk_size: The number of points to compare with their columns at a time (to bound the memory used)
+        :return: The index of the lower level of each point, the normalised distance to it, and whether each point
+         is out of bounds of its column
+        """
+        columns = np.ma.filled(np.ma.asarray(columns, dtype=float), np.nan)
+        points = np.asarray(points, dtype=float)
+        # Work on increasing columns, converting the results back for decreasing ones at the end
+        decreasing = columns[:, -1] < columns[:, 0]
+        columns = np.where(decreasing[:, np.newaxis], columns[:, ::-1], columns)
+
+        # A row-wise search sorted (i.e. the number of levels below each point)
+        indices = np.empty(len(points), dtype=int)
+        for start in range(0, len(points), chunk_size):
+            end = start + chunk_size
+            indices[start:end] = np.sum(columns[start:end] < points[start:end, np.newaxis], axis=1)
+        indices = np.clip(indices - 1, 0, columns.shape[1] - 2)
+
+        rows = np.arange(len(points))
+        lower, upper = columns[rows, indices], columns[rows, indices + 1]
+        norm_distances = (points - lower) / (upper - lower)
+        out_of_bounds = (points < columns[:, 0]) | (points > columns[:, -1])
+
+        indices = np.where(decreasing, columns.shape[1] - 2 - indices, indices)
+        norm_distances = np.where(decreasing, 1 - norm_distances, norm_distances)
+        return indices, norm_distances, out_of_bounds
@@ -1,27 +1,44 @@
 import numpy as np
 
-from cis.collocation.kdtree import HaversineDistanceKDTree
+from cis.collocation.kdtree import HaversineDistanceKDTree, UnitSphereKDTree
 from cis.data_io.hyperpoint import HyperPoint
+from cis.utils import take_csr_rows
 
+#: The k-D tree implementations which can be used by the index
+backends = {'haversine': HaversineDistanceKDTree,
+            'cartesian': UnitSphereKDTree}
 
-def create_index(data, leafsize=10):
+
+def create_index(data, leafsize=10, backend='haversine', **kwargs):
     """
     Creates the k-D tree index.
 
     :param data: list of HyperPoints to index
+    :param leafsize: the number of points at which the tree switches over to brute-force
+    :param backend: the name of the tree implementation to use, one of :data:`backends`
+    :param kwargs: any other arguments for the tree implementation
     """
     spatial_points = data[['latitude', 'longitude']]
     if hasattr(data, 'data'):
         mask = np.ma.getmask(data.data).ravel()
     else:
         mask = None
-    return HaversineDistanceKDTree(spatial_points, mask=mask, leafsize=leafsize)
+    return backends[backend](spatial_points, mask=mask, leafsize=leafsize, **kwargs)
 
 
 class HaversineDistanceKDTreeIndex(object):
     """k-D tree index that can be used to query using distance along the Earth's surface.
+
+    :param backend: the tree implementation to use: 'haversine' (the default) for a k-D tree on latitude and
+     longitude using haversine distances, or 'cartesian' for scipy's cKDTree on points on the unit sphere
+    :param workers: the number of threads used by each query of the 'cartesian' backend, -1 uses all processors
     """
-    def __init__(self):
+    def __init__(self, backend='haversine', workers=1):
+        if backend not in backends:
+            raise ValueError("Unknown k-D tree index backend '{}', must be one of: {}".format(
+                backend, ', '.join(sorted(backends))))
+        self.backend = backend
+        self.workers = workers
         self.index = None
 
     def index_data(self, points, data, coord_map, leafsize=10):
@@ -34,16 +51,51 @@ class HaversineDistanceKDTreeIndex(object):
                           to index in sample point coords and in coords to be output
         """
         try:
-            self.index = create_index(data, leafsize=leafsize)
+            kwargs = {'workers': self.workers} if self.backend == 'cartesian' else {}
+            self.index = create_index(data, leafsize=leafsize, backend=self.backend, **kwargs)
         except KeyError:
             pass # Unable to create index
 
+    def get_cache_key(self, points, data, coord_map, leafsize=10):
+        """
+        :return: the key for caching the index of the data (see :mod:`cis.collocation.index_cache`), or None if the
+         index can't be cached
+        """
+        from cis.collocation.index_cache import make_key
+        if self.backend != 'haversine':
+            # The cKDTree of the cartesian backend is built in compiled code so isn't worth caching
+            return None
+        arrays = [np.asarray(data[['latitude', 'longitude']], dtype=float)]
+        if hasattr(data, 'data'):
+            arrays.append(np.ma.getmaskarray(data.data).ravel())
+        return make_key(self.__class__.__name__, arrays, backend=self.backend, leafsize=leafsize)
+
+    def get_cache_arrays(self):
+        """
+        :return: dictionary of the arrays to cache for this index, or None if there is no index to cache
+        """
+        if isinstance(self.index, HaversineDistanceKDTree):
+            return self.index.get_arrays()
+        return None
+
+    def set_cache_arrays(self, arrays):
+        """
+        Set the index from cached arrays (as returned by :meth:`get_cache_arrays`) instead of indexing the data.
+        """
+        self.index = HaversineDistanceKDTree.from_arrays(arrays)
+
     def find_nearest_point(self, point):
         """Finds the indexed point nearest to a specified point.
         :param point: point for which the nearest point is required
         :return: index in data of closest point
         """
         query_pt = point[['latitude', 'longitude']]
+        if np.ndim(query_pt) > 1:
+            # Only query each distinct location once
+            unique_points, inverse = _unique_points(query_pt)
+            if len(unique_points) < len(inverse):
+                (distances, indices) = self.index.query(unique_points)
+                return indices[inverse]
         (distances, indices) = self.index.query(query_pt)
         return indices
 
@@ -64,4 +116,32 @@ class HaversineDistanceKDTreeIndex(object):
         For each element ``self.data[i]`` of this tree, ``results[i]`` is a
             list of the indices of its neighbors in ``other.data``.
         """
-        return create_index(sample).query_ball_tree(self.index, distance)
+        return create_index(sample, backend=self.backend).query_ball_tree(self.index, distance)
+
+    def find_points_within_distance_sample_csr(self, sample, distance):
+        """Finds the points within a specified distance of each of the sample points, querying all of the sample points
+        in a single batch.
+        :param sample: the sample points
+        :param distance: distance in kilometres
+        :return: tuple of (offsets, indices) arrays such that ``indices[offsets[i]:offsets[i + 1]]`` are the indices in
+         data of the points near to sample point i
+        """
+        query_pts = sample[['latitude', 'longitude']]
+        unique_points, inverse = _unique_points(query_pts)
+        if len(unique_points) < len(inverse):
+            # Copy the neighbours of each distinct location back to all of the sample points there
+            offsets, indices = self.index.query_ball_point_csr(unique_points, distance)
+            return take_csr_rows(offsets, indices, inverse)
+        return self.index.query_ball_point_csr(query_pts, distance)
+
+
+def _unique_points(points):
+    """
+    Find the distinct latitude, longitude pairs, as sample points are often at the same few locations (e.g. stations).
+
+    :param points: (N, 2) array_like of latitude, longitude
+    :return: tuple of (the distinct points, the position in them of each of the points)
+    """
+    points = np.asarray(points, dtype=float)
+    unique_points, inverse = np.unique(points, axis=0, return_inverse=True)
+    return unique_points, inverse.ravel()
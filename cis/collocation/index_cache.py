@@ -0,0 +1,140 @@
+"""
+A persistent, on-disk cache of the indexes built over data points for collocation, so that collocating repeatedly with
+the same coordinates doesn't need to rebuild the same index every time.
+
+The cache is enabled by setting the ``CIS_INDEX_CACHE_DIR`` environment variable (or the ``index_cache_dir``
+collocator option) to a directory. Each index is stored there in a sub-directory of ``.npy`` files, named by a hash of
+the index type, its parameters and the coordinate values indexed (so any change to the input files gives a new entry).
+The arrays are memory-mapped when they are read back, so only the parts of the index which are used get read from disk.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+#: The environment variable which sets the cache directory when it is not given explicitly
+ENV_CACHE_DIR = "CIS_INDEX_CACHE_DIR"
+
+
+def get_cache_dir(cache_dir=None):
+    """
+    :param cache_dir: an explicitly given cache directory, or None
+    :return: the index cache directory to use, or None if the cache is not enabled
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(ENV_CACHE_DIR, None)
+    return cache_dir or None
+
+
+def make_key(index_name, arrays, **params):
+    """
+    Create the key for an index from its type, parameters and the arrays it indexes.
+
+    :param index_name: the name of the type of index
+    :param arrays: list of the (numeric) arrays indexed
+    :param params: any parameters which change the index built
+    :return: a hexadecimal hash string
+    :raises TypeError: if any of the arrays are not numeric
+    """
+    key = hashlib.sha1(index_name.encode('utf-8'))
+    for name in sorted(params):
+        key.update('{}={!r};'.format(name, params[name]).encode('utf-8'))
+    for array in arrays:
+        array = np.ascontiguousarray(np.ma.filled(array, np.nan) if np.ma.isMaskedArray(array) else array)
+        if array.dtype.hasobject:
+            raise TypeError("Unable to create an index cache key for an array of objects")
+        key.update('{}{};'.format(array.dtype.str, array.shape).encode('utf-8'))
+        key.update(array.tobytes())
+    return key.hexdigest()
+
+
+def load(cache_dir, key):
+    """
+    Read the (memory-mapped) arrays of a cached index.
+
+    :param cache_dir: the cache directory
+    :param key: the key of the index
+    :return: dictionary of the arrays by name, or None if the index is not in the cache
+    """
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        return None
+    arrays = {}
+    try:
+        for filename in os.listdir(path):
+            name, ext = os.path.splitext(filename)
+            if ext == '.npy':
+                try:
+                    arrays[name] = np.load(os.path.join(path, filename), mmap_mode='r', allow_pickle=False)
+                except ValueError:
+                    # Empty arrays can't be memory-mapped
+                    arrays[name] = np.load(os.path.join(path, filename), allow_pickle=False)
+    except (IOError, OSError, ValueError) as e:
+        logging.warning("Unable to read the cached index {}: {}".format(path, e))
+        return None
+    return arrays
+
+
+def save(cache_dir, key, arrays):
+    """
+    Write the arrays of an index to the cache. Failures are only logged, as the cache is just an optimisation.
+
+    :param cache_dir: the cache directory
+    :param key: the key of the index
+    :param arrays: dictionary of the arrays by name
+    """
+    path = os.path.join(cache_dir, key)
+    tmp_path = None
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a temporary directory first so that other processes never see a partial index
+        tmp_path = tempfile.mkdtemp(prefix='.' + key, dir=cache_dir)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(array), allow_pickle=False)
+        os.rename(tmp_path, path)
+        tmp_path = None
+        logging.info("Cached index in {}".format(path))
+    except (IOError, OSError) as e:
+        if not os.path.isdir(path):
+            logging.warning("Unable to cache the index in {}: {}".format(path, e))
+    finally:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def index_data(index, coords, data, coord_map, cache_dir):
+    """
+    Index the data, reading the index from the cache if it is there and adding it to the cache otherwise. Indexes are
+    only cached if they implement ``get_cache_key``, ``get_cache_arrays`` and ``set_cache_arrays``.
+
+    :param index: the index instance
+    :param coords: coordinates of grid
+    :param data: the data points to index
+    :param coord_map: list of tuples relating index in HyperPoint to index in coords and in
+                      coords to be iterated over
+    :param cache_dir: the cache directory
+    """
+    key = None
+    if hasattr(index, 'get_cache_key'):
+        try:
+            key = index.get_cache_key(coords, data, coord_map)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            key = None  # Unable to cache this index
+
+    if key is not None:
+        arrays = load(cache_dir, key)
+        if arrays is not None:
+            logging.info("Using the cached index {}".format(os.path.join(cache_dir, key)))
+            index.set_cache_arrays(arrays)
+            return
+
+    index.index_data(coords, data, coord_map)
+
+    if key is not None:
+        arrays = index.get_cache_arrays()
+        if arrays is not None:
+            save(cache_dir, key, arrays)
@@ -5,6 +5,7 @@
 
 
 
+import itertools
 import sys
 from heapq import heappush, heappop
 import math
@@ -12,6 +13,8 @@ import math
 import numpy as np
 import scipy.sparse
 
+from cis.utils import expand_ranges
+
 __all__ = ['minkowski_distance_p', 'minkowski_distance', 'haversine_distance',
            'distance_matrix',
            'Rectangle', 'KDTree']
@@ -1152,198 +1155,586 @@ class KDTree(object):
         return result
 
 
-class HaversineDistanceKDTree(KDTree):
-    """Modification of the scipy.spatial.KDTree class to allow querying for
-    nearest neighbours measured by distance along the Earth's surface.
+def _haversine_from_radians(lat1, lon1, lat2, lon2):
+    """Computes the Haversine distance in kilometres between (arrays of) points given in radians
+    """
+    arclen = 2 * np.arcsin(np.sqrt(np.minimum(np.sin((lat2 - lat1) / 2) ** 2 +
+                                              np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2, 1.0)))
+    return arclen * RADIUS_EARTH
+
+
+def _min_distance_to_rectangles(lat0, lon0, lat_min, lat_max, lon_min, lon_max):
+    """Vectorised equivalent of RectangleHaversine._min_distance_point: finds the distance from each point to the
+    nearest point in the corresponding latitude/longitude rectangle.
+    :param lat0: latitudes of the points in radians
+    :param lon0: longitudes of the points in radians
+    :param lat_min: lower latitudes of the rectangles in radians
+    :param lat_max: upper latitudes of the rectangles in radians
+    :param lon_min: lower longitudes of the rectangles in radians
+    :param lon_max: upper longitudes of the rectangles in radians
+    :return: distances in kilometres
+    """
+    # Shift point longitudes to be within pi of the rectangle mid-longitudes.
+    lon_mid = (lon_min + lon_max) / 2.0
+    lon0 = np.mod(lon0 - lon_mid + PI, TWO_PI) + lon_mid - PI
+
+    within_lon = (lon_min <= lon0) & (lon0 <= lon_max)
+    left = lon0 < lon_mid
+    lon1 = np.where(within_lon, lon0, np.where(left, lon_min, lon_max))
+    lon_diff = np.abs(lon0 - lon1)
+
+    # Latitude at which the geodesic of shortest distance to the nearest line of longitude crosses it, see
+    # geodesic_to_line_of_longitude_crossing_latitude.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sin_lat = np.sin(lat0) / np.sqrt(1 - np.cos(lat0) ** 2 * np.sin(lon0 - lon1) ** 2)
+    sin_lat = np.where(np.isfinite(sin_lat), sin_lat, 0.0)
+    crossing_lat = np.arcsin(np.clip(sin_lat, -1.0, 1.0))
+
+    # If the nearest point cannot be on the rectangle edge it must be a vertex, see
+    # line_of_longitude_segment_nearer_end_latitude.
+    tan_lat_equi = np.tan((lat_min + lat_max) / 2.0) * np.cos(lon0 - lon1)
+    vertex_lat = np.where(np.tan(lat0) < tan_lat_equi, lat_min, lat_max)
+
+    lat1 = np.where(within_lon, lat0, np.where(lon_diff > HALF_PI, vertex_lat, crossing_lat))
+    lat1 = np.clip(lat1, lat_min, lat_max)
+    return _haversine_from_radians(lat0, lon0, lat1, lon1)
+
+
+class HaversineDistanceKDTree(object):
+    """k-D tree for querying nearest neighbours measured by distance along the Earth's surface.
+
+    The tree is stored as flat arrays rather than node objects, and it is built and traversed iteratively (one tree
+    level at a time), answering queries for whole batches of points at once. Node i covers the data points
+    ``self.indices[self.node_start[i]:self.node_end[i]]``, which lie within the latitude/longitude rectangle
+    ``self.node_mins[i]``, ``self.node_maxes[i]``. Inner nodes are split on dimension ``self.split_dim[i]`` at value
+    ``self.split[i]``, with children ``self.children[i]`` (which are -1 for leaves).
+
+    :param data: (N, 2) array_like of latitude, longitude in degrees
+    :param leafsize: the number of points at which the tree switches over to brute-force
+    :param mask: (optional) boolean array of length N, True for points which should not be indexed
     """
 
+    #: The number of query points handled together in each batch, to bound the memory used by a traversal
+    query_block_size = 65536
+
+    #: The names of the arrays which completely describe a built tree. The data and node bounds are kept in radians as
+    #: well as degrees so that a tree read back from (memory-mapped) arrays needn't read them all to convert them.
+    array_names = ('data', 'data_radians', 'indices', 'node_start', 'node_end', 'node_mins', 'node_maxes',
+                   'node_mins_radians', 'node_maxes_radians', 'split_dim', 'split', 'children')
+
     def __init__(self, data, leafsize=10, mask=None):
-        self.data = np.ma.asarray(data)
-        if mask is not None:
-            self.data.mask = np.column_stack([mask] * data.shape[1])
+        self.data = np.asarray(data, dtype=float)
         self.n, self.m = np.shape(self.data)
         self.leafsize = int(leafsize)
         if self.leafsize < 1:
             raise ValueError("leafsize must be at least 1")
-        self.maxes = np.amax(self.data, axis=0)
-        self.mins = np.amin(self.data, axis=0)
 
+        self.data_radians = np.radians(self.data)
         indices = np.arange(self.n)
-        if mask is not None:
-            indices = np.ma.array(indices, mask=mask)
-            indices = indices.compressed()
-        self.tree = self._build(indices, self.maxes, self.mins)
+        if mask is not None and np.any(mask):
+            indices = indices[~np.asarray(mask, dtype=bool)]
+        self._build(indices)
 
-    def _query(self, x, k=1, eps=0, p=2, distance_upper_bound=np.inf):
+    def _build(self, indices):
+        """
+        Build the tree one level at a time. Each node is split at the midpoint of the widest dimension of the bounding
+        box of its points, so that both children are non-empty.
+        :param indices: the data indexes to put in the tree
+        """
+        data = self.data
+        starts, ends = np.array([0]), np.array([len(indices)])
+        level_nodes = []
+        first_node = 0
+
+        while len(starts) > 0:
+            n_nodes = len(starts)
+            counts = ends - starts
+            non_empty = counts > 0
+            mins = np.full((n_nodes, self.m), np.inf)
+            maxes = np.full((n_nodes, self.m), -np.inf)
+            if np.any(non_empty):
+                # Reduce over [start, end) of each node; the extra row allows an end of len(indices)
+                level_data = np.vstack((data[indices], np.zeros((1, self.m))))
+                bounds = np.column_stack((starts[non_empty], ends[non_empty])).ravel()
+                mins[non_empty] = np.minimum.reduceat(level_data, bounds)[::2]
+                maxes[non_empty] = np.maximum.reduceat(level_data, bounds)[::2]
+
+            with np.errstate(invalid='ignore'):
+                # Empty nodes have infinite bounds, but will always be leaves
+                split_dim = np.argmax(maxes - mins, axis=1)
+                widths = np.take_along_axis(maxes - mins, split_dim[:, np.newaxis], axis=1)[:, 0]
+                split = (np.take_along_axis(maxes, split_dim[:, np.newaxis], axis=1)[:, 0] +
+                         np.take_along_axis(mins, split_dim[:, np.newaxis], axis=1)[:, 0]) / 2.0
+            # Nodes with few points, or only identical points, become leaves
+            inner = (counts > self.leafsize) & (widths > 0)
+
+            children = np.full((n_nodes, 2), -1, dtype=np.intp)
+            children[inner] = first_node + n_nodes + 2 * np.arange(np.count_nonzero(inner))[:, np.newaxis] + [0, 1]
+            level_nodes.append((starts, ends, mins, maxes, np.where(inner, split_dim, -1), split, children))
+            first_node += n_nodes
+
+            if not np.any(inner):
+                break
+
+            # Partition the points of each inner node into those less than or equal to, and greater than, the split.
+            # A stable sort on (node, side) keeps every node's points contiguous.
+            inner_starts, inner_ends = starts[inner], ends[inner]
+            node_number, positions = expand_ranges(np.arange(len(inner_starts)), inner_starts, inner_ends)
+            point_values = data[indices[positions], split_dim[inner][node_number]]
+            greater = point_values > split[inner][node_number]
+            order = np.argsort(2 * node_number + greater, kind='stable')
+            indices[positions] = indices[positions[order]]
+
+            n_less = np.bincount(node_number[~greater], minlength=len(inner_starts))
+            starts = np.column_stack((inner_starts, inner_starts + n_less)).ravel()
+            ends = np.column_stack((inner_starts + n_less, inner_ends)).ravel()
+
+        self.indices = indices
+        self.node_start, self.node_end, self.node_mins, self.node_maxes, self.split_dim, self.split, self.children = \
+            [np.concatenate([level[i] for level in level_nodes]) for i in range(7)]
+        self.node_mins_radians = np.radians(self.node_mins)
+        self.node_maxes_radians = np.radians(self.node_maxes)
+        self._set_node_bounds()
+
+    def get_arrays(self):
+        """
+        :return: dictionary of the arrays describing this tree by name, from which it can be recreated by
+         :meth:`from_arrays`
+        """
+        arrays = {name: getattr(self, name) for name in self.array_names}
+        arrays['leafsize'] = np.array(self.leafsize)
+        return arrays
 
-        metric = np.array([1.0] * x.size)
-        metric[1] = math.cos(x[1] * math.pi / 180.0)
-        side_distances = np.maximum(0, np.maximum(x - self.maxes, self.mins - x)) * metric
-        if p != np.inf:
-            side_distances **= p
-            min_distance = np.sum(side_distances)
-        else:
-            min_distance = np.amax(side_distances)
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Recreate a tree from the arrays of a tree which has already been built, without rebuilding it.
 
-        # priority queue for chasing nodes
-        # entries are:
-        #  minimum distance between the cell and the target
-        #  distances between the nearest side of the cell and the target
-        #  the head node of the cell
-        q = [(min_distance,
-              tuple(side_distances),
-              self.tree)]
-        # priority queue for the nearest neighbors
-        # furthest known neighbor first
-        # entries are (-distance**p, i)
-        neighbors = []
+        :param arrays: dictionary of arrays, as returned by :meth:`get_arrays`
+        :return: the tree
+        """
+        tree = cls.__new__(cls)
+        for name in cls.array_names:
+            setattr(tree, name, arrays[name])
+        tree.n, tree.m = np.shape(tree.data)
+        tree.leafsize = int(arrays['leafsize'])
+        tree._set_node_bounds()
+        return tree
+
+    def _set_node_bounds(self):
+        self.maxes = self.node_maxes[0]
+        self.mins = self.node_mins[0]
+
+    def _min_distance_to_nodes(self, x, nodes):
+        """
+        :param x: (M, 2) array of query points in radians
+        :param nodes: array of M nodes
+        :return: the minimum distance from each query point to the bounding box of the corresponding node
+        """
+        mins, maxes = self.node_mins_radians[nodes], self.node_maxes_radians[nodes]
+        return _min_distance_to_rectangles(x[:, 0], x[:, 1], mins[:, 0], maxes[:, 0], mins[:, 1], maxes[:, 1])
 
-        if eps == 0:
-            epsfac = 1
-        elif p == np.inf:
-            epsfac = 1 / (1 + eps)
+    def _max_distance_to_nodes(self, x, nodes):
+        """
+        :param x: (M, 2) array of query points in radians
+        :param nodes: array of M nodes
+        :return: the maximum distance from each query point to the bounding box of the corresponding node. This is
+         the semi-circumference minus the distance to the point closest to the polar opposite point.
+        """
+        opposite = np.column_stack((-x[:, 0], x[:, 1] + PI))
+        return PI * RADIUS_EARTH - self._min_distance_to_nodes(opposite, nodes)
+
+    def _distances(self, x, query, positions):
+        """
+        :return: the distance between each query point and the data point at the corresponding tree position
+        """
+        points = self.data_radians[self.indices[positions]]
+        return _haversine_from_radians(x[query, 0], x[query, 1], points[:, 0], points[:, 1])
+
+    def _prepare_query_points(self, x):
+        x = np.asarray(x, dtype=float)
+        if x.shape[-1] != self.m:
+            raise ValueError("x must consist of vectors of length %d but has shape %s" % (self.m, np.shape(x)))
+        return x
+
+    def _query_ball_point_pairs(self, x, r):
+        """
+        Find all of the (query point, data point) pairs which are within distance r of each other.
+        :param x: (M, 2) array of query points in radians
+        :param r: the radius in kilometres, either a scalar or an array of length M
+        :return: tuple of (query point index, data point index) arrays, sorted by query point and then data point
+        """
+        r = np.broadcast_to(np.asarray(r, dtype=float), (len(x),))
+        # Allow for rounding in the bounding box distances when pruning, the actual points are checked exactly
+        r_prune = r * (1.0 + 1e-9) + 1e-9
+        found_query, found_position = [], []
+
+        query = np.arange(len(x)) if self.n else np.array([], dtype=np.intp)
+        nodes = np.zeros(len(query), dtype=np.intp)
+        while len(query) > 0:
+            keep = self._min_distance_to_nodes(x[query], nodes) <= r_prune[query]
+            query, nodes = query[keep], nodes[keep]
+
+            # Nodes which lie entirely within the radius are added in bulk
+            inside = self._max_distance_to_nodes(x[query], nodes) < r[query]
+            q, pos = expand_ranges(query[inside], self.node_start[nodes[inside]], self.node_end[nodes[inside]])
+            found_query.append(q)
+            found_position.append(pos)
+            query, nodes = query[~inside], nodes[~inside]
+
+            # Leaves are checked by brute-force
+            leaf = self.children[nodes, 0] < 0
+            q, pos = expand_ranges(query[leaf], self.node_start[nodes[leaf]], self.node_end[nodes[leaf]])
+            within = self._distances(x, q, pos) <= r[q]
+            found_query.append(q[within])
+            found_position.append(pos[within])
+
+            # Otherwise descend to both children
+            query = np.repeat(query[~leaf], 2)
+            nodes = self.children[nodes[~leaf]].ravel()
+
+        if found_query:
+            query = np.concatenate(found_query)
+            data_indices = self.indices[np.concatenate(found_position)]
         else:
-            epsfac = 1 / (1 + eps) ** p
+            query = data_indices = np.array([], dtype=np.intp)
+        order = np.lexsort((data_indices, query))
+        return query[order], data_indices[order]
 
-        if p != np.inf and distance_upper_bound != np.inf:
-            distance_upper_bound = distance_upper_bound ** p
+    def query_ball_point_csr(self, x, r):
+        """Find all points within distance r of each of the points x.
 
-        while q:
-            min_distance, side_distances, node = heappop(q)
-            if isinstance(node, HaversineDistanceKDTree.leafnode):
-                # brute-force
-                data = self.data[node.idx]
-                ds = haversine_distance(data, x[np.newaxis, :])
-                for i in range(len(ds)):
-                    if ds[i] < distance_upper_bound:
-                        if len(neighbors) == k:
-                            heappop(neighbors)
-                        heappush(neighbors, (-ds[i], node.idx[i]))
-                        if len(neighbors) == k:
-                            distance_upper_bound = -neighbors[0][0]
-            else:
-                # we don't push cells that are too far onto the queue at all,
-                # but since the distance_upper_bound decreases, we might get
-                # here even if the cell's too far
-                if min_distance > distance_upper_bound * epsfac:
-                    # since this is the nearest cell, we're done, bail out
-                    break
-                # compute minimum distances to the children and push them on
-                if x[node.split_dim] < node.split:
-                    near, far = node.less, node.greater
-                else:
-                    near, far = node.greater, node.less
+        :param x: array_like, shape (M, 2)
+            The points to search for neighbors of, as latitude, longitude in degrees.
+        :param r: positive float
+            The radius of points to return, in kilometres.
 
-                # near child is at the same distance as the current node
-                heappush(q, (min_distance, side_distances, near))
+        :returns: tuple of (offsets, indices) integer arrays, in a compressed sparse row layout such that
+            ``indices[offsets[i]:offsets[i + 1]]`` are the (sorted) indices of the neighbors of ``x[i]``.
+        """
+        x = np.radians(self._prepare_query_points(x).reshape(-1, self.m))
+        counts = np.zeros(len(x), dtype=np.intp)
+        indices = []
+        for block_start in range(0, len(x), self.query_block_size):
+            block = slice(block_start, block_start + self.query_block_size)
+            query, data_indices = self._query_ball_point_pairs(x[block], r)
+            counts[block] = np.bincount(query, minlength=len(x[block]))
+            indices.append(data_indices)
+        indices = np.concatenate(indices) if indices else np.array([], dtype=np.intp)
+        return np.concatenate(([0], np.cumsum(counts))), indices
 
-                # far child is further by an amount depending only
-                # on the split value
-                sd = list(side_distances)
-                if p == np.inf:
-                    min_distance = max(min_distance, abs(node.split - x[node.split_dim]))
-                elif p == 1:
-                    sd[node.split_dim] = np.abs(node.split - x[node.split_dim])
-                    min_distance = min_distance - side_distances[node.split_dim] + sd[node.split_dim]
-                else:
-                    sd[node.split_dim] = np.abs(node.split - x[node.split_dim]) ** p
-                    min_distance = min_distance - side_distances[node.split_dim] + sd[node.split_dim]
+    def query_ball_point(self, x, r, p=2., eps=0):
+        """Find all points within distance r of point(s) x.
 
-                # far child might be too far, if so, don't bother pushing it
-                if min_distance <= distance_upper_bound * epsfac:
-                    heappush(q, (min_distance, tuple(sd), far))
+        :param x: array_like, shape tuple + (self.m,)
+            The point or points to search for neighbors of.
+        :param r: positive float
+            The radius of points to return, in kilometres.
+        :param p: float (NOT USED)
+        :param eps: float (NOT USED)
 
-        if p == np.inf:
-            return sorted([(-d, i) for (d, i) in neighbors])
-        else:
-            return sorted([((-d) ** (1. / p), i) for (d, i) in neighbors])
+        :returns: list or array of lists
+            If `x` is a single point, returns a list of the indices of the
+            neighbors of `x`. If `x` is an array of points, returns an object
+            array of shape tuple containing lists of neighbors.
+        """
+        x = self._prepare_query_points(x)
+        offsets, indices = self.query_ball_point_csr(x, r)
+        neighbours = [indices[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])]
+        if x.ndim == 1:
+            return neighbours[0]
+        result = np.empty(len(neighbours), dtype=object)
+        result[:] = neighbours
+        return result.reshape(x.shape[:-1])
 
     def query_ball_tree(self, other, r, p=2., eps=0):
         """Find all pairs of points whose distance is at most r
 
-        :param other: KDTree instance
+        :param other: HaversineDistanceKDTree instance
             The tree containing points to search against.
         :param r: float
             The maximum distance, has to be positive.
         :param p: float (NOT USED)
-        :param eps: float, optional
-            Approximate search.  Branches of the tree are not explored
-            if their nearest points are further than ``r/(1+eps)``, and
-            branches are added in bulk if their furthest points are nearer
-            than ``r * (1+eps)``.  `eps` has to be non-negative.
+        :param eps: float (NOT USED)
 
         :returns:  list of lists
             For each element ``self.data[i]`` of this tree, ``results[i]`` is a
             list of the indices of its neighbors in ``other.data``.
+        """
+        offsets, indices = other.query_ball_point_csr(self.data, r)
+        indexed = np.zeros(self.n, dtype=bool)
+        indexed[self.indices] = True
+        return [indices[start:end].tolist() if is_indexed else []
+                for start, end, is_indexed in zip(offsets[:-1], offsets[1:], indexed)]
 
+    def query(self, x, k=1, eps=0, p=2, distance_upper_bound=np.inf):
         """
-        results = [[] for i in range(self.n)]
+        Query the kd-tree for nearest neighbors
 
-        def traverse_checking(node1, rect1, node2, rect2):
-            if rect1.min_distance_rectangle(rect2) > r / (1. + eps):
-                return
-            elif rect1.max_distance_rectangle(rect2) < r * (1. + eps):
-                traverse_no_checking(node1, node2)
-            elif isinstance(node1, KDTree.leafnode):
-                if isinstance(node2, KDTree.leafnode):
-                    d = other.data[node2.idx]
-                    for i in node1.idx:
-                        results[i] += node2.idx[haversine_distance(d, self.data[i]) <= r].tolist()
-                else:
-                    less, greater = rect2.split(node2.split_dim, node2.split)
-                    traverse_checking(node1, rect1, node2.less, less)
-                    traverse_checking(node1, rect1, node2.greater, greater)
-            elif isinstance(node2, KDTree.leafnode):
-                less, greater = rect1.split(node1.split_dim, node1.split)
-                traverse_checking(node1.less, less, node2, rect2)
-                traverse_checking(node1.greater, greater, node2, rect2)
-            else:
-                less1, greater1 = rect1.split(node1.split_dim, node1.split)
-                less2, greater2 = rect2.split(node2.split_dim, node2.split)
-                traverse_checking(node1.less, less1, node2.less, less2)
-                traverse_checking(node1.less, less1, node2.greater, greater2)
-                traverse_checking(node1.greater, greater1, node2.less, less2)
-                traverse_checking(node1.greater, greater1, node2.greater, greater2)
+        :param x: array_like, last dimension self.m
+            An array of points to query, as latitude, longitude in degrees.
+        :param k: integer
+            The number of nearest neighbors to return.
+        :param eps: float (NOT USED)
+        :param p: float (NOT USED)
+        :param distance_upper_bound: nonnegative float
+            Return only neighbors within this distance (in kilometres).
 
-        def traverse_no_checking(node1, node2):
-            if isinstance(node1, KDTree.leafnode):
-                if isinstance(node2, KDTree.leafnode):
-                    for i in node1.idx:
-                        results[i] += node2.idx.tolist()
-                else:
-                    traverse_no_checking(node1, node2.less)
-                    traverse_no_checking(node1, node2.greater)
-            else:
-                traverse_no_checking(node1.less, node2)
-                traverse_no_checking(node1.greater, node2)
+        :returns :
+            d : array of floats
+                The distances to the nearest neighbors, in kilometres.
+                If x has shape tuple+(self.m,), then d has shape tuple if
+                k is one, or tuple+(k,) if k is larger than one.  Missing
+                neighbors are indicated with infinite distances.
+            i : array of integers
+                The locations of the neighbors in self.data. i is the same
+                shape as d. Missing neighbors are indicated by self.n.
+        """
+        if k is None or k < 1:
+            raise ValueError("Requested %s nearest neighbors; acceptable numbers are integers greater than or equal"
+                             " to one" % k)
+        x = self._prepare_query_points(x)
+        retshape = np.shape(x)[:-1]
+        flat_x = np.radians(x.reshape(-1, self.m))
 
-        traverse_checking(self.tree, RectangleHaversine(self.maxes, self.mins),
-                          other.tree, RectangleHaversine(other.maxes, other.mins))
-        return results
+        dd = np.full((len(flat_x), k), np.inf)
+        ii = np.full((len(flat_x), k), self.n, dtype=np.intp)
+        for block_start in range(0, len(flat_x), self.query_block_size):
+            block = slice(block_start, block_start + self.query_block_size)
+            dd[block], ii[block] = self._query(flat_x[block], k, distance_upper_bound)
 
-    def _query_ball_point(self, x, r, p=2., eps=0):
-        R = RectangleHaversine(self.maxes, self.mins)
+        if k == 1:
+            dd, ii = dd[:, 0], ii[:, 0]
+            return dd.reshape(retshape), ii.reshape(retshape)
+        return dd.reshape(retshape + (k,)), ii.reshape(retshape + (k,))
 
-        def traverse_checking(node, rect):
-            if rect.min_distance_point(x, p) > r / (1. + eps):
-                return []
-            elif rect.max_distance_point(x, p) < r * (1. + eps):
-                return traverse_no_checking(node)
-            elif isinstance(node, KDTree.leafnode):
-                d = self.data[node.idx]
-                return node.idx[haversine_distance(d, x) <= r].tolist()
-            else:
-                less, greater = rect.split(node.split_dim, node.split)
-                return traverse_checking(node.less, less) + traverse_checking(node.greater, greater)
+    def _query(self, x, k, distance_upper_bound):
+        """
+        Find the k nearest neighbours of a batch of query points. The leaf containing each point is searched first to
+        give an initial bound, then all nodes which could contain a nearer point are searched one level at a time.
+        :param x: (M, 2) array of query points in radians
+        :return: (M, k) arrays of distances and indices into self.data
+        """
+        best_d = np.full((len(x), k), np.inf)
+        best_i = np.full((len(x), k), self.n, dtype=np.intp)
+        if self.n == 0 or len(self.indices) == 0:
+            return best_d, best_i
+
+        def update(query, positions):
+            # Merge the new candidates into the k best neighbours found so far
+            candidate_d = self._distances(x, query, positions)
+            candidate_i = self.indices[positions]
+            in_range = candidate_d <= distance_upper_bound
+            all_q = np.concatenate((np.repeat(np.arange(len(x)), k), query[in_range]))
+            all_d = np.concatenate((best_d.ravel(), candidate_d[in_range]))
+            all_i = np.concatenate((best_i.ravel(), candidate_i[in_range]))
+            order = np.lexsort((all_i, all_d, all_q))
+            all_q, all_d, all_i = all_q[order], all_d[order], all_i[order]
+            rank = np.arange(len(all_q)) - np.searchsorted(all_q, all_q)
+            best = rank < k
+            best_d[:] = all_d[best].reshape(-1, k)
+            best_i[:] = all_i[best].reshape(-1, k)
+
+        # Descend to the leaf which would contain each query point
+        nodes = np.zeros(len(x), dtype=np.intp)
+        descending = self.children[nodes, 0] >= 0
+        x_degrees = np.degrees(x)
+        while np.any(descending):
+            current = nodes[descending]
+            greater = x_degrees[descending, self.split_dim[current]] > self.split[current]
+            nodes[descending] = self.children[current, greater.astype(np.intp)]
+            descending = self.children[nodes, 0] >= 0
+        update(*expand_ranges(np.arange(len(x)), self.node_start[nodes], self.node_end[nodes]))
+        initial_leaves = nodes
+
+        query = np.arange(len(x))
+        nodes = np.zeros(len(x), dtype=np.intp)
+        while len(query) > 0:
+            bound = np.minimum(best_d[query, -1], distance_upper_bound)
+            keep = self._min_distance_to_nodes(x[query], nodes) <= bound * (1.0 + 1e-9) + 1e-9
+            query, nodes = query[keep], nodes[keep]
+
+            leaf = self.children[nodes, 0] < 0
+            new_leaf = leaf & (nodes != initial_leaves[query])
+            update(*expand_ranges(query[new_leaf], self.node_start[nodes[new_leaf]], self.node_end[nodes[new_leaf]]))
+
+            query = np.repeat(query[~leaf], 2)
+            nodes = self.children[nodes[~leaf]].ravel()
+
+        return best_d, best_i
+
+
+class UnitSphereKDTree(object):
+    """Index for querying nearest neighbours measured by distance along the Earth's surface, using scipy's compiled
+    cKDTree.
+
+    Latitudes and longitudes are converted once to 3D Cartesian points on the unit sphere. A great-circle distance r
+    then corresponds one-to-one with a straight line (chord) distance of 2 sin(r / 2R) between the points, so the
+    queries can be answered with ordinary Euclidean distances. This also avoids any special treatment of the poles or
+    the longitude wrap. The interface is the same as :class:`HaversineDistanceKDTree`.
+
+    :param data: (N, 2) array_like of latitude, longitude in degrees
+    :param leafsize: the number of points at which the tree switches over to brute-force
+    :param mask: (optional) boolean array of length N, True for points which should not be indexed
+    :param workers: the number of threads to use for each query, -1 uses all available processors. Only supported by
+     scipy 1.6 and later, otherwise the queries are single-threaded.
+    """
 
-        def traverse_no_checking(node):
-            if isinstance(node, KDTree.leafnode):
-                return node.idx.tolist()
-            else:
-                return traverse_no_checking(node.less) + \
-                       traverse_no_checking(node.greater)
+    def __init__(self, data, leafsize=10, mask=None, workers=1):
+        from scipy.spatial import cKDTree
+        self.data = np.asarray(data, dtype=float)
+        self.n, self.m = np.shape(self.data)
+        self.workers = workers
 
-        return traverse_checking(self.tree, R)
+        self.indices = np.arange(self.n)
+        if mask is not None and np.any(mask):
+            self.indices = self.indices[~np.asarray(mask, dtype=bool)]
+        self.tree = cKDTree(self._to_cartesian(self.data[self.indices]), leafsize=leafsize)
+
+    @staticmethod
+    def _to_cartesian(x):
+        """
+        :param x: (M, 2) array of latitude, longitude in degrees
+        :return: (M, 3) array of points on the unit sphere
+        """
+        lat, lon = np.radians(x[:, 0]), np.radians(x[:, 1])
+        cos_lat = np.cos(lat)
+        return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+    @staticmethod
+    def _chord_length(r):
+        """
+        :param r: great-circle distance in kilometres
+        :return: the corresponding straight line distance between points on the unit sphere
+        """
+        return 2.0 * np.sin(np.minimum(r / (2.0 * RADIUS_EARTH), HALF_PI))
+
+    @staticmethod
+    def _arc_length(chord):
+        """
+        :param chord: straight line distance between points on the unit sphere
+        :return: the corresponding great-circle distance in kilometres
+        """
+        return 2.0 * RADIUS_EARTH * np.arcsin(np.minimum(chord / 2.0, 1.0))
+
+    def _parallel_kwargs(self):
+        from scipy import __version__
+        if self.workers != 1 and tuple(int(v) for v in __version__.split('.')[:2]) >= (1, 6):
+            return {'workers': self.workers}
+        return {}
+
+    def _prepare_query_points(self, x):
+        x = np.asarray(x, dtype=float)
+        if x.shape[-1] != self.m:
+            raise ValueError("x must consist of vectors of length %d but has shape %s" % (self.m, np.shape(x)))
+        return x
+
+    def query_ball_point_csr(self, x, r):
+        """Find all points within distance r of each of the points x.
+
+        :param x: array_like, shape (M, 2)
+            The points to search for neighbors of, as latitude, longitude in degrees.
+        :param r: positive float
+            The radius of points to return, in kilometres.
+
+        :returns: tuple of (offsets, indices) integer arrays, in a compressed sparse row layout such that
+            ``indices[offsets[i]:offsets[i + 1]]`` are the (sorted) indices of the neighbors of ``x[i]``.
+        """
+        x = self._to_cartesian(self._prepare_query_points(x).reshape(-1, self.m))
+        # Allow for rounding in the conversion; this only affects points which are at distance r to within a few mm
+        chord = self._chord_length(r) * (1.0 + 1e-12)
+        neighbours = self.tree.query_ball_point(x, chord, **self._parallel_kwargs())
+        counts = np.fromiter((len(n) for n in neighbours), dtype=np.intp, count=len(x))
+        tree_indices = np.fromiter(itertools.chain.from_iterable(neighbours), dtype=np.intp, count=counts.sum())
+        # Sort the indices of each query point, then map them back onto the data
+        query = np.repeat(np.arange(len(x)), counts)
+        indices = self.indices[tree_indices[np.lexsort((tree_indices, query))]]
+        return np.concatenate(([0], np.cumsum(counts))), indices
+
+    def query_ball_point(self, x, r, p=2., eps=0):
+        """Find all points within distance r of point(s) x.
+
+        :param x: array_like, shape tuple + (self.m,)
+            The point or points to search for neighbors of.
+        :param r: positive float
+            The radius of points to return, in kilometres.
+        :param p: float (NOT USED)
+        :param eps: float (NOT USED)
+
+        :returns: list or array of lists
+            If `x` is a single point, returns a list of the indices of the
+            neighbors of `x`. If `x` is an array of points, returns an object
+            array of shape tuple containing lists of neighbors.
+        """
+        x = self._prepare_query_points(x)
+        offsets, indices = self.query_ball_point_csr(x, r)
+        neighbours = [indices[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])]
+        if x.ndim == 1:
+            return neighbours[0]
+        result = np.empty(len(neighbours), dtype=object)
+        result[:] = neighbours
+        return result.reshape(x.shape[:-1])
+
+    def query_ball_tree(self, other, r, p=2., eps=0):
+        """Find all pairs of points whose distance is at most r
+
+        :param other: UnitSphereKDTree or HaversineDistanceKDTree instance
+            The tree containing points to search against.
+        :param r: float
+            The maximum distance, has to be positive.
+        :param p: float (NOT USED)
+        :param eps: float (NOT USED)
+
+        :returns:  list of lists
+            For each element ``self.data[i]`` of this tree, ``results[i]`` is a
+            list of the indices of its neighbors in ``other.data``.
+        """
+        offsets, indices = other.query_ball_point_csr(self.data, r)
+        indexed = np.zeros(self.n, dtype=bool)
+        indexed[self.indices] = True
+        return [indices[start:end].tolist() if is_indexed else []
+                for start, end, is_indexed in zip(offsets[:-1], offsets[1:], indexed)]
+
+    def query(self, x, k=1, eps=0, p=2, distance_upper_bound=np.inf):
+        """
+        Query the tree for nearest neighbors
+
+        :param x: array_like, last dimension self.m
+            An array of points to query, as latitude, longitude in degrees.
+        :param k: integer
+            The number of nearest neighbors to return.
+        :param eps: nonnegative float
+            Return approximate nearest neighbors; the kth returned value is guaranteed to be no further than (1+eps)
+            times the distance to the real kth nearest neighbor.
+        :param p: float (NOT USED)
+        :param distance_upper_bound: nonnegative float
+            Return only neighbors within this distance (in kilometres).
+
+        :returns :
+            d : array of floats
+                The distances to the nearest neighbors, in kilometres.
+                If x has shape tuple+(self.m,), then d has shape tuple if
+                k is one, or tuple+(k,) if k is larger than one.  Missing
+                neighbors are indicated with infinite distances.
+            i : array of integers
+                The locations of the neighbors in self.data. i is the same
+                shape as d. Missing neighbors are indicated by self.n.
+        """
+        x = self._prepare_query_points(x)
+        retshape = np.shape(x)[:-1]
+        if k > 1:
+            retshape += (k,)
+        flat_x = self._to_cartesian(x.reshape(-1, self.m))
+
+        if len(self.indices) == 0:
+            return np.full(retshape, np.inf), np.full(retshape, self.n, dtype=np.intp)
+
+        bound = self._chord_length(distance_upper_bound) if np.isfinite(distance_upper_bound) else np.inf
+        d, i = self.tree.query(flat_x, k=k, eps=eps, distance_upper_bound=bound, **self._parallel_kwargs())
+        found = i < len(self.indices)
+        d = np.where(found, self._arc_length(d), np.inf)
+        i = np.where(found, self.indices[np.minimum(i, len(self.indices) - 1)], self.n)
+        return d.reshape(retshape), i.reshape(retshape)
 
 
 def distance_matrix(x, y, p=2, threshold=1000000):
@@ -350,7 +350,7 @@ class GriddedData(iris.cube.Cube, CommonData):
         Collocate the CommonData object with another CommonData object using the specified collocator and kernel
 
         :param CommonData or CommonDataList data: The data to resample
-        :param str how: Collocation method (e.g. lin, nn, bin or box)
+        :param str how: Collocation method (e.g. lin, nn, area_weighted, bin or box)
         :param str or cis.collocation.col_framework.Kernel kernel:
         :param bool missing_data_for_missing_sample: Should missing values in sample data be ignored for collocation?
         :param float fill_value: Value to use for missing data
@@ -363,6 +363,14 @@ class GriddedData(iris.cube.Cube, CommonData):
         from cis.data_io.ungridded_data import UngriddedData, UngriddedDataList
         from cis.collocation.col import collocate, get_kernel
 
+        if int(kwargs.pop('workers', 1)) != 1:
+            raise ValueError("Multiple workers are not supported for collocation onto gridded sample points")
+        if kwargs.pop('chunk_size', None) is not None or kwargs.pop('output_file', None) is not None:
+            raise ValueError("Chunked collocation is only supported for ungridded -> ungridded collocation")
+        # Only used for gridded -> gridded area weighted regridding
+        recent_weights = kwargs.pop('recent_weights', None)
+
+        col_kwargs = {}
         if isinstance(data, UngriddedData) or isinstance(data, UngriddedDataList):
             col_cls = ci.GeneralGriddedCollocator
             # Bin is the default for ungridded -> gridded collocation
@@ -379,20 +387,24 @@ class GriddedData(iris.cube.Cube, CommonData):
             col_cls = ci.GriddedCollocator
             con = None
             if kernel is not None:
-                raise ValueError("Cannot specify kernel when method is 'lin' or 'nn'")
+                raise ValueError("Cannot specify kernel when method is 'lin', 'nn' or 'area_weighted'")
+            col_kwargs['index_cache_dir'] = kwargs.pop('index_cache_dir', None)
+            col_kwargs['recent_weights'] = recent_weights
 
             # Lin is the default for gridded -> gridded
             if how == '' or how == 'lin':
                 kernel = ci.gridded_gridded_li()
             elif how == 'nn':
                 kernel = ci.gridded_gridded_nn()
+            elif how == 'area_weighted':
+                kernel = ci.gridded_gridded_area_weighted()
             else:
                 raise ValueError("Invalid method specified for gridded -> gridded collocation: " + how)
         else:
             raise ValueError("Invalid argument, data must be either GriddedData or UngriddedData")
 
         col = col_cls(missing_data_for_missing_sample=missing_data_for_missing_sample, fill_value=fill_value,
-                      var_name=var_name, var_long_name=var_long_name, var_units=var_units)
+                      var_name=var_name, var_long_name=var_long_name, var_units=var_units, **col_kwargs)
 
         return collocate(data, self, col, con, kernel)
 
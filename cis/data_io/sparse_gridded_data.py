@@ -0,0 +1,211 @@
+"""
+Sparse gridded data, which keeps only the values of the occupied cells of a grid. Aggregating onto very fine grids
+(or grids with many dimensions) usually leaves most of the cells empty, so rather than allocating the whole grid the
+values are kept as a flat cell number and a value for each occupied cell. They can be saved using the CF 'compression by
+gathering' convention, and are only expanded onto the full grid on demand.
+"""
+import logging
+from time import gmtime, strftime
+
+import numpy as np
+
+from cis.utils import set_standard_name_if_valid
+
+# The name of the dimension (and list variable) of the occupied cells in the output files
+cell_dimension_name = 'cell'
+
+
+class SparseGriddedData(object):
+    """
+    The values of a variable in the occupied cells of a grid.
+
+    :param ndarray cell_ids: The (sorted) cell number of each value in the flattened (C order) grid
+    :param ndarray values: The value in each of these cells
+    :param list coords: The (one dimensional) coordinates of the grid, in order
+    :param str var_name: The variable name
+    :param str long_name: The long name
+    :param str standard_name: The standard name
+    :param units: The units
+    """
+
+    def __init__(self, cell_ids, values, coords, var_name='', long_name='', standard_name=None, units=''):
+        self.cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        self.values = np.asarray(values)
+        self._coords = list(coords)
+        self.var_name = var_name
+        self.long_name = long_name
+        self.standard_name = standard_name
+        self.units = units
+        self.attributes = {}
+
+    @classmethod
+    def from_indices(cls, indices, values, coords, var_name='', long_name='', standard_name=None, units=''):
+        """
+        Create sparse gridded data from the indices of some cells of the grid and their values. Cells with missing (or
+        NaN) values are left out.
+
+        :param tuple indices: The indices of the cells in each dimension of the grid, as a tuple of arrays
+        :param values: The value in each cell
+        :param list coords: The (one dimensional) coordinates of the grid, in order
+        :return SparseGriddedData:
+        """
+        values = np.ma.masked_invalid(values)
+        valid = ~np.ma.getmaskarray(values)
+        cell_ids = np.ravel_multi_index(tuple(np.asarray(i)[valid] for i in indices),
+                                        tuple(len(c.points) for c in coords))
+        order = np.argsort(cell_ids)
+        return cls(cell_ids[order], np.ma.getdata(values)[valid][order], coords, var_name, long_name,
+                   standard_name, units)
+
+    @property
+    def shape(self):
+        """
+        The shape of the full grid
+        """
+        return tuple(len(c.points) for c in self._coords)
+
+    def coords(self):
+        """
+        :return list: The coordinates of the grid
+        """
+        return list(self._coords)
+
+    def name(self):
+        return self.standard_name or self.long_name or self.var_name
+
+    def rename(self, name):
+        self.long_name = name
+
+    def add_history(self, new_history):
+        """Appends to, or creates, the history attribute using the supplied history string.
+
+        The new entry is prefixed with a timestamp.
+        :param new_history: history string
+        """
+        timestamp = strftime("%Y-%m-%dT%H:%M:%SZ ", gmtime())
+        if 'history' not in self.attributes:
+            self.attributes['history'] = timestamp + new_history
+        else:
+            self.attributes['history'] += '\n' + timestamp + new_history
+
+    def to_gridded(self):
+        """
+        Expand the values onto the full grid, with the empty cells masked.
+
+        :return GriddedData:
+        """
+        from cis.data_io.gridded_data import GriddedData
+        data = np.zeros(self.shape, dtype=self.values.dtype)
+        mask = np.ones(self.shape, dtype=bool)
+        data.flat[self.cell_ids] = self.values
+        mask.flat[self.cell_ids] = False
+        gridded = GriddedData(np.ma.masked_array(data, mask=mask), var_name=self.var_name, long_name=self.long_name,
+                              dim_coords_and_dims=[(coord.copy(), i) for i, coord in enumerate(self._coords)])
+        set_standard_name_if_valid(gridded, self.standard_name)
+        try:
+            gridded.units = self.units
+        except ValueError:
+            logging.warning("Units are not cf compliant, not setting them. Units {}".format(self.units))
+        gridded.attributes.update(self.attributes)
+        return gridded
+
+    def save_data(self, output_file):
+        """
+        Save this data object to a given output file, see :meth:`SparseGriddedDataList.save_data`
+        :param output_file: Output file to save to.
+        """
+        SparseGriddedDataList([self]).save_data(output_file)
+
+
+class SparseGriddedDataList(list):
+    """
+    A list of sparse gridded data objects on the same grid.
+    """
+
+    def coords(self):
+        """
+        :return list: The coordinates of the grid
+        """
+        return self[0].coords() if self else []
+
+    def add_history(self, new_history):
+        """
+        Appends to, or creates, the history attribute of each data object using the supplied history string.
+        :param new_history: history string
+        """
+        for data in self:
+            data.add_history(new_history)
+
+    def to_gridded(self):
+        """
+        Expand the values of each data object onto the full grid, with the empty cells masked.
+
+        :return GriddedDataList:
+        """
+        from cis.data_io.gridded_data import GriddedDataList
+        return GriddedDataList([data.to_gridded() for data in self])
+
+    def save_data(self, output_file):
+        """
+        Save data to a given output file, using the CF 'compression by gathering' convention: every variable is
+        written only for the cells which are occupied in any of them, along a single dimension whose list variable
+        holds the (zero based, C order) index of each of those cells in the full grid and names the grid dimensions in
+        its ``compress`` attribute.
+        :param output_file: File to save to
+        """
+        from netCDF4 import Dataset
+        logging.info('Saving data to %s' % output_file)
+
+        cell_ids = np.unique(np.concatenate([data.cell_ids for data in self])) if self else np.zeros(0, np.int64)
+        with Dataset(output_file, 'w', format='NETCDF4') as nc_file:
+            nc_file.Conventions = 'CF-1.6'
+            dimension_names = [_write_coordinate(nc_file, coord) for coord in self.coords()]
+
+            nc_file.createDimension(cell_dimension_name, len(cell_ids))
+            cell = nc_file.createVariable(cell_dimension_name, 'i8', (cell_dimension_name,), zlib=True)
+            cell.compress = ' '.join(dimension_names)
+            cell[:] = cell_ids
+
+            for data in self:
+                var = nc_file.createVariable(data.var_name, data.values.dtype, (cell_dimension_name,), zlib=True)
+                values = np.ma.masked_all(len(cell_ids), dtype=data.values.dtype)
+                values[np.searchsorted(cell_ids, data.cell_ids)] = data.values
+                var[:] = values
+                if data.standard_name:
+                    var.standard_name = data.standard_name
+                if data.long_name:
+                    var.long_name = data.long_name
+                if data.units:
+                    var.units = str(data.units)
+                for name, value in data.attributes.items():
+                    if name == 'history':
+                        nc_file.history = value
+                    else:
+                        setattr(var, name, value)
+
+
+def _write_coordinate(nc_file, coord):
+    """
+    Write a (one dimensional) grid coordinate, and its bounds, as a coordinate variable
+    :return str: The name of the coordinate's dimension
+    """
+    name = coord.var_name or coord.name()
+    nc_file.createDimension(name, len(coord.points))
+    var = nc_file.createVariable(name, coord.points.dtype, (name,))
+    var[:] = coord.points
+    if coord.standard_name:
+        var.standard_name = coord.standard_name
+    if coord.long_name:
+        var.long_name = coord.long_name
+    var.units = str(coord.units)
+    if coord.units.calendar:
+        var.calendar = coord.units.calendar
+    if coord.has_bounds():
+        if 'bnds' not in nc_file.dimensions:
+            nc_file.createDimension('bnds', 2)
+        # The bounds of climatological times are given by the 'climatology' attribute in CF, rather than 'bounds'
+        bounds_attribute = 'climatology' if getattr(coord, 'climatological', False) else 'bounds'
+        var.setncattr(bounds_attribute, name + '_bnds')
+        bounds = nc_file.createVariable(name + '_bnds', coord.bounds.dtype, (name, 'bnds'))
+        bounds[:] = coord.bounds
+    return name
@@ -780,7 +780,7 @@ class UngriddedData(LazyData, CommonData):
         from cis.subsetting.subset import subset, UngriddedSubsetConstraint
         return subset(self, UngriddedSubsetConstraint, **kwargs)
 
-    def aggregate(self, how=None, **kwargs):
+    def aggregate(self, how=None, sparse=False, **kwargs):
         """
         Aggregate the UngriddedData object based on the specified grids. The grid is defined by passing keyword
         arguments for each dimension, each argument must be a slice, or have three entries (a maximum, a minimum and a
@@ -789,7 +789,9 @@ class UngriddedData(LazyData, CommonData):
 
         Datetime objects can be used to specify upper and lower datetime limits, or a
         single PartialDateTime object can be used to specify a datetime range. The gridstep can be specified as a
-        DateTimeDelta object.
+        DateTimeDelta object, or as the name of a calendar period ('month', 'season' or 'year') or cycle
+        ('month_of_year', 'season_of_year', 'day_of_year' or 'hour_of_day'). A calendar period or cycle can also be
+        given on its own to bin the whole time range of the data, e.g. t='month_of_year'.
 
         The keyword keys are used to find the relevant coordinate, they are looked for in order of name, standard_name,
         axis and var_name.
@@ -801,10 +803,13 @@ class UngriddedData(LazyData, CommonData):
             data.aggregate(how='mean', t=[PartialDateTime(2008,9), timedelta(days=1))
 
         :param str how: The kernel to use in the aggregation (moments, mean, min, etc...). Default is moments
+        :param bool sparse: Keep only the occupied cells of the grid, returning SparseGriddedData which can be saved in
+         compressed form or expanded onto the full grid with ``to_gridded()``. Useful for very fine grids where most
+         cells are empty
         :param kwargs: The grid specifications for each coordinate dimension
         :return GriddedData:
         """
-        agg = _aggregate_ungridded(self, how, **kwargs)
+        agg = _aggregate_ungridded(self, how, sparse, **kwargs)
         # Return the single item if there's only one (this depends on the kernel used)
         if len(agg) == 1:
             agg = agg[0]
@@ -1125,7 +1130,7 @@ class UngriddedDataList(CommonDataList):
         from cis.subsetting.subset import subset, UngriddedSubsetConstraint
         return subset(self, UngriddedSubsetConstraint, **kwargs)
 
-    def aggregate(self, how='', **kwargs):
+    def aggregate(self, how='', sparse=False, **kwargs):
         """
         Aggregate the UngriddedDataList object based on the specified grids. The grid is defined by passing keyword
         arguments for each dimension, each argument must be a slice, or have three entries (a maximum, a minimum and a
@@ -1134,7 +1139,9 @@ class UngriddedDataList(CommonDataList):
 
         Datetime objects can be used to specify upper and lower datetime limits, or a
         single PartialDateTime object can be used to specify a datetime range. The gridstep can be specified as a
-        DateTimeDelta object.
+        DateTimeDelta object, or as the name of a calendar period ('month', 'season' or 'year') or cycle
+        ('month_of_year', 'season_of_year', 'day_of_year' or 'hour_of_day'). A calendar period or cycle can also be
+        given on its own to bin the whole time range of the data, e.g. t='month_of_year'.
 
         The keyword keys are used to find the relevant coordinate, they are looked for in order of name, standard_name,
         axis and var_name.
@@ -1146,10 +1153,12 @@ class UngriddedDataList(CommonDataList):
             data.aggregate(how='mean', t=[PartialDateTime(2008,9), timedelta(days=1))
 
         :param str how: The kernel to use in the aggregation (moments, mean, min, etc...)
+        :param bool sparse: Keep only the occupied cells of the grid, returning a SparseGriddedDataList which can be
+         saved in compressed form or expanded onto the full grid with ``to_gridded()``
         :param kwargs: The grid specifications for each coordinate dimension
         :return GriddedDataList:
         """
-        return _aggregate_ungridded(self, how, **kwargs)
+        return _aggregate_ungridded(self, how, sparse, **kwargs)
 
 
 def _coords_as_data_frame(coord_list, copy=True, time_index=True):
@@ -1211,7 +1220,8 @@ def _to_flat_ndarray(data, copy=True):
 
 
 def _ungridded_sampled_from(sample, data, how='', kernel=None, missing_data_for_missing_sample=True, fill_value=None,
-                            var_name='', var_long_name='', var_units='', **kwargs):
+                            var_name='', var_long_name='', var_units='', workers=1, chunk_size=None,
+                            output_file=None, recent_weights=None, **kwargs):
     """
     Collocate the CommonData object with another CommonData object using the specified collocator and kernel
 
@@ -1223,7 +1233,14 @@ def _ungridded_sampled_from(sample, data, how='', kernel=None, missing_data_for_
     :param str var_name: The output variable name
     :param str var_long_name: The output variable's long name
     :param str var_units: The output variable's units
-    :return CommonData: The collocated dataset
+    :param int workers: The number of processes to use for ungridded -> ungridded collocation, or threads to use
+     for gridded -> ungridded interpolation
+    :param int chunk_size: The number of sample points to collocate at a time for ungridded -> ungridded collocation
+    :param str output_file: If given, write the collocated data to this file as it is calculated (for ungridded ->
+     ungridded collocation) rather than returning it
+    :param dict recent_weights: A dictionary in which to keep the most recently calculated gridded -> ungridded
+     interpolation weights, shared between calls so that collocating other data on the same grid can reuse them
+    :return CommonData: The collocated dataset, or None if it was written to output_file
     """
     from cis.collocation import col_implementations as ci
     from cis.data_io.gridded_data import GriddedData, GriddedDataList
@@ -1232,7 +1249,8 @@ def _ungridded_sampled_from(sample, data, how='', kernel=None, missing_data_for_
     if isinstance(data, UngriddedData) or isinstance(data, UngriddedDataList):
         col = ci.GeneralUngriddedCollocator(fill_value=fill_value, var_name=var_name, var_long_name=var_long_name,
                                             var_units=var_units,
-                                            missing_data_for_missing_sample=missing_data_for_missing_sample)
+                                            missing_data_for_missing_sample=missing_data_for_missing_sample,
+                                            workers=workers, chunk_size=chunk_size)
 
         # Box is the default, and only option for ungridded -> ungridded collocation
         if how not in ['', 'box']:
@@ -1243,38 +1261,45 @@ def _ungridded_sampled_from(sample, data, how='', kernel=None, missing_data_for_
     elif isinstance(data, GriddedData) or isinstance(data, GriddedDataList):
         col = ci.GriddedUngriddedCollocator(fill_value=fill_value, var_name=var_name, var_long_name=var_long_name,
                                             var_units=var_units,
-                                            missing_data_for_missing_sample=missing_data_for_missing_sample)
+                                            missing_data_for_missing_sample=missing_data_for_missing_sample,
+                                            extrapolate=kwargs.pop('extrapolate', False),
+                                            stream_time=kwargs.pop('stream_time', False),
+                                            index_cache_dir=kwargs.pop('index_cache_dir', None), workers=workers,
+                                            recent_weights=recent_weights)
         con = None
         if how not in ['', 'lin', 'nn']:
             raise ValueError("Invalid method specified for gridded -> ungridded collocation: " + how)
+        if chunk_size is not None or output_file is not None:
+            raise ValueError("Chunked collocation is only supported for ungridded -> ungridded collocation")
 
         kernel = how or 'lin'
     else:
         raise ValueError("Invalid argument, data must be either GriddedData or UngriddedData")
 
-    return collocate(data, sample, col, con, kernel)
+    return collocate(data, sample, col, con, kernel, output_file)
 
 
-def _aggregate_ungridded(data, how, **kwargs):
+def _get_aggregation_grid(data, fill_limits=True, **kwargs):
     """
-    Aggregate an UngriddedData or UngriddedDataList based on the specified grids
+    Create the aggregation grid from the grid specifications for each coordinate dimension
     :param UngriddedData or UngriddedDataList data: The data object to aggregate
-    :param cis.collocation.col_framework.Kernel kernel: The kernel to use in the aggregation
+    :param bool fill_limits: Use the extent of the data for the start and end of any grid without them (otherwise they
+     are left as None)
     :param kwargs: The grid specifications for each coordinate dimension
-    :return:
+    :return dict: The grid slice for each coordinate name
     """
-    from cis.aggregation.ungridded_aggregator import UngriddedAggregator
-    from cis.collocation.col import get_kernel
+    from cis.aggregation.calendar_bins import is_calendar_bin, CALENDAR_BINS
     from cis.time_util import PartialDateTime
     from datetime import datetime, timedelta
-    from cis import __version__
 
-    kernel = get_kernel(how)
     grid_spec = {}
     for dim_name, grid in kwargs.items():
         c = data._get_coord(dim_name)
         if all(hasattr(grid, att) for att in ('start', 'stop', 'step')):
             g = grid
+        elif isinstance(grid, six.string_types):
+            # Just a calendar period or cycle, over the whole time range of the data
+            g = slice(None, None, grid)
         elif len(grid) == 2 and isinstance(grid[0], PartialDateTime):
             g = slice(grid[0].min(), grid[0].max(), grid[1])
         elif len(grid) == 3:
@@ -1283,11 +1308,11 @@ def _aggregate_ungridded(data, how, **kwargs):
             raise ValueError("Invalid subset arguments: {}".format(grid))
 
         # Fill in defaults
-        grid_start = g.start if g.start is not None else c.points.min()
+        grid_start = g.start if g.start is not None or not fill_limits else c.points.min()
         if isinstance(grid_start, datetime):
             grid_start = c.units.date2num(grid_start)
 
-        grid_end = g.stop if g.stop is not None else c.points.max()
+        grid_end = g.stop if g.stop is not None or not fill_limits else c.points.max()
         if isinstance(grid_end, datetime):
             grid_end = c.units.date2num(grid_end)
 
@@ -1299,19 +1324,78 @@ def _aggregate_ungridded(data, how, **kwargs):
         if isinstance(grid_step, timedelta):
             # Standard time is days since, so turn this into a fractional number of days
             grid_step = grid_step.total_seconds() / (24*60*60)
+        elif isinstance(grid_step, six.string_types):
+            if not is_calendar_bin(grid_step):
+                raise ValueError("Invalid grid step '{}', calendar bins must be one of: {}"
+                                 .format(grid_step, ', '.join(CALENDAR_BINS)))
+            if g.stop is None and grid_end is not None:
+                # Calendar bins exclude their end, so make sure the last point of the data is included
+                grid_end = numpy.nextafter(grid_end, numpy.inf)
 
         grid_spec[c.name()] = slice(grid_start, grid_end, grid_step)
+    return grid_spec
+
+
+def _get_aggregation_history(data, grid_spec, kernel, filenames=None):
+    from cis import __version__
+    return "Aggregated using CIS version " + __version__ + \
+           "\n variables: " + str(getattr(data, "var_name", "Unknown")) + \
+           "\n from files: " + str(filenames or getattr(data, "filenames", "Unknown")) + \
+           "\n using new grid: " + str(grid_spec) + \
+           "\n with kernel: " + str(kernel) + "."
+
+
+def _aggregate_ungridded(data, how, sparse=False, **kwargs):
+    """
+    Aggregate an UngriddedData or UngriddedDataList based on the specified grids
+    :param UngriddedData or UngriddedDataList data: The data object to aggregate
+    :param cis.collocation.col_framework.Kernel kernel: The kernel to use in the aggregation
+    :param bool sparse: Keep only the occupied cells of the grid
+    :param kwargs: The grid specifications for each coordinate dimension
+    :return:
+    """
+    from cis.aggregation.ungridded_aggregator import UngriddedAggregator
+    from cis.collocation.col import get_kernel
+
+    kernel = get_kernel(how)
+    grid_spec = _get_aggregation_grid(data, **kwargs)
 
     # We have to make the history before doing the aggregation as the grid dims get popped-off during the operation
-    history = "Aggregated using CIS version " + __version__ + \
-              "\n variables: " + str(getattr(data, "var_name", "Unknown")) + \
-              "\n from files: " + str(getattr(data, "filenames", "Unknown")) + \
-              "\n using new grid: " + str(grid_spec) + \
-              "\n with kernel: " + str(kernel) + "."
+    history = _get_aggregation_history(data, grid_spec, kernel)
 
     aggregator = UngriddedAggregator(grid_spec)
-    data = aggregator.aggregate(data, kernel)
+    data = aggregator.aggregate(data, kernel, sparse)
 
     data.add_history(history)
 
     return data
+
+
+def _aggregate_ungridded_files(filenames, variables, how, product=None, processes=None, **kwargs):
+    """
+    Aggregate ungridded data in many files based on the specified grids, binning each file separately so that the
+    data in all of the files never needs to be read at once (see :meth:`UngriddedAggregator.aggregate_files`)
+    :param list filenames: The files to aggregate
+    :param list variables: The variables to aggregate
+    :param str how: The kernel to use in the aggregation
+    :param str product: The name of the data reading plugin to use to read the data
+    :param int processes: The number of worker processes to use, defaults to the number of CPUs
+    :param kwargs: The grid specifications for each coordinate dimension
+    :return GriddedDataList:
+    """
+    from cis.aggregation.ungridded_aggregator import UngriddedAggregator
+    from cis.collocation.col import get_kernel
+    from cis.data_io.data_reader import DataReader
+
+    kernel = get_kernel(how)
+    reader = DataReader()
+    variables = reader._expand_wildcards(listify(variables), filenames[:1], product)
+    # Only the coordinates of the first file are needed to find the gridded coordinates
+    first = reader.read_data_list(filenames[:1], variables, product)
+    if first.is_gridded:
+        raise ValueError("Only ungridded data can be aggregated file by file")
+    grid_spec = _get_aggregation_grid(first, fill_limits=False, **kwargs)
+
+    output = UngriddedAggregator(grid_spec).aggregate_files(filenames, variables, kernel, product, processes)
+    output.add_history(_get_aggregation_history(first, grid_spec, kernel, filenames))
+    return output
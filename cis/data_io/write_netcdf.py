@@ -86,12 +86,14 @@ def __check_disk_space(filepath, data):
                             .format(path=filepath, free=sizeof_fmt(available), size=sizeof_fmt(data.data.nbytes)))
 
 
-def __create_variable(nc_file, data, prefer_standard_name=False):
+def __create_variable(nc_file, data, prefer_standard_name=False, start=None):
     """Creates and writes a variable to a netCDF file.
     :param nc_file: netCDF file to which to write
     :param data: LazyData for variable to write
     :param prefer_standard_name: if True, use the standard name of the variable if defined,
            otherwise use the variable name
+    :param start: if given, the data is a chunk of the variable to write starting at this index, and the variable is
+           created (with the full length of the file) by the first chunk written
     :return: created netCDF variable
     """
     from cis.exceptions import InconsistentDimensionsError
@@ -104,7 +106,17 @@ def __create_variable(nc_file, data, prefer_standard_name=False):
             name = data.metadata.standard_name
     out_type = types[str(data.data.dtype)]
     logging.info("Creating variable: {name}({index}) {type}".format(name=name, index=index_name, type=out_type))
-    if name not in nc_file.variables:
+    if start is not None:
+        if name in nc_file.variables:
+            var = nc_file.variables[name]
+        else:
+            var = nc_file.createVariable(name, datatype=out_type, dimensions=index_name,
+                                         fill_value=__get_missing_value(data))
+            var = __add_metadata(var, data)
+        chunk = data.data.flatten()
+        var[start:start + len(chunk)] = chunk
+        return var
+    elif name not in nc_file.variables:
         # Generate a warning if we have insufficient disk space
         __check_disk_space(nc_file.filepath(), data.data)
         var = nc_file.createVariable(name, datatype=out_type, dimensions=index_name,
@@ -161,15 +173,17 @@ def write_coordinate_list(coord_list, filename):
     netcdf_file.close()
 
 
-def add_data_to_file(data_object, filename):
+def add_data_to_file(data_object, filename, start=None):
     """
 
     :param data_object:
     :param filename:
+    :param start: if given, write data_object as a chunk of the variable starting at this index along the dimension
+                  of the file, which must already have been created (e.g. by :func:`write_coordinates`)
     :return:
     """
     from cis import __version__
     netcdf_file = Dataset(filename, 'a', format="NETCDF4")
-    var = __create_variable(netcdf_file, data_object, prefer_standard_name=False)
+    var = __create_variable(netcdf_file, data_object, prefer_standard_name=False, start=start)
     netcdf_file.source = "CIS" + __version__
     netcdf_file.close()
@@ -222,9 +222,20 @@ def add_aggregate_parser_arguments(parser):
     parser.add_argument("aggregategrid", metavar="AggregateGrid",
                         help="Grid for new aggregation, e.g. t,x=[-180,90,5] would collapse time completely and "
                              "aggregate longitude onto a new grid, which would start at -180 and then proceed in 5 "
-                             "degree increments up to 90")
+                             "degree increments up to 90. The time step may also be a calendar period (month, season "
+                             "or year) or cycle (month_of_year, season_of_year, day_of_year or hour_of_day)")
     parser.add_argument("-o", "--output", metavar="Output filename", default="out", nargs="?",
                         help="The filename of the output file")
+    memory_options = parser.add_mutually_exclusive_group()
+    memory_options.add_argument("--stream", action='store_true',
+                                help="Aggregate ungridded data one file at a time, so that only the output grid "
+                                     "(rather than all of the data) needs to fit in memory. The start and end of every "
+                                     "grid dimension must be given and the kernel must be moments, mean, stddev, min, "
+                                     "max, sum or approximate_median")
+    memory_options.add_argument("--sparse", action='store_true',
+                                help="Keep (and output) only the occupied cells of the grid when aggregating ungridded "
+                                     "data, for very fine grids where most cells are empty. The output uses the CF "
+                                     "'compression by gathering' convention")
     return parser
 
 
@@ -443,6 +454,7 @@ def get_aggregate_grid(aggregategrid, parser):
     :param parser:        The parser used to report errors
     :return: The parsed datagroups as a list of dictionaries
     """
+    from cis.aggregation.calendar_bins import is_calendar_bin
     from cis.parse_datetime import parse_as_number_or_datetime, parse_as_number_or_datetime_delta
 
     # Split into the limits for each dimension.
@@ -472,7 +484,10 @@ def get_aggregate_grid(aggregategrid, parser):
 
             start_parsed = parse_as_number_or_datetime(match.group('start'))
             end_parsed = parse_as_number_or_datetime(match.group('end'))
-            delta_parsed = parse_as_number_or_datetime_delta(match.group('delta'))
+            if is_calendar_bin(match.group('delta')):
+                delta_parsed = match.group('delta').lower()
+            else:
+                delta_parsed = parse_as_number_or_datetime_delta(match.group('delta'))
 
             if dim_name.lower() == 'x':
                 if not start_parsed <= end_parsed:
@@ -0,0 +1,102 @@
+"""
+Tests aggregating ungridded data into calendar periods and cycles
+"""
+import datetime as dt
+from unittest import TestCase
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from cis.aggregation.calendar_bins import CalendarCycleCoord, make_period_coord, to_datetime64, from_datetime64
+from cis.test.util.mock import make_random_ungridded_data
+from cis.time_util import cis_standard_time_unit
+
+
+def _std_time(*args):
+    return cis_standard_time_unit.date2num(dt.datetime(*args))
+
+
+def _make_data():
+    return make_random_ungridded_data(4, 2000, lat_range=(-10, 10), lon_range=(20, 30),
+                                      time_range=(dt.datetime(2007, 1, 1), dt.datetime(2009, 1, 1)))
+
+
+def _dates(data):
+    return cis_standard_time_unit.num2date(data.coord('time').points)
+
+
+class TestCalendarPeriods(TestCase):
+
+    def test_datetime64_conversion_matches_the_time_units(self):
+        times = np.array([_std_time(1601, 3, 1, 6), _std_time(2008, 2, 29, 23, 59, 59)])
+        assert_array_equal(to_datetime64(times, cis_standard_time_unit),
+                           np.array(['1601-03-01T06', '2008-02-29T23:59:59'], dtype='datetime64[us]'))
+        assert_allclose(from_datetime64(to_datetime64(times, cis_standard_time_unit), cis_standard_time_unit), times)
+
+    def test_month_bounds_are_the_starts_of_each_month(self):
+        coord = make_period_coord(_std_time(2008, 1, 15), _std_time(2008, 3, 1), 'month', cis_standard_time_unit)
+        assert_array_equal(coord.bounds, [[_std_time(2008, 1, 1), _std_time(2008, 2, 1)],
+                                          [_std_time(2008, 2, 1), _std_time(2008, 3, 1)]])
+
+    def test_seasons_start_in_december(self):
+        coord = make_period_coord(_std_time(2008, 1, 15), _std_time(2008, 4, 1), 'season', cis_standard_time_unit)
+        assert_array_equal(coord.bounds, [[_std_time(2007, 12, 1), _std_time(2008, 3, 1)],
+                                          [_std_time(2008, 3, 1), _std_time(2008, 6, 1)]])
+
+    def test_aggregating_into_months(self):
+        data = _make_data()
+        output = data.aggregate(how='mean', t=[dt.datetime(2007, 1, 1), dt.datetime(2009, 1, 1), 'month'])
+        # The fully collapsed latitude and longitude are kept as length one dimensions
+        self.assertEqual(output.shape, (1, 1, 24))
+        months = np.array([(d.year - 2007) * 12 + d.month - 1 for d in _dates(data)])
+        expected = [data.data[months == m].mean() for m in range(24)]
+        assert_allclose(output.data[0, 0], expected, rtol=1e-12)
+
+    def test_non_gregorian_calendars_cant_be_binned(self):
+        from cf_units import Unit
+        with self.assertRaises(ValueError):
+            make_period_coord(0, 360, 'month', Unit('days since 2000-01-01', calendar='360_day'))
+
+
+class TestCalendarCycles(TestCase):
+
+    def test_season_of_year_climatology(self):
+        data = _make_data()
+        output = data.aggregate(how='mean', t='season_of_year')
+        seasons = np.array([(d.month % 12) // 3 for d in _dates(data)])
+        expected = [data.data[seasons == s].mean() for s in range(4)]
+        assert_allclose(output.data[0, 0], expected, rtol=1e-12)
+
+        time = output.coord('time')
+        self.assertIsInstance(time, CalendarCycleCoord)
+        self.assertTrue(time.climatological)
+        assert_array_equal(time.bounds[0], [_std_time(2006, 12, 1), _std_time(2009, 3, 1)])
+
+    def test_diurnal_cycle_on_a_grid(self):
+        data = _make_data()
+        output = data.aggregate(how='mean', t=[dt.datetime(2008, 1, 1), dt.datetime(2009, 1, 1), 'hour_of_day'],
+                                x=slice(20, 30, 5))
+        self.assertEqual(output.shape, (1, 2, 24))
+        dates = _dates(data)
+        in_range = np.array([d.year == 2008 for d in dates])
+        hours = np.array([d.hour for d in dates])
+        east = data.coord('longitude').points >= 25
+        for hour in range(24):
+            assert_allclose(output.data[0, 1, hour], data.data[in_range & east & (hours == hour)].mean(), rtol=1e-12)
+
+    def test_day_of_year_bins(self):
+        coord = CalendarCycleCoord.from_range(_std_time(2007, 1, 1), _std_time(2009, 1, 1), 'day_of_year',
+                                              cis_standard_time_unit)
+        self.assertEqual(len(coord.points), 366)
+        times = [_std_time(2007, 12, 31, 12), _std_time(2008, 12, 31), _std_time(2008, 3, 1), _std_time(2009, 1, 1)]
+        assert_array_equal(coord.bin_values(times), [364, 365, 60, -1])
+
+    def test_cycle_index_is_cached_by_time_range(self):
+        from cis.collocation.data_index import GridCellBinIndexInSlices
+        data = _make_data()
+        keys = []
+        for start in [dt.datetime(2007, 1, 1), dt.datetime(2007, 1, 15)]:
+            coord = CalendarCycleCoord.from_range(cis_standard_time_unit.date2num(start), _std_time(2009, 1, 1),
+                                                  'month_of_year', cis_standard_time_unit, standard_name='time')
+            keys.append(GridCellBinIndexInSlices().get_cache_key([coord], data.get_non_masked_points(), [(4, 0, 0)]))
+        self.assertNotEqual(keys[0], keys[1])
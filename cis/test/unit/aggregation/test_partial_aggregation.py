@@ -0,0 +1,203 @@
+"""
+Tests aggregating ungridded data in parts, using mergeable partial aggregates
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from cis.aggregation.partial_aggregation import PartialAggregate, QuantileSketch
+from cis.aggregation.ungridded_aggregator import UngriddedAggregator
+from cis.collocation.col_implementations import moments, min, max, sum, mean, stddev, nn_horizontal, median, \
+    approximate_median, percentiles
+from cis.collocation.col_framework import AbstractDataOnlyKernel
+from cis.test.util.mock import make_random_ungridded_data
+
+
+def _partial_aggregate(values, cells, shape):
+    order = np.argsort(cells, kind='mergesort')
+    cells, values = cells[order], values[order]
+    starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+    out_indices = np.unravel_index(cells[starts], shape)
+    return PartialAggregate.from_segments(shape, out_indices, values, np.append(starts, cells.size))
+
+
+class TestPartialAggregate(TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(1)
+        self.shape = (4, 5)
+        self.values = random.normal(1000, 3, 300)
+        # Leave the last cell empty
+        self.cells = random.randint(0, 19, 300)
+
+    def _check_kernel(self, kernel, partial):
+        expected = moments().get_values_for_segments(*self._sorted())
+        values = kernel.get_values_from_partial_aggregate(partial)
+        for expected_values, output in zip(expected, values):
+            assert_allclose(output.ravel()[:19], expected_values, rtol=1e-12)
+            assert np.isnan(output.ravel()[19])
+
+    def _sorted(self):
+        order = np.argsort(self.cells, kind='mergesort')
+        return self.values[order], np.searchsorted(self.cells[order], np.arange(20))
+
+    def test_a_single_part_gives_the_same_result_as_the_moments_kernel(self):
+        values, offsets = self._sorted()
+        partial = _partial_aggregate(self.values, self.cells, self.shape)
+        output = moments().get_values_from_partial_aggregate(partial).reshape(3, -1)[:, :19]
+        assert_array_equal(output, moments().get_values_for_segments(values, offsets))
+
+    def test_merged_parts_give_the_same_results_as_all_of_the_values(self):
+        partial = _partial_aggregate(self.values[:100], self.cells[:100], self.shape)
+        partial.merge(_partial_aggregate(self.values[100:250], self.cells[100:250], self.shape))
+        partial.merge(_partial_aggregate(self.values[250:], self.cells[250:], self.shape))
+        partial.merge(PartialAggregate(self.shape))
+        self._check_kernel(moments(), partial)
+
+        values, offsets = self._sorted()
+        for kernel in [mean(), stddev(), min(), max(), sum()]:
+            expected = kernel.get_values_for_segments(values, offsets)[0]
+            assert_allclose(kernel.get_values_from_partial_aggregate(partial)[0].ravel()[:19], expected, rtol=1e-12)
+
+    def test_partial_aggregates_on_different_grids_cant_be_merged(self):
+        with self.assertRaises(ValueError):
+            PartialAggregate((2, 3)).merge(PartialAggregate((3, 2)))
+
+
+class TestPercentiles(TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(2)
+        self.values = np.concatenate((random.normal(-5, 3, 500), np.zeros(20), random.lognormal(2, 1, 480)))
+        random.shuffle(self.values)
+        self.offsets = np.concatenate(([0, 0], np.sort(random.randint(0, 1000, 40)), [1000, 1000]))
+
+    def test_percentiles_of_all_segments_match_those_of_each_segment(self):
+        kernel = percentiles([0, 10, 50, 90, 100])
+        expected = AbstractDataOnlyKernel.get_values_for_segments(kernel, self.values, self.offsets)
+        assert_allclose(kernel.get_values_for_segments(self.values, self.offsets), expected, rtol=1e-12)
+        self.assertTrue(np.isnan(expected[:, 0]).all())
+
+    def test_approximate_percentiles_are_calculated_from_a_quantile_sketch(self):
+        kernel = percentiles([10, 50, 90], approximate=True, relative_accuracy=0.02)
+        cells = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        expected = QuantileSketch.from_values(cells, self.values, 0.02).percentiles([10, 50, 90], len(self.offsets) - 1)
+        assert_array_equal(kernel.get_values_for_segments(self.values, self.offsets), expected)
+        assert_array_equal(kernel.get_value_for_data_only(self.values[self.offsets[1]:self.offsets[2]]), expected[:, 1])
+
+    def test_median_has_a_single_output_with_the_variable_name(self):
+        self.assertEqual(median().return_size, 1)
+        self.assertEqual(median().get_variable_details('rain', 'Rain', None, 'mm')[0][0], 'rain')
+        self.assertEqual([d[0] for d in percentiles([5, 95]).get_variable_details('rain', 'Rain', None, 'mm')],
+                         ['rain_p5', 'rain_p95'])
+
+    def test_sketch_percentiles_are_within_the_relative_accuracy(self):
+        cells = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        sketch = QuantileSketch.from_values(cells, self.values, relative_accuracy=0.02)
+        approximate = sketch.percentiles([10, 50, 90], len(self.offsets) - 1)
+        for i in range(len(self.offsets) - 1):
+            cell_values = np.sort(self.values[self.offsets[i]:self.offsets[i + 1]])
+            if cell_values.size == 0:
+                self.assertTrue(np.isnan(approximate[:, i]).all())
+                continue
+            for j, percentile in enumerate([10, 50, 90]):
+                expected = cell_values[int(np.floor(percentile / 100.0 * (cell_values.size - 1)))]
+                assert_allclose(approximate[j, i], expected, rtol=0.02, atol=1e-300)
+
+    def test_merged_sketches_are_the_same_as_a_sketch_of_all_of_the_values(self):
+        cells = np.arange(self.values.size) % 7
+        expected = QuantileSketch.from_values(cells, self.values)
+        sketch = QuantileSketch.from_values(cells[:300], self.values[:300])
+        sketch.merge(QuantileSketch.from_values(cells[300:], self.values[300:]))
+        assert_array_equal(sketch.percentiles([25, 50, 75], 7), expected.percentiles([25, 50, 75], 7))
+        assert_array_equal(sketch.counts, expected.counts)
+
+
+class TestAggregateFiles(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.parts = [make_random_ungridded_data(seed) for seed in range(3)]
+        self.filenames = []
+        for i, part in enumerate(self.parts):
+            filename = os.path.join(self.directory, 'part{}.nc'.format(i))
+            part.save_data(filename)
+            self.filenames.append(filename)
+        self.grid = {'latitude': slice(-90, 90, 30), 'longitude': slice(-180, 180, 60)}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_aggregating_files_separately_gives_the_same_result_as_aggregating_them_together(self):
+        from cis import read_data
+        expected = UngriddedAggregator(dict(self.grid)).aggregate(read_data(self.filenames, 'rain'), moments())
+        output = UngriddedAggregator(dict(self.grid)).aggregate_files(self.filenames, 'rain', moments(), processes=1)
+
+        self.assertEqual([d.var_name for d in output], [d.var_name for d in expected])
+        for expected_data, output_data in zip(expected, output):
+            assert_allclose(output_data.data, expected_data.data, rtol=1e-12)
+            assert_array_equal(np.ma.getmaskarray(output_data.data), np.ma.getmaskarray(expected_data.data))
+            self.assertEqual(output_data.coords(), expected_data.coords())
+
+    def test_aggregating_several_variables_reads_each_file_once(self):
+        from mock import patch
+        from cis.data_io.data_reader import DataReader
+        read_data_list = DataReader.read_data_list
+        with patch.object(DataReader, 'read_data_list', autospec=True, side_effect=read_data_list) as reader:
+            output = UngriddedAggregator(dict(self.grid)).aggregate_files(self.filenames, ['rain', 'rain'], mean(),
+                                                                          processes=1)
+        self.assertEqual(reader.call_count, len(self.filenames))
+        self.assertEqual(len(output), 2)
+        assert_array_equal(output[0].data, output[1].data)
+
+    def test_aggregate_command_can_stream_the_files(self):
+        from argparse import Namespace
+        from cis import read_data
+        from cis.cis_main import aggregate_cmd
+        output = os.path.join(self.directory, 'out.nc')
+        arguments = Namespace(datagroups=[{'variables': ['rain'], 'filenames': self.filenames, 'kernel': 'mean'}],
+                              grid={'y': slice(-90, 90, 30), 'x': slice(-180, 180, 60)}, output=output, stream=True)
+        aggregate_cmd(arguments)
+
+        expected = read_data(self.filenames, 'rain').aggregate(how='mean', y=slice(-90, 90, 30), x=slice(-180, 180, 60))
+        assert_allclose(read_data(output, 'rain').data, expected.data, rtol=1e-12)
+
+    def test_aggregating_files_with_approximate_median_is_close_to_the_median(self):
+        from cis import read_data
+        expected = UngriddedAggregator(dict(self.grid)).aggregate(read_data(self.filenames, 'rain'), median())
+        output = UngriddedAggregator(dict(self.grid)).aggregate_files(self.filenames, 'rain', approximate_median(0.005),
+                                                                      processes=1)
+        assert_allclose(output[0].data, expected[0].data, rtol=0.05)
+
+    def test_approximate_median_gives_the_same_result_with_or_without_aggregating_files_separately(self):
+        from cis import read_data
+        expected = UngriddedAggregator(dict(self.grid)).aggregate(read_data(self.filenames, 'rain'),
+                                                                  approximate_median())
+        output = UngriddedAggregator(dict(self.grid)).aggregate_files(self.filenames, 'rain', approximate_median(),
+                                                                      processes=1)
+        assert_array_equal(output[0].data, expected[0].data)
+
+    def test_aggregating_files_with_exact_median_raises_error(self):
+        with self.assertRaises(ValueError):
+            UngriddedAggregator(dict(self.grid)).aggregate_files(self.filenames, 'rain', median())
+
+    def test_aggregating_files_with_a_kernel_overriding_the_data_only_method_raises_error(self):
+        class DoubledMean(mean):
+            def get_value_for_data_only(self, values):
+                return 2 * super(DoubledMean, self).get_value_for_data_only(values)
+
+        with self.assertRaises(ValueError):
+            UngriddedAggregator(dict(self.grid)).aggregate_files(self.filenames, 'rain', DoubledMean())
+
+    def test_aggregating_files_with_a_kernel_which_cant_be_merged_raises_error(self):
+        with self.assertRaises(ValueError):
+            UngriddedAggregator(dict(self.grid)).aggregate_files(self.filenames, 'rain', nn_horizontal())
+
+    def test_aggregating_files_without_grid_limits_raises_error(self):
+        grid = {'latitude': slice(None, None, 30)}
+        with self.assertRaises(ValueError):
+            UngriddedAggregator(grid).aggregate_files(self.filenames, 'rain', moments())
@@ -0,0 +1,107 @@
+"""
+Tests aggregating ungridded data keeping only the occupied cells of the grid
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from cis.aggregation.ungridded_aggregator import UngriddedAggregator
+from cis.collocation.col_implementations import moments, mean, nn_horizontal
+from cis.data_io.sparse_gridded_data import SparseGriddedData, SparseGriddedDataList
+from cis.data_io.ungridded_data import UngriddedDataList
+from cis.test.util.mock import make_random_ungridded_data
+
+
+def _make_data(altitude=False):
+    return make_random_ungridded_data(3, 300, lat_range=(-10, 10), lon_range=(20, 30),
+                                      altitude_range=(0, 1000) if altitude else None)
+
+
+class TestSparseAggregation(TestCase):
+
+    def setUp(self):
+        # A fine grid, on which most cells are empty
+        self.grid = {'latitude': slice(-90, 90, 0.5), 'longitude': slice(-180, 180, 0.5)}
+        self.data = _make_data()
+
+    def _check_same_as_dense(self, dense, sparse):
+        self.assertEqual([d.var_name for d in sparse], [d.var_name for d in dense])
+        for dense_data, sparse_data in zip(dense, sparse):
+            self.assertLess(sparse_data.cell_ids.size, dense_data.data.size / 100)
+            gridded = sparse_data.to_gridded()
+            assert_array_equal(np.ma.getmaskarray(gridded.data), np.ma.getmaskarray(dense_data.data))
+            assert_allclose(gridded.data.compressed(), dense_data.data.compressed(), rtol=1e-12)
+            self.assertEqual(gridded.coords(), dense_data.coords())
+            self.assertEqual(gridded.units, dense_data.units)
+
+    def test_sparse_aggregation_gives_the_same_result_as_dense_aggregation(self):
+        dense = UngriddedAggregator(dict(self.grid)).aggregate(self.data, moments())
+        sparse = UngriddedAggregator(dict(self.grid)).aggregate(self.data, moments(), sparse=True)
+        self.assertIsInstance(sparse, SparseGriddedDataList)
+        self._check_same_as_dense(dense, sparse)
+
+    def test_sparse_aggregation_with_a_collapsed_coordinate(self):
+        data = _make_data(altitude=True)
+        grid = {'x': slice(-180, 180, 0.25), 'y': slice(-90, 90, 0.25)}
+        dense = data.aggregate(how='mean', **grid)
+        sparse = data.aggregate(how='mean', sparse=True, **grid)
+        self.assertIsInstance(sparse, SparseGriddedData)
+        self._check_same_as_dense([dense], [sparse])
+        assert_allclose(sparse.coords()[2].bounds, dense.coord('altitude').bounds)
+
+    def test_sparse_aggregation_of_a_list_of_data_shares_the_grid(self):
+        other = _make_data()
+        other.var_name = 'snow'
+        data = UngriddedDataList([self.data, other])
+        sparse = data.aggregate(how=mean(), sparse=True, **self.grid)
+        self.assertEqual([d.var_name for d in sparse], ['rain', 'snow'])
+        assert_array_equal(sparse[0].values, sparse[1].values)
+        self.assertIs(sparse[0].coords()[0], sparse[1].coords()[0])
+
+    def test_sparse_aggregation_applies_an_overridden_data_only_method_to_each_cell(self):
+        class DoubledMean(mean):
+            def get_value_for_data_only(self, values):
+                return 2 * super(DoubledMean, self).get_value_for_data_only(values)
+
+        expected = UngriddedAggregator(dict(self.grid)).aggregate(self.data, mean(), sparse=True)
+        sparse = UngriddedAggregator(dict(self.grid)).aggregate(self.data, DoubledMean(), sparse=True)
+        assert_array_equal(sparse[0].cell_ids, expected[0].cell_ids)
+        assert_allclose(sparse[0].values, 2 * expected[0].values, rtol=1e-12)
+
+    def test_sparse_aggregation_with_a_kernel_which_cant_reduce_segments_raises_error(self):
+        with self.assertRaises(ValueError):
+            UngriddedAggregator(dict(self.grid)).aggregate(self.data, nn_horizontal(), sparse=True)
+
+
+class TestSparseGriddedDataSave(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'sparse.nc')
+        self.grid = {'latitude': slice(-90, 90, 0.5), 'longitude': slice(-180, 180, 0.5)}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_saved_sparse_data_uses_compression_by_gathering(self):
+        from netCDF4 import Dataset
+        sparse = _make_data().aggregate(how='moments', sparse=True, **self.grid)
+        sparse.save_data(self.filename)
+
+        with Dataset(self.filename) as nc_file:
+            cell = nc_file.variables['cell']
+            self.assertEqual(cell.compress, 'latitude longitude')
+            self.assertEqual(nc_file.variables['rain'].dimensions, ('cell',))
+            self.assertEqual(len(nc_file.dimensions['latitude']), 360)
+            self.assertIn('Aggregated using CIS', nc_file.history)
+            # Expand each variable onto the full grid using the (C order) list of cells
+            for data in sparse:
+                gridded = np.full(360 * 720, np.nan)
+                gridded[cell[:]] = np.ma.filled(nc_file.variables[data.var_name][:], np.nan)
+                expected = data.to_gridded().data
+                assert_allclose(gridded.reshape(expected.shape), np.ma.filled(expected, np.nan), rtol=1e-12)
+            self.assertEqual(nc_file.variables['latitude'].bounds, 'latitude_bnds')
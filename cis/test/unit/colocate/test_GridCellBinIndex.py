@@ -1,5 +1,6 @@
 import unittest
 
+import numpy
 from hamcrest import *
 
 from cis.collocation import data_index
@@ -66,3 +67,69 @@ class TestGridCellBinIndex(unittest.TestCase):
 
         final_points_index = [(out_index, hp, points) for out_index, hp, points in iterator]
         assert_that(len(final_points_index), is_(0), "Masked points should not be iterated over")
+
+
+class TestGridCellBinIndexLookup(unittest.TestCase):
+
+    def _create_index(self, sample_cube, data):
+        coord_map = make_coord_map(sample_cube, data)
+        coords = sample_cube.coords()
+        for coord in coords:
+            if not coord.has_bounds():
+                coord.guess_bounds()
+        index = data_index.GridCellBinIndex()
+        index.index_data(coords, data.get_non_masked_points(), coord_map)
+        return index
+
+    def test_GIVEN_points_WHEN_index_THEN_each_cell_has_the_points_within_its_bounds(self):
+        sample_cube = make_square_5x3_2d_cube_with_decreasing_latitude()
+        data = make_regular_2d_ungridded_data_with_missing_values()
+        index = self._create_index(sample_cube, data)
+
+        lat_bounds = sample_cube.coord('latitude').bounds
+        lon_bounds = sample_cube.coord('longitude').bounds
+        lats, lons = data.coord('latitude').points.ravel(), data.coord('longitude').points.ravel()
+        mask = numpy.ma.getmaskarray(data.data).ravel()
+        for i in range(5):
+            for j in range(3):
+                expected = [p for p in range(lats.size) if not mask[p] and
+                            min(lat_bounds[i]) <= lats[p] < max(lat_bounds[i]) and
+                            min(lon_bounds[j]) <= lons[p] < max(lon_bounds[j])]
+                points = index.get_points_by_indices((i, j))
+                if expected:
+                    assert_that(list(points), is_(expected))
+                else:
+                    assert_that(points, is_(None))
+
+    def test_GIVEN_points_outside_grid_WHEN_index_THEN_they_are_not_in_any_cell(self):
+        sample_cube = make_square_5x3_2d_cube()
+        data = make_regular_2d_ungridded_data(lat_dim_length=3, lat_min=20, lat_max=30)
+        index = self._create_index(sample_cube, data)
+        assert_that(index.sort_order.size, is_(0))
+        assert_that(index.get_points_by_indices((2, 1)), is_(None))
+
+
+class TestFindCellIndices(unittest.TestCase):
+
+    def _search(self, lower_bounds, values, max_bound):
+        expected = numpy.searchsorted(lower_bounds, values, side='right') - 1
+        expected[~(values < max_bound)] = -1
+        return expected
+
+    def _check(self, lower_bounds, values, max_bound):
+        out = numpy.empty(len(values), dtype=numpy.int64)
+        data_index._find_cell_indices(lower_bounds, values, max_bound, out)
+        assert_that(out.tolist(), is_(self._search(lower_bounds, values, max_bound).tolist()))
+
+    def test_GIVEN_regular_grid_WHEN_find_cells_THEN_same_as_searching_including_on_boundaries(self):
+        lower_bounds = numpy.arange(-180, 180, 0.1)
+        values = numpy.concatenate((numpy.random.RandomState(3).uniform(-200, 200, 1000), lower_bounds,
+                                    [-180.05, 180, 179.99999, -180 - 1e-12]))
+        self._check(lower_bounds, values, 180)
+
+    def test_GIVEN_irregular_grid_WHEN_find_cells_THEN_same_as_searching(self):
+        lower_bounds = numpy.array([-90, -60, -30, -10, 0, 10, 30, 60])
+        self._check(lower_bounds, numpy.array([-100, -90, -75, -10, -5, 10, 59.9, 60, 89, 90, 100.]), 90)
+
+    def test_GIVEN_nan_values_WHEN_find_cells_THEN_outside_grid(self):
+        self._check(numpy.arange(0., 10.), numpy.array([numpy.nan, 0.5, numpy.nan]), 10)
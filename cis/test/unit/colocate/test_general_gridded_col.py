@@ -1085,3 +1085,49 @@ class TestGeneralGriddedCollocator(unittest.TestCase):
         kernel = mean()
         out_cube = col.collocate(points=sample, data=data, constraint=constraint, kernel=kernel)
         assert out_cube[0].shape == (5, 3)
+
+
+class TestGeneralGriddedCollocatorSegmentedKernels(unittest.TestCase):
+    """
+    Kernels which reduce all of the cells at once should give the same results as reducing each cell in turn
+    """
+
+    def _collocate_both_ways(self, sample, missing_data_for_missing_sample=False):
+        # Some of the data points lie outside the sample grid
+        data = make_regular_2d_ungridded_data(lat_dim_length=31, lat_min=-15, lat_max=15, lon_dim_length=17,
+                                              lon_min=-8, lon_max=8)
+        col = GeneralGriddedCollocator(missing_data_for_missing_sample=missing_data_for_missing_sample)
+        expected = col.collocate(points=sample, data=data, constraint=BinnedCubeCellOnlyConstraint(),
+                                 kernel=FastMoments())
+        output = col.collocate(points=sample, data=data, constraint=BinnedCubeCellOnlyConstraint(), kernel=moments())
+        for expected_var, output_var in zip(expected, output):
+            assert_arrays_almost_equal(output_var.data, expected_var.data)
+            assert_that(numpy.ma.getmaskarray(output_var.data).tolist(),
+                        is_(numpy.ma.getmaskarray(expected_var.data).tolist()))
+        return output
+
+    def test_segmented_moments_match_cell_by_cell_moments(self):
+        output = self._collocate_both_ways(make_square_5x3_2d_cube())
+        assert_that(numpy.ma.count_masked(output[0].data), is_(0))
+
+    def test_segmented_moments_match_cell_by_cell_moments_with_missing_sample(self):
+        sample = make_square_5x3_2d_cube()
+        sample.data = numpy.ma.masked_array(sample.data, mask=numpy.zeros(sample.shape, dtype=bool))
+        sample.data[1, 2] = numpy.ma.masked
+        sample.data[4, 0] = numpy.ma.masked
+        output = self._collocate_both_ways(sample, missing_data_for_missing_sample=True)
+        assert_that(numpy.ma.count_masked(output[0].data), is_(2))
+
+    def test_subclass_which_overrides_the_data_only_method_is_applied_cell_by_cell(self):
+        class DoubledMean(mean):
+            def get_value_for_data_only(self, values):
+                return 2 * super(DoubledMean, self).get_value_for_data_only(values)
+
+        data = make_regular_2d_ungridded_data(lat_dim_length=31, lat_min=-15, lat_max=15, lon_dim_length=17,
+                                              lon_min=-8, lon_max=8)
+        col = GeneralGriddedCollocator()
+        expected = col.collocate(points=make_square_5x3_2d_cube(), data=data, constraint=BinnedCubeCellOnlyConstraint(),
+                                 kernel=mean())
+        output = col.collocate(points=make_square_5x3_2d_cube(), data=data, constraint=BinnedCubeCellOnlyConstraint(),
+                               kernel=DoubledMean())
+        assert_arrays_almost_equal(output[0].data, 2 * expected[0].data)
@@ -11,7 +11,8 @@ from cis.data_io.gridded_data import make_from_cube, GriddedDataList
 from cis.collocation.col_implementations import GeneralUngriddedCollocator, DummyConstraint, moments, \
     SepConstraintKdtree
 from cis.data_io.hyperpoint import HyperPoint
-from cis.data_io.ungridded_data import UngriddedData, UngriddedDataList
+from cis.collocation.haversinedistancekdtreeindex import HaversineDistanceKDTreeIndex
+from cis.data_io.ungridded_data import UngriddedData, UngriddedDataList, Metadata
 from cis.test.util import mock
 
 
@@ -127,6 +128,157 @@ class TestGeneralUngriddedCollocator(unittest.TestCase):
         assert all(output[4].data.mask)
         assert np.allclose(output[5].data, expected_n)
 
+    def test_box_collocation_with_data_only_kernel_matches_kernel_on_each_point(self):
+        from cis.collocation.col_implementations import mean, stddev, min, max, sum
+        data = mock.make_regular_4d_ungridded_data()
+        sample = UngriddedData.from_points_array(
+            [HyperPoint(lat=1.0, lon=1.0, alt=12.0, t=dt.datetime(1984, 8, 29, 8, 34)),
+             HyperPoint(lat=3.0, lon=3.0, alt=37.0, t=dt.datetime(1984, 8, 30, 8, 34)),
+             HyperPoint(lat=-1.0, lon=-1.0, alt=5.0, t=dt.datetime(1984, 9, 1, 8, 34)),
+             HyperPoint(lat=60.0, lon=60.0, alt=5.0, t=dt.datetime(1984, 9, 1, 8, 34))])
+        col = GeneralUngriddedCollocator()
+
+        for kernel_class in [mean, stddev, min, max, sum, moments]:
+            constraint = SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M')
+            output = col.collocate(sample, data, constraint, kernel_class())
+
+            # Compare with the result of the kernel applied to each set of constrained points in turn
+            constraint = SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M')
+            sample_points = sample.as_data_frame(time_index=False, name='vals')
+            data_points = data.as_data_frame(time_index=False, name='vals').dropna(axis=0)
+            constraint.haversine_distance_kd_tree_index = HaversineDistanceKDTreeIndex()
+            constraint.haversine_distance_kd_tree_index.index_data(sample, data_points, None)
+            expected = np.ma.masked_all((len(output), len(sample_points)))
+            for i, point, con_points in constraint.get_iterator(False, None, None, data_points, None,
+                                                                sample_points, None):
+                try:
+                    expected[:, i] = kernel_class().get_value(point, con_points)
+                except ValueError:
+                    pass
+            expected = np.ma.masked_invalid(expected)
+
+            for out, exp in zip(output, expected):
+                assert np.array_equal(out.data.mask, exp.mask)
+                assert np.allclose(out.data.compressed(), exp.compressed())
+
+    def test_collocation_with_multiple_workers_matches_single_process(self):
+        from cis.collocation.col_implementations import nn_t, nn_horizontal_only
+        data = mock.make_regular_4d_ungridded_data()
+        sample = UngriddedData.from_points_array(
+            [HyperPoint(lat=lat, lon=lon, alt=alt, t=dt.datetime(1984, 8, 29, 8, 34) + dt.timedelta(days=day))
+             for lat, lon, alt, day in [(1.0, 1.0, 12.0, 0), (3.0, 3.0, 37.0, 1), (-1.0, -1.0, 5.0, 3),
+                                        (60.0, 60.0, 5.0, 3), (-8.0, 4.0, 45.0, 2), (9.0, -4.0, 20.0, 0)]])
+
+        for kernel_class in [moments, nn_t, nn_horizontal_only]:
+            expected = GeneralUngriddedCollocator().collocate(
+                sample, data, SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M'), kernel_class())
+            output = GeneralUngriddedCollocator(workers=3).collocate(
+                sample, data, SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M'), kernel_class())
+
+            for out, exp in zip(output, expected):
+                assert np.array_equal(out.data.mask, exp.data.mask)
+                assert np.allclose(out.data.compressed(), exp.data.compressed())
+
+    def test_list_of_variables_on_the_same_points_shares_neighbours(self):
+        from cis.collocation.col_implementations import nn_t
+        data = mock.make_regular_4d_ungridded_data()
+        other_data = UngriddedData(np.ma.masked_greater(data.data + 100, 120), Metadata('other', units='1'),
+                                   data.coords())
+        sample = UngriddedData.from_points_array(
+            [HyperPoint(lat=1.0, lon=1.0, alt=12.0, t=dt.datetime(1984, 8, 29, 8, 34)),
+             HyperPoint(lat=3.0, lon=3.0, alt=37.0, t=dt.datetime(1984, 8, 30, 8, 34)),
+             HyperPoint(lat=-1.0, lon=-1.0, alt=5.0, t=dt.datetime(1984, 9, 1, 8, 34)),
+             HyperPoint(lat=60.0, lon=60.0, alt=5.0, t=dt.datetime(1984, 9, 1, 8, 34))])
+
+        for kernel_class in [moments, nn_t]:
+            output = GeneralUngriddedCollocator().collocate(
+                sample, UngriddedDataList([data, other_data]),
+                SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M'), kernel_class())
+
+            expected = UngriddedDataList()
+            for var in [data, other_data]:
+                expected.extend(GeneralUngriddedCollocator().collocate(
+                    sample, var, SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M'), kernel_class()))
+
+            eq_(len(output), len(expected))
+            for out, exp in zip(output, expected):
+                eq_(out.name(), exp.name())
+                assert np.array_equal(out.data.mask, exp.data.mask)
+                assert np.allclose(out.data.compressed(), exp.data.compressed())
+
+    def _make_sample_for_chunking(self):
+        return UngriddedData.from_points_array(
+            [HyperPoint(lat=lat, lon=lon, alt=alt, t=dt.datetime(1984, 8, 29, 8, 34) + dt.timedelta(days=day))
+             for lat, lon, alt, day in [(1.0, 1.0, 12.0, 0), (3.0, 3.0, 37.0, 1), (-1.0, -1.0, 5.0, 3),
+                                        (60.0, 60.0, 5.0, 3), (-8.0, 4.0, 45.0, 2), (9.0, -4.0, 20.0, 0),
+                                        (2.0, 2.0, 24.0, 1)]])
+
+    def test_collocation_in_chunks_matches_collocation_all_at_once(self):
+        from cis.collocation.col_implementations import nn_t, nn_horizontal_only
+        data = mock.make_regular_4d_ungridded_data()
+        sample = self._make_sample_for_chunking()
+
+        for kernel_class in [moments, nn_t, nn_horizontal_only]:
+            expected = GeneralUngriddedCollocator().collocate(
+                sample, data, SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M'), kernel_class())
+            output = GeneralUngriddedCollocator(chunk_size=3).collocate(
+                sample, data, SepConstraintKdtree('1000km', a_sep='15m', t_sep='P1DT1M'), kernel_class())
+
+            for out, exp in zip(output, expected):
+                assert np.array_equal(out.data.mask, exp.data.mask)
+                assert np.allclose(out.data.compressed(), exp.data.compressed())
+
+    def test_collocation_to_file_in_chunks_matches_saved_collocation(self):
+        import os
+        import shutil
+        import tempfile
+        from netCDF4 import Dataset
+        data = mock.make_regular_4d_ungridded_data()
+        data = UngriddedData(data.data, Metadata('rain', units='kg m-2 s-1'), data.coords())
+        other_data = UngriddedData(np.ma.masked_greater(data.data + 100, 120), Metadata('other', units='1'),
+                                   data.coords())
+        sample = self._make_sample_for_chunking()
+
+        expected = GeneralUngriddedCollocator().collocate(
+            sample, UngriddedDataList([data, other_data]), SepConstraintKdtree('1000km', t_sep='P1DT1M'), moments())
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            output_file = os.path.join(tmp_dir, 'out.nc')
+            GeneralUngriddedCollocator(chunk_size=2).collocate_to_file(
+                sample, UngriddedDataList([data, other_data]), SepConstraintKdtree('1000km', t_sep='P1DT1M'),
+                moments(), output_file, history='Collocated in chunks')
+
+            with Dataset(output_file) as f:
+                eq_(len(f.dimensions['obs']), 7)
+                assert np.allclose(f.variables['latitude'][:], sample.coord('latitude').data)
+                for exp in expected:
+                    var = f.variables[exp.var_name]
+                    assert var.history.endswith('Collocated in chunks')
+                    out = var[:]
+                    assert np.array_equal(np.ma.getmaskarray(out), np.ma.getmaskarray(exp.data))
+                    assert np.allclose(out.compressed(), exp.data.compressed())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            GeneralUngriddedCollocator(chunk_size=0)
+
+    def test_invalid_number_of_workers(self):
+        with self.assertRaises(ValueError):
+            GeneralUngriddedCollocator(workers=0)
+
+    def test_get_neighbour_indices_without_horizontal_constraint(self):
+        data = mock.make_regular_4d_ungridded_data()
+        sample = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, alt=50.0, t=dt.datetime(1984, 8, 29)),
+             HyperPoint(lat=0.0, lon=0.0, alt=500.0, t=dt.datetime(1984, 8, 29))])
+        constraint = SepConstraintKdtree(a_sep='15m')
+        offsets, indices = constraint.get_neighbour_indices(data.as_data_frame(time_index=False, name='vals'),
+                                                            sample.as_data_frame(time_index=False, name='vals'))
+        eq_(list(offsets), [0, 15, 15])
+        assert np.array_equal(data.data.flatten()[indices], np.arange(21.0, 36.0))
+
 if __name__ == '__main__':
     import nose
     nose.runmodule()
@@ -8,7 +8,8 @@ from iris.exceptions import CoordinateNotFoundError
 import numpy
 
 from cis.exceptions import ClassNotFoundError
-from cis.collocation.col_implementations import GriddedCollocator, gridded_gridded_nn, gridded_gridded_li, nn_p
+from cis.collocation.col_implementations import GriddedCollocator, gridded_gridded_nn, gridded_gridded_li, nn_p, \
+    gridded_gridded_area_weighted
 import cis.data_io.gridded_data as gridded_data
 from cis.test.util.mock import make_dummy_2d_cube, make_dummy_2d_cube_with_small_offset_in_lat_and_lon, \
     make_dummy_2d_cube_with_small_offset_in_lat, make_dummy_2d_cube_with_small_offset_in_lon, \
@@ -1278,3 +1279,125 @@ class TestGriddedGriddedCollocator(GriddedGriddedCollocatorTests, TestCase):
         col = self.collocator
         out_cube = col.collocate(points=sample, data=data, constraint=None, kernel=gridded_gridded_nn())
         assert out_cube[0].shape == sample.shape
+
+
+class TestAreaWeightedGriddedCollocator(TestCase):
+
+    @staticmethod
+    def _make_global_cube(spacing, lon_start=0.0, data=None, time_dim_length=0):
+        import iris.cube
+        from iris.coords import DimCoord
+        lat = DimCoord(numpy.arange(-90 + spacing / 2.0, 90, spacing), standard_name='latitude', units='degrees')
+        lon = DimCoord(numpy.arange(lon_start + spacing / 2.0, lon_start + 360, spacing), standard_name='longitude',
+                       units='degrees', circular=True)
+        for coord in (lat, lon):
+            coord.guess_bounds()
+        shape = (len(lat.points), len(lon.points))
+        dim_coords = [(lat, 0), (lon, 1)]
+        if time_dim_length:
+            shape += (time_dim_length,)
+            dim_coords.append((DimCoord(numpy.arange(time_dim_length, dtype=float), standard_name='time',
+                                        units='days since 1984-08-27'), 2))
+        if data is None:
+            data = numpy.arange(numpy.prod(shape), dtype=float).reshape(shape)
+        return gridded_data.make_from_cube(iris.cube.Cube(data, var_name='rain', units='mm',
+                                                          dim_coords_and_dims=dim_coords))
+
+    @staticmethod
+    def _global_mean(cube):
+        lat_bounds = numpy.radians(cube.coord('latitude').bounds)
+        lon_bounds = numpy.radians(cube.coord('longitude').bounds)
+        areas = numpy.outer(numpy.diff(numpy.sin(lat_bounds), axis=1), numpy.diff(lon_bounds, axis=1))
+        areas = areas.reshape(areas.shape + (1,) * (cube.ndim - 2))
+        return (cube.data * areas).sum(axis=(0, 1)) / areas.sum()
+
+    def test_same_grid_returns_original_data(self):
+        data = self._make_global_cube(30)
+        out_cube = GriddedCollocator().collocate(self._make_global_cube(30), data, None,
+                                                 gridded_gridded_area_weighted())[0]
+        numpy.testing.assert_allclose(out_cube.data, data.data)
+        assert out_cube.var_name == 'rain'
+
+    def test_regridded_values_are_area_weighted_means_and_conserve_the_global_mean(self):
+        data = self._make_global_cube(30, time_dim_length=3)
+        sample = self._make_global_cube(60, lon_start=-180)
+
+        out_cube = GriddedCollocator().collocate(sample, gridded_data.make_from_cube(data.copy()), None,
+                                                 gridded_gridded_area_weighted())[0]
+
+        assert out_cube.shape == (3, 6, 3)
+        numpy.testing.assert_allclose(self._global_mean(out_cube), self._global_mean(data))
+        # The first target cell covers latitudes -90 to -30 and longitudes -180 to -120, i.e. the source cells at
+        #  latitudes -75 and -45 and longitudes 195 and 225
+        lat_weights = numpy.diff(numpy.sin(numpy.radians([-90, -60, -30])))
+        expected = numpy.average([numpy.mean(data.data[0, 6:8, 0]), numpy.mean(data.data[1, 6:8, 0])],
+                                 weights=lat_weights)
+        numpy.testing.assert_allclose(out_cube.data[0, 0, 0], expected)
+
+    def test_masked_source_cells_are_excluded(self):
+        values = numpy.ma.masked_array(numpy.ones((6, 12)), mask=numpy.zeros((6, 12), dtype=bool))
+        values[:, 0] = 100
+        values.mask[:, 0] = True
+        values.mask[:3, :] = True
+        data = self._make_global_cube(30, data=values)
+
+        out_cube = GriddedCollocator().collocate(self._make_global_cube(90), data, None,
+                                                 gridded_gridded_area_weighted())[0]
+
+        numpy.testing.assert_allclose(out_cube.data[1, :], 1.0)
+        assert out_cube.data.mask[0, :].all()
+
+    def test_missing_sample_values_are_masked(self):
+        sample = self._make_global_cube(90)
+        sample.data = numpy.ma.masked_array(sample.data, mask=[[True, False, False, False], [False] * 4])
+
+        out_cube = GriddedCollocator(missing_data_for_missing_sample=True).collocate(
+            sample, self._make_global_cube(30), None, gridded_gridded_area_weighted())[0]
+
+        numpy.testing.assert_array_equal(out_cube.data.mask, sample.data.mask)
+
+    def test_weights_are_reused_for_other_variables_on_the_same_grids(self):
+        from mock import patch
+        from cis.collocation import conservative_regridding
+        data = gridded_data.GriddedDataList([self._make_global_cube(30), self._make_global_cube(30)])
+        sample = self._make_global_cube(60)
+
+        with patch.object(conservative_regridding, '_calculate_area_weights',
+                          wraps=conservative_regridding._calculate_area_weights) as calculate:
+            recent_weights = {}
+            output = GriddedCollocator(recent_weights=recent_weights).collocate(sample, data, None,
+                                                                                gridded_gridded_area_weighted())
+            GriddedCollocator(recent_weights=recent_weights).collocate(sample, self._make_global_cube(30), None,
+                                                                       gridded_gridded_area_weighted())
+            assert calculate.call_count == 1
+            # Collocators don't share the weights unless they are given the same dictionary
+            GriddedCollocator().collocate(sample, self._make_global_cube(30), None, gridded_gridded_area_weighted())
+            assert calculate.call_count == 2
+        assert len(output) == 2
+
+    def test_regridding_in_blocks_of_slices_gives_the_same_result(self):
+        from cis.collocation.conservative_regridding import get_area_weights, regrid
+        data = self._make_global_cube(30, time_dim_length=5)
+        # Mask all of the source cells of the northernmost target row, and some of those of the row before it
+        data.data = numpy.ma.masked_greater(data.data, 210)
+        sample = self._make_global_cube(60)
+        weights = get_area_weights(data.coord('latitude'), data.coord('longitude'), sample.coord('latitude'),
+                                   sample.coord('longitude'))
+
+        expected = regrid(data.data, weights, 0, 1, (3, 6))
+        # Each block holds two of the time slices
+        blocks = regrid(data.data, weights, 0, 1, (3, 6), block_size=2 * 72)
+
+        assert blocks.shape == (3, 6, 5)
+        numpy.testing.assert_array_equal(blocks.mask, expected.mask)
+        numpy.testing.assert_allclose(blocks.compressed(), expected.compressed())
+        assert expected.mask.any() and not expected.mask.all()
+
+    def test_overlap_matrix_with_wrapping(self):
+        from cis.collocation.conservative_regridding import overlap_matrix
+        source = numpy.array([[0., 90.], [90., 180.], [180., 270.], [270., 360.]])
+        target = numpy.array([[-135., -45.], [-45., 45.]])
+
+        overlaps = overlap_matrix(source, target, modulus=360.).toarray()
+
+        numpy.testing.assert_allclose(overlaps, [[0., 0., 45., 45.], [45., 0., 0., 45.]])
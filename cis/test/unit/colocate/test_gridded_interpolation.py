@@ -22,10 +22,12 @@ from __future__ import division, print_function, absolute_import
 
 import itertools
 import numpy as np
-from numpy.testing import (assert_array_almost_equal, assert_raises,
+from numpy.testing import (assert_array_almost_equal, assert_array_equal, assert_raises,
                            TestCase, assert_allclose)
 
-from cis.collocation.gridded_interpolation import _RegularGridInterpolator, GriddedUngriddedInterpolator
+from cis.collocation.gridded_interpolation import _RegularGridInterpolator, GriddedUngriddedInterpolator, \
+    GriddedUngriddedTimeStreamingInterpolator
+from nose.tools import eq_
 from scipy.interpolate import LinearNDInterpolator, NearestNDInterpolator
 
 
@@ -53,6 +55,20 @@ class TestRegularGridInterpolator(TestCase):
         values = (values0 + values1 * 10 + values2 * 100 + values3 * 1000)
         return points, values
 
+    def test_chunked_and_threaded_evaluation_matches_evaluating_all_points_at_once(self):
+        points, values = self._get_sample_4d()
+        sample = np.random.RandomState(1).uniform(-0.1, 1.1, size=(1000, 4))
+        # Interpolate two stacked variables at once too
+        stacked_values = np.stack([values, values * 2], axis=-1)
+
+        for method in ['lin', 'nn']:
+            interp = _RegularGridInterpolator(points, sample.T, method=method)
+            expected = interp(stacked_values, chunk_size=len(sample))
+            for workers in [1, 3]:
+                values_in_chunks = interp(stacked_values, workers=workers, chunk_size=64)
+                assert_allclose(values_in_chunks, expected)
+                assert_array_equal(values_in_chunks.mask, expected.mask)
+
     def test_list_input(self):
         points, values = self._get_sample_4d()
 
@@ -227,6 +243,72 @@ class TestRegularGridInterpolator(TestCase):
         wanted = np.asarray([8.8, 11.2, 4.8])
         assert_array_almost_equal(values, wanted)
 
+    def test_vertical_indices_in_increasing_and_decreasing_columns(self):
+        columns = np.array([[0., 10., 20., 30.],
+                            [30., 20., 10., 0.],
+                            [0., 10., 20., 30.],
+                            [1000., 800., 500., 100.],
+                            [0., 10., 20., 30.]])
+        points = np.array([15., 15., -5., 900., 30.])
+
+        indices, norm_distances, out_of_bounds = _RegularGridInterpolator._find_vertical_indices(points, columns,
+                                                                                              chunk_size=2)
+
+        assert_array_equal(indices, [1, 1, 0, 0, 2])
+        assert_array_almost_equal(norm_distances, [0.5, 0.5, -0.5, 0.5, 1.0])
+        assert_array_equal(out_of_bounds, [False, False, True, False, False])
+
+    def test_vertical_indices_match_searching_each_column(self):
+        rng = np.random.RandomState(0)
+        columns = np.cumsum(rng.uniform(1, 10, size=(50, 8)), axis=1)
+        points = rng.uniform(0, 60, size=50)
+
+        indices, norm_distances, _ = _RegularGridInterpolator._find_vertical_indices(points, columns)
+
+        for point, column, index, norm_distance in zip(points, columns, indices, norm_distances):
+            expected_index = np.clip(np.searchsorted(column, point) - 1, 0, column.size - 2)
+            eq_(index, expected_index)
+            assert_allclose(norm_distance, (point - column[index]) / (column[index + 1] - column[index]))
+
+    def test_hybrid_Coord_with_decreasing_and_circular_coords(self):
+        from cis.test.util.mock import make_mock_cube
+        from cis.data_io.ungridded_data import UngriddedData
+        from cis.data_io.hyperpoint import HyperPoint
+        import datetime as dt
+        cube = make_mock_cube(time_dim_length=3, hybrid_ht_len=10)
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, alt=5550.0, t=dt.datetime(1984, 8, 28)),
+             HyperPoint(lat=4.0, lon=-4.0, alt=5600.0, t=dt.datetime(1984, 8, 28, 18)),
+             HyperPoint(lat=-4.0, lon=4.0, alt=5500.0, t=dt.datetime(1984, 8, 27, 12))])
+        wanted = GriddedUngriddedInterpolator(cube, sample_points, 'lin')(cube)
+
+        # Reversing the latitudes reverses the hybrid coordinate along with the data
+        reversed_cube = cube[::-1]
+        reversed_cube.coord('longitude').circular = True
+        values = GriddedUngriddedInterpolator(reversed_cube, sample_points, 'lin')(reversed_cube)
+
+        assert not np.ma.is_masked(wanted)
+        assert_array_almost_equal(values, wanted)
+
+    def test_decreasing_and_circular_coords_read_the_data_without_copying(self):
+        from cis.test.util.mock import make_mock_cube
+        from cis.data_io.ungridded_data import UngriddedData
+        from cis.data_io.hyperpoint import HyperPoint
+        cube = make_mock_cube(lat_dim_length=5, lon_dim_length=8, lon_range=(0., 315.))
+        sample_points = UngriddedData.from_points_array([HyperPoint(lat=3.0, lon=340.0), HyperPoint(lat=-1.0, lon=5.0),
+                                                         HyperPoint(lat=2.0, lon=100.0)])
+        cube.coord('longitude').circular = True
+        wanted = GriddedUngriddedInterpolator(cube, sample_points, 'lin')(cube)
+
+        reversed_cube = cube[::-1]
+        interpolator = GriddedUngriddedInterpolator(reversed_cube, sample_points, 'lin')
+        # The whole of the (reversed and wrapped) slice is read once, rather than copied into the order of the grid
+        data_slices = tuple(interpolator._hyperslab_slices)
+        assert_array_equal(interpolator._read_hyperslab(reversed_cube), reversed_cube.data[data_slices])
+
+        assert not np.ma.is_masked(wanted)
+        assert_array_almost_equal(interpolator(reversed_cube), wanted)
+
     def test_hybrid_Coord_nn(self):
         from cis.test.util.mock import make_mock_cube
         from cis.data_io.ungridded_data import UngriddedData
@@ -388,6 +470,193 @@ class TestRegularGridInterpolator(TestCase):
         assert_array_almost_equal(interpolator(cube, extrapolate=True), wanted)
 
 
+class TestGriddedUngriddedInterpolatorHyperslab(TestCase):
+
+    def _make_global_cube(self):
+        import iris.cube
+        from iris.coords import DimCoord
+        from cis.data_io.gridded_data import make_from_cube
+        lat = DimCoord(np.arange(80., -81., -10.), standard_name='latitude', units='degrees')
+        lon = DimCoord(np.arange(0., 360., 10.), standard_name='longitude', units='degrees', circular=True)
+        # The value is 100 * latitude + the longitude index
+        data = 100 * lat.points[:, np.newaxis] + np.arange(len(lon.points))[np.newaxis, :]
+        return make_from_cube(iris.cube.Cube(data, dim_coords_and_dims=[(lat, 0), (lon, 1)]))
+
+    def test_only_the_cells_around_the_sample_points_are_read(self):
+        from cis.data_io.ungridded_data import UngriddedData
+        from cis.data_io.hyperpoint import HyperPoint
+        cube = self._make_global_cube()
+        sample_points = UngriddedData.from_points_array([HyperPoint(lat=25.0, lon=45.0), HyperPoint(lat=5.0, lon=62.0)])
+
+        interpolator = GriddedUngriddedInterpolator(cube, sample_points, 'lin')
+
+        # Latitudes 30 to 0 and longitudes 40 to 70
+        assert interpolator._hyperslab_slices == [slice(5, 9), slice(4, 8)]
+        assert_array_almost_equal(interpolator(cube), [2504.5, 506.2])
+
+    def test_interpolation_across_the_circular_longitude_with_decreasing_latitude(self):
+        from cis.data_io.ungridded_data import UngriddedData
+        from cis.data_io.hyperpoint import HyperPoint
+        cube = self._make_global_cube()
+        sample_points = UngriddedData.from_points_array([HyperPoint(lat=5.0, lon=355.0),
+                                                         HyperPoint(lat=-45.0, lon=15.0)])
+
+        values = GriddedUngriddedInterpolator(cube, sample_points, 'lin')(cube)
+
+        assert_array_almost_equal(values, [517.5, -4498.5])
+
+
+class TestGriddedUngriddedTimeStreamingInterpolator(TestCase):
+
+    def _make_sample_points(self):
+        from cis.data_io.ungridded_data import UngriddedData
+        from cis.data_io.hyperpoint import HyperPoint
+        import datetime as dt
+        return UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, pres=111100040.5, alt=5000, t=dt.datetime(1984, 8, 28, 0, 0, 0)),
+             HyperPoint(lat=0.0, lon=0.0, pres=113625040.5, alt=4000, t=dt.datetime(1984, 8, 28, 12, 0, 0)),
+             HyperPoint(lat=5.0, lon=2.5, pres=177125044.5, alt=3000, t=dt.datetime(1984, 8, 28, 0, 0, 0)),
+             HyperPoint(lat=-4.0, lon=-4.0, pres=166600039.0, alt=3500, t=dt.datetime(1984, 8, 27)),
+             HyperPoint(lat=2.0, lon=1.0, pres=166600039.0, alt=3500, t=dt.datetime(1984, 8, 29, 6))])
+
+    def test_matches_interpolating_the_whole_time_series(self):
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=4)
+        sample_points = self._make_sample_points()
+
+        interpolator = GriddedUngriddedTimeStreamingInterpolator(cube, sample_points, 'lin')
+
+        # The points fall between three different pairs of time steps
+        eq_(len(interpolator._steps), 3)
+        assert_array_almost_equal(interpolator(cube), GriddedUngriddedInterpolator(cube, sample_points, 'lin')(cube))
+
+    def test_matches_interpolating_the_whole_time_series_with_hybrid_coord(self):
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=3, hybrid_pr_len=10)
+        sample_points = self._make_sample_points()
+
+        values = GriddedUngriddedTimeStreamingInterpolator(cube, sample_points, 'lin')(cube)
+
+        wanted = GriddedUngriddedInterpolator(cube, sample_points, 'lin')(cube)
+        assert_array_almost_equal(values, wanted)
+        assert_array_equal(values.mask, wanted.mask)
+
+    def test_decreasing_time_and_a_list_of_variables(self):
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=4)
+        reversed_cube = cube[:, :, ::-1]
+        other_cube = reversed_cube * 2
+        sample_points = self._make_sample_points()
+
+        values = GriddedUngriddedTimeStreamingInterpolator(reversed_cube, sample_points, 'nn')([reversed_cube,
+                                                                                                other_cube])
+
+        wanted = GriddedUngriddedInterpolator(cube, sample_points, 'nn')(cube)
+        assert_array_almost_equal(values[0], wanted)
+        assert_array_almost_equal(values[1], wanted * 2)
+
+    def test_missing_sample_points_are_masked(self):
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=4)
+        sample_points = self._make_sample_points()
+        sample_points.data = np.ma.masked_array(sample_points.data, mask=[False, True, False, False, False])
+
+        values = GriddedUngriddedTimeStreamingInterpolator(cube, sample_points, 'lin', True)(cube)
+
+        wanted = GriddedUngriddedInterpolator(cube, sample_points, 'lin', True)(cube)
+        assert_array_almost_equal(values, wanted)
+        assert_array_equal(values.mask, [False, True, False, False, False])
+
+    def test_data_without_time_raises_error(self):
+        from cis.test.util.mock import make_mock_cube
+        with assert_raises(ValueError):
+            GriddedUngriddedTimeStreamingInterpolator(make_mock_cube(), self._make_sample_points(), 'lin')
+
+
+class TestInterpolationWeightsCache(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.cache_dir)
+
+    def _make_sample_points(self, lat=0.0):
+        from cis.data_io.ungridded_data import UngriddedData
+        from cis.data_io.hyperpoint import HyperPoint
+        import datetime as dt
+        return UngriddedData.from_points_array(
+            [HyperPoint(lat=lat, lon=0.0, pres=111100040.5, alt=5000, t=dt.datetime(1984, 8, 28, 0, 0, 0)),
+             HyperPoint(lat=5.0, lon=2.5, pres=177125044.5, alt=3000, t=dt.datetime(1984, 8, 28, 0, 0, 0)),
+             HyperPoint(lat=-4.0, lon=-4.0, pres=166600039.0, alt=3500, t=dt.datetime(1984, 8, 27))])
+
+    def test_weights_are_read_from_the_cache(self):
+        import os
+        from mock import patch
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=3, hybrid_pr_len=10)
+        expected = GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'lin', cache_dir=self.cache_dir)(cube)
+        eq_(len(os.listdir(self.cache_dir)), 1)
+
+        with patch.object(_RegularGridInterpolator, '_find_indices') as find_indices:
+            interpolator = GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'lin',
+                                                        cache_dir=self.cache_dir)
+            eq_(find_indices.call_count, 0)
+        values = interpolator(cube * 2)
+
+        assert_array_almost_equal(values, expected * 2)
+        assert_array_equal(values.mask, expected.mask)
+
+    def test_most_recent_weights_are_reused_without_a_cache(self):
+        from mock import patch
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=3)
+        recent_weights = {}
+        expected = GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'nn',
+                                                recent_weights=recent_weights)(cube)
+
+        with patch.object(_RegularGridInterpolator, '_find_indices') as find_indices:
+            values = GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'nn',
+                                                  recent_weights=recent_weights)(cube)
+            eq_(find_indices.call_count, 0)
+
+        assert_array_almost_equal(values, expected)
+
+    def test_weights_are_not_shared_between_interpolators_by_default(self):
+        from mock import patch
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=3)
+        GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'nn')
+
+        with patch.object(_RegularGridInterpolator, '_find_indices', side_effect=AssertionError):
+            with assert_raises(AssertionError):
+                GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'nn')
+
+    def test_weights_are_not_reused_for_data_in_a_different_order(self):
+        from mock import patch
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=3)
+        recent_weights = {}
+        GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'lin', recent_weights=recent_weights)
+
+        # The reversed latitudes give the same grid, but it maps onto the data differently
+        with patch.object(_RegularGridInterpolator, '_find_indices', side_effect=AssertionError):
+            with assert_raises(AssertionError):
+                GriddedUngriddedInterpolator(cube[::-1], self._make_sample_points(), 'lin',
+                                             recent_weights=recent_weights)
+
+    def test_weights_are_not_reused_for_different_points_or_methods(self):
+        import os
+        from cis.test.util.mock import make_mock_cube
+        cube = make_mock_cube(time_dim_length=3)
+        GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'lin', cache_dir=self.cache_dir)
+        GriddedUngriddedInterpolator(cube, self._make_sample_points(lat=1.0), 'lin', cache_dir=self.cache_dir)
+        GriddedUngriddedInterpolator(cube, self._make_sample_points(), 'nn', cache_dir=self.cache_dir)
+        eq_(len(os.listdir(self.cache_dir)), 3)
+
+
 class MyValue(object):
     """
     Minimal indexable object
@@ -11,6 +11,7 @@ from cis.test.util import mock
 
 from numpy.testing import assert_almost_equal, assert_equal, assert_raises
 from nose.tools import eq_
+from mock import patch
 
 
 class TestGriddedUngriddedCollocator(unittest.TestCase):
@@ -114,6 +115,30 @@ class TestGriddedUngriddedCollocator(unittest.TestCase):
         # And this one because of the extrapolation
         assert np.ma.is_masked(new_data.data[2])
 
+    def test_list_of_variables_is_interpolated_together(self):
+        from cis.data_io.gridded_data import GriddedDataList
+        cube = make_from_cube(mock.make_mock_cube(time_dim_length=3, hybrid_ht_len=10))
+        other_cube = cube.copy(data=np.ma.masked_greater(cube.data * 2.0 + 1.0, 300.0))
+        other_cube.var_name = 'other'
+
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, alt=5550.0, t=dt.datetime(1984, 8, 28)),
+             HyperPoint(lat=4.0, lon=4.0, alt=6000.0, t=dt.datetime(1984, 8, 28)),
+             HyperPoint(lat=-4.0, lon=-4.0, alt=6500.0, t=dt.datetime(1984, 8, 27))])
+        sample_points.data = np.ma.array([0, 0, 0], mask=[False, True, False])
+
+        for kernel in ['lin', 'nn']:
+            output = GriddedUngriddedCollocator(missing_data_for_missing_sample=True).collocate(
+                sample_points, GriddedDataList([cube, other_cube]), None, kernel)
+
+            eq_(len(output), 2)
+            eq_(output[1].var_name, 'other')
+            for var, out in zip([cube, other_cube], output):
+                expected = GriddedUngriddedCollocator(missing_data_for_missing_sample=True).collocate(
+                    sample_points, var, None, kernel)[0]
+                assert_equal(out.data.mask, expected.data.mask)
+                assert_almost_equal(out.data.compressed(), expected.data.compressed())
+
     def test_collocation_of_pres_points_on_hybrid_altitude_coordinates(self):
         cube = make_from_cube(mock.make_mock_cube(time_dim_length=3, hybrid_ht_len=10))
 
@@ -734,3 +759,58 @@ class TestLinear(unittest.TestCase):
         assert_almost_equal(new_data.data[0], 8.8)
         assert_almost_equal(new_data.data[1], 11.2)
         assert_almost_equal(new_data.data[2], 4.8)
+
+    def test_collocation_streaming_through_time(self):
+        cube = make_from_cube(mock.make_mock_cube(time_dim_length=3, hybrid_ht_len=10))
+
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, alt=5550.0, t=dt.datetime(1984, 8, 28, 0, 0, 0)),
+             HyperPoint(lat=4.0, lon=-4.0, alt=5600.0, t=dt.datetime(1984, 8, 28, 18, 0, 0)),
+             HyperPoint(lat=-4.0, lon=4.0, alt=5500.0, t=dt.datetime(1984, 8, 27, 12, 0, 0))])
+
+        expected = GriddedUngriddedCollocator(fill_value=np.NAN).collocate(sample_points, cube, None, 'lin')[0]
+        col = GriddedUngriddedCollocator(fill_value=np.NAN, stream_time='True')
+        new_data = col.collocate(sample_points, cube, None, 'lin')[0]
+
+        assert col.stream_time
+        assert not np.ma.is_masked(expected.data)
+        assert_almost_equal(new_data.data, expected.data)
+
+    def test_weights_of_every_time_step_are_reused_when_streaming_through_time(self):
+        from mock import patch
+        from cis.collocation.gridded_interpolation import _RegularGridInterpolator
+        cube = make_from_cube(mock.make_mock_cube(time_dim_length=3, hybrid_ht_len=10))
+
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, alt=5550.0, t=dt.datetime(1984, 8, 28, 0, 0, 0)),
+             HyperPoint(lat=4.0, lon=-4.0, alt=5600.0, t=dt.datetime(1984, 8, 28, 18, 0, 0)),
+             HyperPoint(lat=-4.0, lon=4.0, alt=5500.0, t=dt.datetime(1984, 8, 27, 12, 0, 0))])
+
+        recent_weights = {}
+        col = GriddedUngriddedCollocator(fill_value=np.NAN, stream_time=True, recent_weights=recent_weights)
+        expected = col.collocate(sample_points, cube, None, 'lin')[0]
+        assert len(col.interpolator._steps) > 1
+        eq_(len(recent_weights), len(col.interpolator._steps))
+
+        # Collocating the next variable onto the same points reuses the weights of every step
+        col = GriddedUngriddedCollocator(fill_value=np.NAN, stream_time=True, recent_weights=recent_weights)
+        with patch.object(_RegularGridInterpolator, '_find_indices', side_effect=AssertionError):
+            new_data = col.collocate(sample_points, make_from_cube(cube * 2), None, 'lin')[0]
+
+        assert_almost_equal(new_data.data, expected.data * 2)
+
+    def test_collocation_with_multiple_workers(self):
+        from cis.collocation import gridded_interpolation
+        cube = make_from_cube(mock.make_mock_cube(time_dim_length=3, hybrid_ht_len=10))
+
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, alt=5550.0, t=dt.datetime(1984, 8, 28, 0, 0, 0)),
+             HyperPoint(lat=4.0, lon=-4.0, alt=5600.0, t=dt.datetime(1984, 8, 28, 18, 0, 0)),
+             HyperPoint(lat=-4.0, lon=4.0, alt=5500.0, t=dt.datetime(1984, 8, 27, 12, 0, 0))])
+
+        expected = GriddedUngriddedCollocator(fill_value=np.NAN).collocate(sample_points, cube, None, 'lin')[0]
+        with patch.object(gridded_interpolation, 'EVALUATION_CHUNK_SIZE', 1):
+            new_data = GriddedUngriddedCollocator(fill_value=np.NAN, workers=2).collocate(sample_points, cube, None,
+                                                                                         'lin')[0]
+
+        assert_almost_equal(new_data.data, expected.data)
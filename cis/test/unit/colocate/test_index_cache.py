@@ -0,0 +1,123 @@
+"""
+Tests the on-disk cache of collocation indexes
+"""
+import datetime as dt
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from nose.tools import eq_
+from numpy.testing import assert_equal
+import numpy as np
+
+from cis.collocation import data_index, index_cache
+from cis.collocation.col_implementations import GeneralUngriddedCollocator, SepConstraintKdtree, moments, \
+    BinnedCubeCellOnlyConstraint, make_coord_map
+from cis.collocation.haversinedistancekdtreeindex import HaversineDistanceKDTreeIndex
+from cis.collocation.kdtree import HaversineDistanceKDTree
+from cis.data_io.hyperpoint import HyperPoint
+from cis.data_io.ungridded_data import UngriddedData
+from cis.test.util import mock
+
+
+class TestIndexCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _collocate(self, data, constraint):
+        sample = UngriddedData.from_points_array(
+            [HyperPoint(lat=1.0, lon=1.0, alt=12.0, t=dt.datetime(1984, 8, 29, 8, 34)),
+             HyperPoint(lat=4.0, lon=4.0, alt=34.0, t=dt.datetime(1984, 8, 30, 8, 34)),
+             HyperPoint(lat=-4.0, lon=-4.0, alt=89.0, t=dt.datetime(1984, 9, 1, 8, 34))])
+        return GeneralUngriddedCollocator().collocate(sample, data, constraint, moments())
+
+    def test_cache_is_disabled_by_default(self):
+        with patch.dict(os.environ, {index_cache.ENV_CACHE_DIR: ''}):
+            eq_(index_cache.get_cache_dir(), None)
+        eq_(index_cache.get_cache_dir(self.cache_dir), self.cache_dir)
+
+    def test_cache_directory_can_be_set_by_the_environment(self):
+        with patch.dict(os.environ, {index_cache.ENV_CACHE_DIR: self.cache_dir}):
+            eq_(index_cache.get_cache_dir(), self.cache_dir)
+
+    def test_cache_key_depends_on_the_values_and_parameters(self):
+        key = index_cache.make_key('index', [np.arange(5.0)], log=False)
+        eq_(key, index_cache.make_key('index', [np.arange(5.0)], log=False))
+        assert key != index_cache.make_key('index', [np.arange(5.0)], log=True)
+        assert key != index_cache.make_key('index', [np.arange(1.0, 6.0)], log=False)
+        assert key != index_cache.make_key('other_index', [np.arange(5.0)], log=False)
+
+    def test_haversine_tree_recreated_from_arrays_gives_the_same_results(self):
+        points = np.column_stack((np.linspace(-80, 80, 200), np.linspace(-170, 170, 200) % 360 - 180))
+        tree = HaversineDistanceKDTree(points, leafsize=4)
+        copy = HaversineDistanceKDTree.from_arrays(tree.get_arrays())
+        queries = [[0.0, 0.0], [45.0, 100.0], [-60.0, -30.0]]
+        assert_equal(copy.query(queries)[1], tree.query(queries)[1])
+        assert_equal(copy.query_ball_point_csr(queries, 2000), tree.query_ball_point_csr(queries, 2000))
+
+    def test_haversine_tree_recreated_from_arrays_uses_the_stored_radians(self):
+        points = np.column_stack((np.linspace(-80, 80, 200), np.linspace(-170, 170, 200) % 360 - 180))
+        arrays = HaversineDistanceKDTree(points, leafsize=4).get_arrays()
+        with patch('numpy.radians', side_effect=AssertionError("The data shouldn't be converted again")):
+            copy = HaversineDistanceKDTree.from_arrays(arrays)
+        assert copy.data_radians is arrays['data_radians']
+
+    def test_collocation_with_kd_tree_uses_cached_index(self):
+        data = mock.make_regular_4d_ungridded_data()
+        expected = self._collocate(data, SepConstraintKdtree('500km', index_cache_dir=self.cache_dir))
+        eq_(len(os.listdir(self.cache_dir)), 1)
+
+        with patch.object(HaversineDistanceKDTreeIndex, 'index_data') as index_data:
+            output = self._collocate(data, SepConstraintKdtree('500km', index_cache_dir=self.cache_dir))
+            eq_(index_data.call_count, 0)
+        for expected_var, output_var in zip(expected, output):
+            assert_equal(output_var.data, expected_var.data)
+
+    def test_collocation_with_sorted_index_uses_cached_index(self):
+        data = mock.make_regular_4d_ungridded_data()
+        expected = self._collocate(data, SepConstraintKdtree(t_sep='P1D', index_cache_dir=self.cache_dir))
+
+        with patch.object(data_index.SortedCoordinateIndex, 'index_data') as index_data:
+            output = self._collocate(data, SepConstraintKdtree(t_sep='P1D', index_cache_dir=self.cache_dir))
+            eq_(index_data.call_count, 0)
+        for expected_var, output_var in zip(expected, output):
+            assert_equal(output_var.data, expected_var.data)
+
+    def test_different_coordinates_are_not_read_from_the_cache(self):
+        self._collocate(mock.make_regular_4d_ungridded_data(),
+                        SepConstraintKdtree('500km', index_cache_dir=self.cache_dir))
+        self._collocate(mock.make_regular_2d_ungridded_data(lat_dim_length=6),
+                        SepConstraintKdtree('500km', index_cache_dir=self.cache_dir))
+        eq_(len(os.listdir(self.cache_dir)), 2)
+
+    def test_cartesian_index_is_not_cached(self):
+        self._collocate(mock.make_regular_4d_ungridded_data(),
+                        SepConstraintKdtree('500km', index_type='cartesian', index_cache_dir=self.cache_dir))
+        eq_(os.listdir(self.cache_dir), [])
+
+    def test_grid_cell_bin_index_is_cached(self):
+        sample_cube = mock.make_square_5x3_2d_cube_with_time(offset=0, time_offset=0)
+        data = mock.make_regular_4d_ungridded_data()
+        coord_map = make_coord_map(sample_cube, data)
+        coords = sample_cube.coords()
+        for coord in coords:
+            if not coord.has_bounds():
+                coord.guess_bounds()
+
+        expected = BinnedCubeCellOnlyConstraint()
+        data_index.create_indexes(expected, coords, data.get_non_masked_points(), coord_map)
+        with patch.dict(os.environ, {index_cache.ENV_CACHE_DIR: self.cache_dir}):
+            data_index.create_indexes(BinnedCubeCellOnlyConstraint(), coords, data.get_non_masked_points(), coord_map)
+            constraint = BinnedCubeCellOnlyConstraint()
+            with patch.object(data_index.GridCellBinIndexInSlices, 'index_data') as index_data:
+                data_index.create_indexes(constraint, coords, data.get_non_masked_points(), coord_map)
+                eq_(index_data.call_count, 0)
+
+        eq_(len(os.listdir(self.cache_dir)), 1)
+        assert_equal(list(constraint.grid_cell_bin_index_slices.get_iterator()),
+                     list(expected.grid_cell_bin_index_slices.get_iterator()))
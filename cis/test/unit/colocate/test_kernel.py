@@ -373,5 +373,109 @@ class TestMean(unittest.TestCase):
         eq_(new_data.data[0], 25.5)
 
 
+class TestSegmentedKernels(unittest.TestCase):
+    def setUp(self):
+        self.values = np.array([1.0, 2.0, 4.0, 7.0, 3.0, 5.0])
+        # Segments are [1, 2, 4], [], [7], [3, 5]
+        self.offsets = np.array([0, 3, 3, 4, 6])
+
+    def _check_matches_data_only_kernel(self, kernel):
+        result = kernel.get_values_for_segments(self.values, self.offsets)
+        eq_(result.shape, (kernel.return_size, 4))
+        assert np.all(np.isnan(result[:, 1]))
+        for i in [0, 2, 3]:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                expected = kernel.get_value_for_data_only(self.values[self.offsets[i]:self.offsets[i + 1]])
+            assert_almost_equal(result[:, i], np.atleast_1d(expected))
+
+    def test_segmented_kernels_match_data_only_kernels(self):
+        from cis.collocation.col_implementations import mean, min, max, sum, moments
+        for kernel in [mean(), min(), max(), sum(), moments()]:
+            self._check_matches_data_only_kernel(kernel)
+
+    def test_segmented_stddev_is_nan_for_a_single_value(self):
+        from cis.collocation.col_implementations import stddev
+        result = stddev().get_values_for_segments(self.values, self.offsets)
+        assert_almost_equal(result[0, [0, 3]], [np.std([1.0, 2.0, 4.0], ddof=1), np.std([3.0, 5.0], ddof=1)])
+        assert np.isnan(result[0, 2])
+
+    def test_default_segmented_kernel_calls_data_only_kernel_on_each_segment(self):
+        from cis.collocation.col_framework import AbstractDataOnlyKernel
+
+        class TestOnlyMedianKernel(AbstractDataOnlyKernel):
+            def get_value_for_data_only(self, values):
+                return np.median(values)
+
+        result = TestOnlyMedianKernel().get_values_for_segments(self.values, self.offsets)
+        assert_almost_equal(result, [[2.0, np.nan, 7.0, 4.0]])
+
+    def test_collocation_applies_kernels_without_their_own_segment_method_to_each_point(self):
+        from cis.collocation.col_implementations import GeneralUngriddedCollocator, mean, SepConstraintKdtree
+        import datetime as dt
+        import pandas as pd
+
+        class TestOnlyLargestKernel(mean):
+            # Overrides the reduction but inherits mean's segment method, which mustn't be used in its place
+            def get_value_for_data_only(self, values):
+                assert isinstance(values, pd.Series)
+                return values.max()
+
+        ug_data = mock.make_regular_4d_ungridded_data()
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=1.0, lon=1.0, alt=12.0, t=dt.datetime(1984, 8, 29, 8, 34))])
+        new_data = GeneralUngriddedCollocator().collocate(sample_points, ug_data, SepConstraintKdtree(),
+                                                          TestOnlyLargestKernel())[0]
+        eq_(new_data.data[0], 50.0)
+
+
+class TestNearestNeighbourKernelsOnSegments(unittest.TestCase):
+    def setUp(self):
+        import pandas as pd
+        self.sample_points = pd.DataFrame({'latitude': [0.0, 10.0, 0.0, 5.0],
+                                           'longitude': [0.0, 10.0, 0.0, 5.0],
+                                           'altitude': [10.0, 20.0, 30.0, 40.0],
+                                           'air_pressure': [10.0, 20.0, 30.0, 40.0],
+                                           'time': [1.0, 2.0, 3.0, 4.0]})
+        self.data_points = pd.DataFrame({'latitude': [1.0, -1.0, 2.0, 9.0, 4.0, 6.0],
+                                         'longitude': [1.0, -1.0, 2.0, 9.0, 4.0, 6.0],
+                                         'altitude': [12.0, 8.0, 15.0, 21.0, 35.0, 45.0],
+                                         'air_pressure': [5.0, 19.0, 12.0, 21.0, 35.0, 45.0],
+                                         'time': [1.5, 0.5, 1.0, 2.5, 3.5, 4.5],
+                                         'vals': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+        # Segments are [0, 1, 2], [3], [], [4, 5]
+        self.offsets = np.array([0, 3, 4, 4, 6])
+        self.indices = np.array([0, 1, 2, 3, 4, 5])
+
+    def _check_matches_get_value(self, kernel):
+        result = kernel.get_values_for_neighbours(self.sample_points, self.data_points, self.offsets, self.indices)
+        eq_(result.shape, (1, 4))
+        assert np.isnan(result[0, 2])
+        for i in [0, 1, 3]:
+            expected = kernel.get_value(self.sample_points.iloc[i],
+                                        self.data_points.iloc[self.indices[self.offsets[i]:self.offsets[i + 1]]])
+            eq_(result[0, i], expected)
+
+    def test_segmented_nearest_neighbour_kernels_match_get_value(self):
+        from cis.collocation.col_implementations import nn_horizontal, nn_altitude, nn_pressure, nn_time
+        for kernel in [nn_horizontal(), nn_altitude(), nn_pressure(), nn_time()]:
+            self._check_matches_get_value(kernel)
+
+    def test_segmented_nearest_neighbour_chooses_the_first_of_equidistant_points(self):
+        from cis.collocation.col_implementations import nn_altitude, nn_time
+        # The last segment has points at equal distances either side of the sample point in time and altitude, as
+        # does the first segment in altitude
+        assert_equal(nn_time().get_values_for_neighbours(self.sample_points, self.data_points, self.offsets,
+                                                         self.indices)[0, [0, 3]], [3.0, 5.0])
+        assert_equal(nn_altitude().get_values_for_neighbours(self.sample_points, self.data_points, self.offsets,
+                                                             self.indices)[0, [0, 3]], [1.0, 5.0])
+
+    def test_segmented_nearest_neighbour_in_pressure_uses_the_pressure_ratio(self):
+        from cis.collocation.col_implementations import nn_pressure
+        result = nn_pressure().get_values_for_neighbours(self.sample_points, self.data_points, self.offsets,
+                                                         self.indices)
+        # 10 hPa is nearer to 12 hPa than to 5 hPa or 19 hPa
+        eq_(result[0, 0], 3.0)
+
+
 if __name__ == '__main__':
     unittest.main()
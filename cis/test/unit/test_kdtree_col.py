@@ -1,17 +1,18 @@
 import datetime as dt
+from unittest import TestCase
 import pandas as pd
 
 from hamcrest import *
 from nose.tools import istest, eq_
 import numpy as np
-from cis.collocation.kdtree import KDTree
+from cis.collocation.kdtree import HaversineDistanceKDTree, UnitSphereKDTree, haversine
 from cis.time_util import cis_standard_time_unit
 import cis.data_io.gridded_data as gridded_data
 from cis.data_io.hyperpoint import HyperPoint, HyperPointList
 from cis.data_io.ungridded_data import UngriddedData
 from cis.test.util import mock
 from cis.collocation.col_implementations import (GeneralUngriddedCollocator, nn_horizontal_only, DummyConstraint,
-                                                 SepConstraintKdtree, make_coord_map)
+                                                 SepConstraintKdtree, make_coord_map, mean)
 from cis.collocation.haversinedistancekdtreeindex import HaversineDistanceKDTreeIndex
 
 
@@ -203,10 +204,10 @@ class TestSepConstraint(object):
         eq_(ref_vals.size, new_vals.size)
         assert (np.equal(ref_vals, new_vals).all())
 
-    def get_max_depth(self, node, depth):
-        if isinstance(node, KDTree.leafnode):
+    def get_max_depth(self, tree, node, depth):
+        if tree.children[node, 0] < 0:
             return depth
-        return max(self.get_max_depth(node.less, depth + 1), self.get_max_depth(node.greater, depth + 1))
+        return max(self.get_max_depth(tree, child, depth + 1) for child in tree.children[node])
 
     @istest
     def test_horizontal_constraint_in_2d_when_lats_are_the_same_produces_a_balanced_tree(self):
@@ -222,11 +223,134 @@ class TestSepConstraint(object):
         index = HaversineDistanceKDTreeIndex()
         index.index_data(sample_points, ug_data_points, coord_map, leafsize=2)
 
-        depth = self.get_max_depth(index.index.tree, 0)
+        depth = self.get_max_depth(index.index, 0, 0)
 
         assert_that(depth, is_(2), "Depth is 2, there are three unique values -10, 0, 10")
 
 
+class TestHaversineDistanceKDTree(TestCase):
+    tree_class = HaversineDistanceKDTree
+
+    def setUp(self):
+        np.random.seed(42)
+        self.data = np.column_stack((np.random.uniform(-90, 90, 500), np.random.uniform(-180, 180, 500)))
+        # Include points either side of the dateline and near the poles
+        self.points = np.vstack((np.column_stack((np.random.uniform(-90, 90, 50), np.random.uniform(-180, 180, 50))),
+                                 [[0.0, 179.9], [0.0, -179.9], [89.9, 0.0], [-89.9, 45.0]]))
+
+    def get_distances(self, mask=None):
+        distances = np.array([[haversine(point, datum) for datum in self.data] for point in self.points])
+        if mask is not None:
+            distances[:, mask] = np.inf
+        return distances
+
+    @istest
+    def test_query_ball_point_matches_brute_force(self):
+        mask = np.zeros(len(self.data), dtype=bool)
+        mask[::7] = True
+        tree = self.tree_class(self.data, leafsize=4, mask=mask)
+        distances = self.get_distances(mask)
+
+        neighbours = tree.query_ball_point(self.points, 2000)
+
+        for point_neighbours, point_distances in zip(neighbours, distances):
+            eq_(point_neighbours, np.flatnonzero(point_distances <= 2000).tolist())
+
+    @istest
+    def test_query_ball_point_csr_matches_query_ball_point(self):
+        tree = self.tree_class(self.data, leafsize=4)
+
+        offsets, indices = tree.query_ball_point_csr(self.points, 1000)
+
+        for i, point_neighbours in enumerate(tree.query_ball_point(self.points, 1000)):
+            eq_(indices[offsets[i]:offsets[i + 1]].tolist(), point_neighbours)
+
+    @istest
+    def test_query_ball_tree_matches_brute_force(self):
+        tree = self.tree_class(self.data, leafsize=4)
+        distances = self.get_distances()
+
+        neighbours = self.tree_class(self.points).query_ball_tree(tree, 500)
+
+        for point_neighbours, point_distances in zip(neighbours, distances):
+            eq_(point_neighbours, np.flatnonzero(point_distances <= 500).tolist())
+
+    @istest
+    def test_query_nearest_neighbours_matches_brute_force(self):
+        tree = self.tree_class(self.data, leafsize=4)
+        distances = self.get_distances()
+
+        d, i = tree.query(self.points, k=3)
+
+        assert np.allclose(d, np.sort(distances, axis=1)[:, :3])
+        assert np.allclose(distances[np.arange(len(self.points))[:, np.newaxis], i], d)
+
+    @istest
+    def test_query_single_point_with_upper_bound(self):
+        tree = self.tree_class(self.data, leafsize=4)
+        distances = self.get_distances()
+
+        d, i = tree.query(self.points[0], distance_upper_bound=1.0)
+        eq_(d, np.inf)
+        eq_(i, len(self.data))
+
+        d, i = tree.query(self.points[0])
+        eq_(i, np.argmin(distances[0]))
+
+    @istest
+    def test_query_when_all_points_masked(self):
+        tree = self.tree_class(self.data, mask=np.ones(len(self.data), dtype=bool))
+
+        d, i = tree.query(self.points)
+
+        assert np.all(np.isinf(d))
+        assert np.all(i == len(self.data))
+        eq_(tree.query_ball_point(self.points[0], 20000), [])
+
+
+class TestUnitSphereKDTree(TestHaversineDistanceKDTree):
+    tree_class = UnitSphereKDTree
+
+    @istest
+    def test_box_collocation_with_cartesian_index_matches_haversine_index(self):
+        ug_data = mock.make_regular_2d_ungridded_data(lat_dim_length=19, lat_min=-90, lat_max=90,
+                                                      lon_dim_length=37, lon_min=-180, lon_max=180)
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.5, lon=179.5), HyperPoint(lat=-0.5, lon=-179.5), HyperPoint(lat=89.5, lon=12.0),
+             HyperPoint(lat=-20.0, lon=33.0)])
+        col = GeneralUngriddedCollocator()
+
+        expected = col.collocate(sample_points, ug_data, SepConstraintKdtree(h_sep=1500), mean())[0]
+        actual = col.collocate(sample_points, ug_data, SepConstraintKdtree(h_sep=1500, index_type='cartesian'),
+                               mean())[0]
+
+        assert np.allclose(actual.data, expected.data)
+
+
+class TestHaversineDistanceKDTreeIndex(TestCase):
+    def setUp(self):
+        self.data = pd.DataFrame({'latitude': np.linspace(-60, 60, 50), 'longitude': np.linspace(-170, 170, 50)})
+        # A few station locations, repeated in an arbitrary order
+        stations = np.array([[10.0, 20.0], [-30.0, -60.0], [45.0, 100.0]])
+        self.sample = pd.DataFrame(stations[[2, 0, 0, 1, 2, 2, 0]], columns=['latitude', 'longitude'])
+
+    def test_repeated_sample_locations_find_the_same_points_within_distance(self):
+        index = HaversineDistanceKDTreeIndex()
+        index.index_data(None, self.data, None)
+
+        offsets, indices = index.find_points_within_distance_sample_csr(self.sample, 3000)
+
+        expected_offsets, expected_indices = index.index.query_ball_point_csr(self.sample.values, 3000)
+        eq_(offsets.tolist(), expected_offsets.tolist())
+        eq_(indices.tolist(), expected_indices.tolist())
+
+    def test_repeated_sample_locations_find_the_same_nearest_points(self):
+        index = HaversineDistanceKDTreeIndex()
+        index.index_data(None, self.data, None)
+
+        eq_(index.find_nearest_point(self.sample).tolist(), index.index.query(self.sample.values)[1].tolist())
+
+
 class TestSepConstraintWithoutHorizontalSeparation(object):
     """Tests that SepConstraintKdtree behaves as an unoptimized constraint for non-spatial separations
     if the spatial separation parameter is not specified.
@@ -307,6 +431,60 @@ class TestSepConstraintWithoutHorizontalSeparation(object):
         assert (np.equal(ref_vals, new_vals).all())
 
 
+class TestSepConstraintWithSortedCoordinateIndex(object):
+    """Tests that indexing the data on time, altitude or pressure when there is no horizontal separation gives the same
+    result as an exhaustive search.
+    """
+
+    def get_neighbours(self, constraint, data_points, sample_points, use_index):
+        from cis.collocation import data_index
+        if use_index:
+            data_index.create_indexes(constraint, sample_points, data_points, None)
+        else:
+            del constraint.sorted_coordinate_index
+        return constraint.get_neighbour_indices(data_points, sample_points)
+
+    @istest
+    def test_neighbours_match_exhaustive_search(self):
+        import datetime as dt
+        data_points = mock.make_regular_4d_ungridded_data().as_data_frame(time_index=False, name='vals')
+        sample_points = UngriddedData.from_points_array(
+            [HyperPoint(lat=0.0, lon=0.0, alt=alt, pres=pres, t=time)
+             for alt, pres, time in [(50.0, 24.0, dt.datetime(1984, 8, 29)), (3.0, 4.0, dt.datetime(1984, 8, 27, 12)),
+                                     (95.0, 90.0, dt.datetime(1984, 9, 1)), (500.0, 1000.0, dt.datetime(1985, 1, 1))]]
+        ).as_data_frame(time_index=False, name='vals')
+
+        for kwargs in [{'t_sep': 'PT12H'}, {'t_sep': 'P1D', 'a_sep': 15}, {'a_sep': 15}, {'p_sep': 2},
+                       {'a_sep': 25, 'p_sep': 1.5}]:
+            constraint = SepConstraintKdtree(**kwargs)
+            # Use small blocks to check that splitting the sample points up doesn't change anything
+            constraint.max_pairs_per_block = 7
+            offsets, indices = self.get_neighbours(constraint, data_points, sample_points, True)
+            expected_offsets, expected_indices = self.get_neighbours(SepConstraintKdtree(**kwargs), data_points,
+                                                                     sample_points, False)
+
+            assert_that(offsets.tolist(), is_(expected_offsets.tolist()), str(kwargs))
+            assert_that(indices.tolist(), is_(expected_indices.tolist()), str(kwargs))
+
+    @istest
+    def test_time_constraint_in_4d_with_index(self):
+        from cis.collocation import data_index
+        import datetime as dt
+
+        ug_data_points = mock.make_regular_4d_ungridded_data().as_data_frame(time_index=False, name='vals')
+        sample_point = pd.Series({'longitude': 0.0, 'latitude': 0.0, 'altitude': 50.0,
+                                  'time': cis_standard_time_unit.date2num(dt.datetime(1984, 8, 29, 8, 34))})
+        constraint = SepConstraintKdtree(t_sep='P1D')
+        data_index.create_indexes(constraint, None, ug_data_points, None)
+
+        ref_vals = np.array([3., 4., 8., 9., 13., 14., 18., 19., 23., 24., 28., 29., 33., 34., 38., 39., 43., 44., 48.,
+                             49.])
+
+        new_points = constraint.constrain_points(sample_point, ug_data_points)
+
+        assert np.array_equal(new_points.vals, ref_vals)
+
+
 if __name__ == '__main__':
     import nose
 
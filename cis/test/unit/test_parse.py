@@ -614,6 +614,25 @@ class TestParseAggregate(ParseTestFiles):
             args = ['aggregate', 'var1:%s' % self.escaped_single_valid_file, lim]
             parse_args(args)
 
+    def test_GIVEN_stream_option_WHEN_aggregate_THEN_parsed_OK(self):
+        args = ['aggregate', 'var1:%s' % self.escaped_single_valid_file, 'x=[-10,10,1]']
+        assert_that(parse_args(args).stream, is_(False))
+        assert_that(parse_args(args + ['--stream']).stream, is_(True))
+
+    def test_GIVEN_sparse_option_WHEN_aggregate_THEN_parsed_OK(self):
+        args = ['aggregate', 'var1:%s' % self.escaped_single_valid_file, 'x=[-10,10,1]']
+        assert_that(parse_args(args).sparse, is_(False))
+        assert_that(parse_args(args + ['--sparse']).sparse, is_(True))
+
+    def test_GIVEN_sparse_and_stream_options_WHEN_aggregate_THEN_raises_error(self):
+        args = ['aggregate', 'var1:%s' % self.escaped_single_valid_file, 'x=[-10,10,1]', '--sparse', '--stream']
+        try:
+            parse_args(args)
+            assert False
+        except SystemExit as e:
+            if e.code != 2:
+                raise
+
     def test_GIVEN_mixed_limits_valid_WHEN_aggregate_THEN_parsed_OK(self):
         limits = ['x=[-180.0,180.0,0.5],y=[-80.0,10.0,0.1]',
                   'x=[-180.0,180.0,0.5],y=[-80.0,10.0,0.1],t=[2008-05-12,2008-05-12,PT15M]']
@@ -621,6 +640,11 @@ class TestParseAggregate(ParseTestFiles):
             args = ['aggregate', 'var1:%s' % self.escaped_single_valid_file, lim]
             parse_args(args)
 
+    def test_GIVEN_calendar_time_step_WHEN_aggregate_THEN_parsed_OK(self):
+        for step in ['month', 'SEASON', 'day_of_year', 'hour_of_day']:
+            args = ['aggregate', 'var1:%s' % self.escaped_single_valid_file, 't=[2008-01-01,2009-01-01,%s]' % step]
+            assert_that(parse_args(args).grid['t'].step, is_(step.lower()))
+
     def test_output_file_matches_an_input_file(self):
         from cis.parse import _output_file_matches_an_input_file
         from argparse import Namespace
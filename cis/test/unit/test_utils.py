@@ -292,6 +292,12 @@ class TestUtils(unittest.TestCase):
         conc = concatenate(arrays)
         assert numpy.ma.count_masked(conc) == 1
 
+    def test_GIVEN_csr_rows_WHEN_take_repeated_rows_THEN_rows_are_copied_in_order(self):
+        offsets, indices = take_csr_rows(numpy.array([0, 2, 2, 5]), numpy.array([4, 7, 1, 2, 3]),
+                                         numpy.array([2, 1, 0, 2]))
+        eq_(offsets.tolist(), [0, 3, 3, 5, 8])
+        eq_(indices.tolist(), [1, 2, 3, 4, 7, 1, 2, 3])
+
 
 class TestFindLongitudeWrapStart(unittest.TestCase):
 
@@ -1117,6 +1117,40 @@ def make_regular_4d_ungridded_data():
                                         units="kg m-2 s-1", missing_value=-999), coords)
 
 
+def make_random_ungridded_data(seed=0, n=400, lat_range=(-90, 90), lon_range=(-180, 180), altitude_range=None,
+                               time_range=None):
+    """
+    Makes an ungridded data object of normally distributed (mean 10, standard deviation 2) rain values at uniformly
+    distributed random points, which is the same for the same arguments.
+
+    :param seed: seed of the random numbers
+    :param n: number of points
+    :param lat_range: (min, max) latitude of the points
+    :param lon_range: (min, max) longitude of the points
+    :param altitude_range: if given, the (min, max) altitude of the points in metres
+    :param time_range: if given, the (start, end) datetimes of the points
+    :return: UngriddedData object as specified
+    """
+    import numpy as np
+    from cis.data_io.Coord import CoordList, Coord
+    from cis.data_io.ungridded_data import UngriddedData, Metadata
+    from cis.time_util import cis_standard_time_unit
+
+    random = np.random.RandomState(seed)
+    lat = random.uniform(lat_range[0], lat_range[1], n)
+    lon = random.uniform(lon_range[0], lon_range[1], n)
+    coords = CoordList([Coord(lat, Metadata('latitude', units='degrees_north')),
+                        Coord(lon, Metadata('longitude', units='degrees_east'))])
+    if altitude_range is not None:
+        altitude = random.uniform(altitude_range[0], altitude_range[1], n)
+        coords.append(Coord(altitude, Metadata('altitude', units='m')))
+    if time_range is not None:
+        times = random.uniform(*convert_datetime_to_std_time(np.array(time_range)), size=n)
+        coords.append(Coord(times, Metadata('time', standard_name='time', units=str(cis_standard_time_unit))))
+        coords[-1].units = cis_standard_time_unit
+    return UngriddedData(random.normal(10, 2, n), Metadata('rain', long_name='Rain', units='kg m-2'), coords)
+
+
 class ScatterData(object):
     def __init__(self, x, y, data, shape, long_name):
         self.x = x
@@ -135,6 +135,45 @@ def expand_1d_to_2d_array(array, length, axis=0):
     return array_2d
 
 
+def expand_ranges(owners, starts, ends):
+    """
+    Expand a set of half-open [start, end) ranges into the positions they contain, without a Python loop.
+
+    Examples::
+
+        >>> expand_ranges(np.array([0, 1]), np.array([3, 7]), np.array([5, 8]))
+        (array([0, 0, 1]), array([3, 4, 7]))
+
+    :param owners: an array of labels, one for each range
+    :param starts: the start of each range
+    :param ends: the end of each range
+    :return: tuple of arrays (label for each position, position)
+    """
+    counts = ends - starts
+    total = counts.sum()
+    offsets = np.repeat(np.cumsum(counts) - counts - starts, counts)
+    return np.repeat(owners, counts), np.arange(total) - offsets
+
+
+def take_csr_rows(offsets, indices, rows):
+    """
+    Select rows (which may be repeated) of an array of variable length rows in a compressed sparse row layout, where
+    row i is ``indices[offsets[i]:offsets[i + 1]]``.
+
+    Examples::
+
+        >>> take_csr_rows(np.array([0, 2, 3]), np.array([5, 6, 7]), np.array([1, 0, 1]))
+        (array([0, 1, 3, 4]), array([7, 5, 6, 7]))
+
+    :param offsets: the start of each row, and the end of the last row
+    :param indices: the concatenated rows
+    :param rows: the rows to select
+    :return: tuple of arrays (offsets, indices) of the selected rows
+    """
+    starts, ends = offsets[rows], offsets[np.asarray(rows) + 1]
+    _, positions = expand_ranges(rows, starts, ends)
+    return np.concatenate(([0], np.cumsum(ends - starts))), indices[positions]
+
 def create_masked_array_for_missing_data(data, missing_val):
     import numpy.ma as ma
     return ma.array(data, mask=data == missing_val, fill_value=missing_val)